@@ -0,0 +1,42 @@
+import argparse
+import json
+
+# Side by side comparison of two benchmarks.graph_load --json runs:
+#   python3 -m benchmarks.compare before.json after.json
+
+def change(before, after):
+    if not before:
+        return ""
+    return f"{(after - before) / before * 100:+.1f}%"
+
+def compare(before, after):
+    print(f"*** {before.get('commit')} -> {after.get('commit')}")
+    after_levels = {level["concurrency"]: level for level in after["levels"]}
+    for old in before["levels"]:
+        new = after_levels.get(old["concurrency"])
+        if new is None:
+            continue
+        print(f"    concurrency={old['concurrency']}")
+        rows = [("rps", old["rps"], new["rps"])]
+        for metric in ("latency", "ttft"):
+            for p in ("p50_ms", "p95_ms", "p99_ms"):
+                if p in old[metric] and p in new[metric]:
+                    rows.append((f"{metric} {p}", old[metric][p], new[metric][p]))
+        rows.append(("peak_rss_mb", old["peak_rss_mb"], new["peak_rss_mb"]))
+        rows.append(("peak_os_threads", old["peak_os_threads"], new["peak_os_threads"]))
+        rows.append(("errors", old["errors"], new["errors"]))
+        for name, old_value, new_value in rows:
+            print(f"      {name:<18} {old_value:>10.1f} {new_value:>10.1f} {change(old_value, new_value):>8}")
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compare two graph_load benchmark runs')
+    parser.add_argument("before", type=str)
+    parser.add_argument("after", type=str)
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    compare(before, after)
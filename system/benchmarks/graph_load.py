@@ -0,0 +1,365 @@
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from dataclasses import dataclass, field
+import numpy as np
+
+# End-to-end load benchmark of RagGraph against the local stub backend
+# (rag/stub_server.py, started as a subprocess so it doesn't share our GIL,
+# threads or RSS). Reports requests/s, p50/p95/p99 latency, time to first
+# token, per-node latency, peak RSS and thread counts per concurrency level:
+#   python3 -m benchmarks.graph_load --graph hal9004_rag --concurrency 1 8 32 --json run.json
+# Compare two runs with: python3 -m benchmarks.compare before.json after.json
+
+PROMPTS = [
+    "How is the weather in Aachen today?",
+    "Do you remember the name of the cool guitar player I told you about?",
+    "How are you doing?",
+    "What are the latest news about the Champions League?",
+    "Hey, tell me something nice"
+]
+
+MEMORIES = [
+    "The cool guitar player I told you about is called Jimi",
+    "My sister lives in Aachen",
+    "I like the band Radiohead a lot"
+]
+
+@dataclass
+class Sample:
+    latency: float
+    ttft: float
+    nodes: dict = field(default_factory=dict)
+    error: str = None
+
+def start_stub(args):
+    # the stub must be up before rag.models reads RAG_LOCAL_BASE_URL
+    command = [
+        sys.executable, "-m", "rag.stub_server",
+        "--port", str(args.stub_port),
+        "--profile", args.profile,
+        "--seed", "0"
+    ]
+    for flag, value in (
+            ("--ttft", args.ttft),
+            ("--tps", args.tps),
+            ("--answer-tokens", args.answer_tokens),
+            ("--json-tail", args.stub_json_tail),
+            ("--rpm", args.stub_rpm),
+            ("--max-concurrency", args.stub_max_concurrency)
+        ):
+        if value is not None:
+            command += [flag, str(value)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    base_url = f"http://127.0.0.1:{args.stub_port}/v1"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(base_url + "/models", timeout=1).read()
+            return process, base_url
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise Exception(f"Stub backend did not start on {base_url}")
+
+def stub_search(latency):
+    def search(search_query):
+        time.sleep(latency)
+        return {
+            "search_metadata": {"id": "benchmark"},
+            "answer_box": {"title": search_query, "snippet": "Sunny, 21 degrees"},
+            "organic_results": [
+                {"title": f"Result {i}", "link": f"https://example.com/{i}", "snippet": f"Snippet {i} about {search_query}"}
+                for i in range(10)
+            ]
+        }
+    return search
+
+def build_graph(args):
+    if args.graph == "wide":
+        from benchmarks.graphs import wide_graph
+        return wide_graph(args.size)
+    if args.graph == "deep":
+        from benchmarks.graphs import deep_graph
+        return deep_graph(args.size)
+    from rag.agents.hal9004_rag import get_graph
+    from rag.nodes import WebSearchLookup, MemoryRetrievalNode
+    from rag.memory import MemoryStore
+    graph = get_graph(fused_extraction=args.graph == "hal9004_rag_fused")
+    store = MemoryStore()
+    store.add(MEMORIES)
+    for node in graph.nodes:
+        if args.policy is not None and node.policy == "adaptive":
+            node.policy = args.policy
+        # caches would turn the benchmark into a cache benchmark
+        if not args.keep_caches:
+            for attribute in ("cache", "semantic_cache", "search_cache"):
+                if getattr(node, attribute, None) is not None:
+                    setattr(node, attribute, None)
+        if args.no_release and getattr(node, "release_fields", None) is not None:
+            node.release_fields = None
+        if isinstance(node, WebSearchLookup) and not args.real_search:
+            node.search = stub_search(args.search_latency)
+        if isinstance(node, MemoryRetrievalNode):
+            node.store = store
+    return graph
+
+def node_latencies(context):
+    results = context.all_results or {}
+    return {name: result.meta["elapsed"] for name, result in results.items() if "elapsed" in result.meta}
+
+def measure(graph, prompt):
+    from rag.abs import NodeContext
+    context = NodeContext(message_history=[], prompt=prompt)
+    start = time.perf_counter()
+    first = None
+    error = None
+    try:
+        for event in graph.stream(context):
+            if first is None and event.kind in ("token", "result"):
+                first = time.perf_counter()
+    except Exception as e:
+        error = repr(e)
+    end = time.perf_counter()
+    return Sample(end - start, (first or end) - start, node_latencies(context), error)
+
+async def ameasure(graph, prompt):
+    from rag.abs import NodeContext
+    context = NodeContext(message_history=[], prompt=prompt)
+    start = time.perf_counter()
+    first = None
+    error = None
+    try:
+        async for event in graph.astream(context):
+            if first is None and event.kind in ("token", "result"):
+                first = time.perf_counter()
+    except Exception as e:
+        error = repr(e)
+    end = time.perf_counter()
+    return Sample(end - start, (first or end) - start, node_latencies(context), error)
+
+def run_sync(graph, concurrency, requests):
+    counter = itertools.count()
+    samples = []
+
+    def worker():
+        while (index := next(counter)) < requests:
+            samples.append(measure(graph, PROMPTS[index % len(PROMPTS)]))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    return samples
+
+async def arun_load(graph, concurrency, requests):
+    from rag.models import CLIENTS
+    counter = itertools.count()
+    samples = []
+
+    async def worker():
+        while (index := next(counter)) < requests:
+            samples.append(await ameasure(graph, PROMPTS[index % len(PROMPTS)]))
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    await CLIENTS.aclose()
+    return samples
+
+def run_async(graph, concurrency, requests):
+    return asyncio.run(arun_load(graph, concurrency, requests))
+
+class ThreadSampler:
+    # peak thread counts while a level runs, python threads and OS threads
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_python = 0
+        self.peak_os = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def os_threads(self):
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("Threads:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return 0
+
+    def sample(self):
+        while not self.stopped.is_set():
+            self.peak_python = max(self.peak_python, threading.active_count())
+            self.peak_os = max(self.peak_os, self.os_threads())
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def percentiles(values):
+    if len(values) == 0:
+        return {}
+    values = np.array(values) * 1000
+    return {f"p{p}_ms": float(np.percentile(values, p)) for p in (50, 95, 99)}
+
+def quiet_output(verbose: bool):
+    # the engine diagnostics (rag/log.py) would be part of the measured time
+    from rag.log import set_quiet
+    set_quiet(not verbose)
+    if verbose:
+        return contextlib.nullcontext()
+    stack = contextlib.ExitStack()
+    devnull = stack.enter_context(open(os.devnull, "w"))
+    stack.enter_context(contextlib.redirect_stdout(devnull))
+    stack.enter_context(contextlib.redirect_stderr(devnull))
+    return stack
+
+def limiter_metrics():
+    from rag.limits import LIMITERS
+    return LIMITERS.metrics()
+
+def summarize(graph, samples, wall, concurrency, sampler):
+    ok = [sample for sample in samples if sample.error is None]
+    errors = [sample.error for sample in samples if sample.error is not None]
+    nodes = {}
+    for sample in ok:
+        for name, elapsed in sample.nodes.items():
+            nodes.setdefault(name, []).append(elapsed)
+    return {
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": len(errors),
+        "error_examples": sorted(set(errors))[:3],
+        "wall_s": wall,
+        "rps": len(ok) / wall if wall > 0 else 0.0,
+        "latency": percentiles([sample.latency for sample in ok]),
+        "ttft": percentiles([sample.ttft for sample in ok]),
+        "nodes": {name: {"count": len(values), **percentiles(values)} for name, values in sorted(nodes.items())},
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_python_threads": sampler.peak_python,
+        "peak_os_threads": sampler.peak_os,
+        # cumulative over the levels so far
+        "limiters": limiter_metrics(),
+        "policy": graph.policy.snapshot()
+    }
+
+def print_level(level):
+    latency, ttft = level["latency"], level["ttft"]
+    print(f"*** concurrency={level['concurrency']} requests={level['requests']} errors={level['errors']} "
+          f"rps={level['rps']:.1f} rss={level['peak_rss_mb']:.0f}MB threads={level['peak_python_threads']}/{level['peak_os_threads']}")
+    if latency:
+        print(f"    latency  p50={latency['p50_ms']:.0f}ms p95={latency['p95_ms']:.0f}ms p99={latency['p99_ms']:.0f}ms")
+        print(f"    ttft     p50={ttft['p50_ms']:.0f}ms p95={ttft['p95_ms']:.0f}ms p99={ttft['p99_ms']:.0f}ms")
+    for name, limiter in level["limiters"].items():
+        print(f"    limiter {name}: calls={limiter['calls']} limit={limiter['concurrency_limit']:.1f} peak_queue={limiter['peak_queue_depth']} "
+              f"rate_limited={limiter['rate_limited']} retries={limiter['retries']} errors={limiter['errors']}"
+              + (f" settled={limiter['settled']} unsettled={limiter['unsettled']} correction={limiter['settled_tokens']:.0f}tok"
+                 if limiter["settled"] + limiter["unsettled"] > 0 else ""))
+    for name, usage in level["policy"].items():
+        print(f"    adaptive {name}: hit_rate={usage['hit_rate']:.2f} latency={usage['latency'] * 1000:.0f}ms "
+              f"{'lazy' if usage['lazy'] else 'eager'}")
+    for name, node in level["nodes"].items():
+        print(f"    {name:<22} n={node['count']:<5} p50={node['p50_ms']:.0f}ms p95={node['p95_ms']:.0f}ms")
+    for error in level["error_examples"]:
+        print(f"    error: {error}")
+    for name, entry in level.get("critical_path", {}).items():
+        print(f"    critical {name:<22} n={entry['runs']:<5} wall={entry['mean_wall'] * 1000:.0f}ms "
+              f"queued={entry['mean_queue_wait'] * 1000:.1f}ms")
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='End-to-end throughput and latency benchmark of RagGraph')
+    parser.add_argument("--graph", type=str, default="hal9004_rag", choices=["hal9004_rag", "hal9004_rag_fused", "wide", "deep"])
+    parser.add_argument("--size", type=int, default=8, help='Width or depth of the synthetic graphs')
+    parser.add_argument("--engine", type=str, default="async", choices=["async", "sync"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=100, help='Requests per concurrency level')
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--profile", type=str, default="fast", help='Latency profile of the stub backend')
+    parser.add_argument("--ttft", type=float)
+    parser.add_argument("--tps", type=float)
+    parser.add_argument("--answer-tokens", type=int)
+    parser.add_argument("--stub-rpm", type=float, help='Requests per minute the stub enforces with 429s')
+    parser.add_argument("--stub-max-concurrency", type=int, help='Concurrent requests the stub enforces with 429s')
+    parser.add_argument("--stub-json-tail", type=int, help='Words of a trailing "reasoning" field in the stubs extractor answers')
+    parser.add_argument("--stub-port", type=int, default=8799)
+    parser.add_argument("--no-release", action="store_true", help='Extractors wait for the complete answer instead of releasing fields early')
+    parser.add_argument("--base-url", type=str, help='Use an already running backend instead of starting the stub')
+    parser.add_argument("--search-latency", type=float, default=0.3, help='Latency of the stubbed web search')
+    parser.add_argument("--real-search", action="store_true", help='Call serpapi instead of the stubbed search')
+    parser.add_argument("--keep-caches", action="store_true", help='Leave the completion, semantic and search caches on')
+    parser.add_argument("--policy", type=str, choices=["eager", "lazy", "adaptive"], help='Policy of the adaptive nodes')
+    parser.add_argument("--verbose", action="store_true", help='Keep the engine prints')
+    parser.add_argument("--json", type=str, help='Write the results to this file')
+    parser.add_argument("--trace", type=str, help='Trace the runs, write a Chrome trace of the last level to this file')
+    args = parser.parse_args()
+
+    stub = None
+    if args.base_url:
+        base_url = args.base_url
+    else:
+        stub, base_url = start_stub(args)
+    os.environ["RAG_BACKEND"] = "local"
+    os.environ["RAG_LOCAL_BASE_URL"] = base_url
+
+    try:
+        graph = build_graph(args)
+        if args.trace:
+            from rag.tracing import Tracer
+            graph.tracer = Tracer(max_runs=args.requests)
+        run = run_async if args.engine == "async" else run_sync
+        levels = []
+        for concurrency in args.concurrency:
+            with quiet_output(args.verbose):
+                run(graph, min(concurrency, args.warmup), args.warmup)
+                with ThreadSampler() as sampler:
+                    start = time.perf_counter()
+                    samples = run(graph, concurrency, args.requests)
+                    wall = time.perf_counter() - start
+            level = summarize(graph, samples, wall, concurrency, sampler)
+            if args.trace:
+                level["critical_path"] = graph.tracer.critical_path_report()
+            print_level(level)
+            levels.append(level)
+    finally:
+        if stub is not None:
+            stub.terminate()
+            stub.wait()
+
+    if args.trace:
+        graph.tracer.export_chrome(args.trace)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "args": vars(args),
+                "levels": levels
+            }, f, indent=2)
@@ -0,0 +1,48 @@
+from rag.abs import RagGraph, RagNode, RagEdge, RagNodeResult, NodeContext
+from rag.nodes.llm import LLMNode
+from rag.prompts import PromptTemplate
+
+# Synthetic graphs that isolate the engine: 'wide' fans out to parallel LLM
+# nodes and joins them, 'deep' chains LLM nodes one after another.
+
+class BenchLLMNode(LLMNode):
+    max_tokens = 64
+
+    def compile_prompt(self):
+        return PromptTemplate(f"You are the benchmark node {self.name}, answer the users prompt briefly.")
+
+    def to_result(self, context: NodeContext, completion):
+        return RagNodeResult(
+            node_name=self.name,
+            forward=True,
+            response=completion.content
+        )
+
+class CollectNode(RagNode):
+
+    def run(self, context: NodeContext):
+        return RagNodeResult(
+            node_name=self.name,
+            forward=True,
+            response={name: result.response for name, result in context.parent_results.items()}
+        )
+
+def wide_graph(width: int = 8) -> RagGraph:
+    fan = [BenchLLMNode(f"Fan{i}") for i in range(width)]
+    graph = RagGraph(
+        nodes=[RagNode("StartNode", start_node=True)] + fan + [CollectNode("Collect", end_node=True, join="all")],
+        edges=[RagEdge(start="StartNode", end=node.name) for node in fan]
+            + [RagEdge(start=node.name, end="Collect") for node in fan]
+    )
+    graph.compile(strict=True)
+    return graph
+
+def deep_graph(depth: int = 8) -> RagGraph:
+    steps = [BenchLLMNode(f"Step{i}", end_node=i == depth - 1, stream=i == depth - 1) for i in range(depth)]
+    names = ["StartNode"] + [node.name for node in steps]
+    graph = RagGraph(
+        nodes=[RagNode("StartNode", start_node=True)] + steps,
+        edges=[RagEdge(start=start, end=end) for start, end in zip(names, names[1:])]
+    )
+    graph.compile(strict=True)
+    return graph
@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Cold start cost of the CLI entry points, measured with python -X importtime
+# in fresh interpreters. Reports the import time of each target (without the
+# interpreter startup), the wall time of the process and the packages with the
+# highest self time, and fails (exit code 1) when a target exceeds its budget
+# or loads a heavy dependency it shouldn't:
+#   python3 -m benchmarks.import_time --repeat 5 --json imports.json
+
+SYSTEM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY = ("openai", "httpx", "jsonschema", "serpapi", "numpy", "sounddevice", "pydub", "requests")
+
+TARGETS = {
+    # name -> (statement, heavy modules it may load, default budget in ms)
+    "run_agent": ("import run_agent", (), 150),
+    "serve_agent": ("import serve_agent", (), 150),
+    # storing memories needs the embeddings
+    "remember": ("import remember", ("numpy",), 150),
+    "registry": ("import rag.registry, rag.nodes, rag.agents", (), 100),
+    # building a graph creates the nodes but must not load what they only need to run
+    "build_hal9004_rag": ("from rag.registry import build_agent; build_agent('hal9004_rag')", (), 200),
+    "build_hal9004_rag_fused": ("from rag.registry import build_agent; build_agent('hal9004_rag_fused')", (), 200),
+    "nlp": ("import nlp.continous_reponse, nlp.live_recognize, nlp.live_recognize3, nlp.text_to_speech", (), 150),
+    # a first model call loads the client stack
+    "client": ("from rag.models import CLIENTS, BACKENDS, Backends; CLIENTS.get_client(BACKENDS[Backends.LOCAL])", ("openai", "httpx"), 1000)
+}
+
+MARKER = "import-time-benchmark-start"
+
+def parse_importtime(stderr: str):
+    # "import time: self [us] | cumulative | imported package", nesting by
+    # indentation, only the imports after the marker belong to the target
+    modules = []
+    lines = stderr.splitlines()
+    if MARKER in lines:
+        lines = lines[lines.index(MARKER) + 1:]
+    for line in lines:
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+def measure(statement: str):
+    # runs the statement in a fresh interpreter, returns (import ms, wall ms, self ms per package, loaded modules)
+    probe = f"import sys\nsys.stderr.write('{MARKER}\\n')\n{statement}\nprint(','.join(sorted(sys.modules)))"
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [SYSTEM_DIR, os.getenv("PYTHONPATH")]))}
+    started = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", probe],
+        capture_output=True, text=True, cwd=SYSTEM_DIR, env=env
+    )
+    wall = (time.perf_counter() - started) * 1000
+    if process.returncode != 0:
+        raise RuntimeError(f"{statement!r} failed:\n{process.stderr[-2000:]}")
+    modules = parse_importtime(process.stderr)
+    total = sum(cumulative for _, _, cumulative, depth in modules if depth == 0) / 1000
+    packages = {}
+    for name, self_us, _, _ in modules:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0.0) + self_us / 1000
+    loaded = set(process.stdout.strip().splitlines()[-1].split(","))
+    return total, wall, packages, loaded
+
+def run_target(name, statement, allowed, budget, repeat, top):
+    # warms the .pyc cache, the first run after a change would measure compilation
+    measure(statement)
+    runs = [measure(statement) for _ in range(repeat)]
+    import_ms = statistics.median(run[0] for run in runs)
+    wall_ms = statistics.median(run[1] for run in runs)
+    slowest = sorted(runs[-1][2].items(), key=lambda entry: -entry[1])[:top]
+    heavy = sorted(module for module in HEAVY if module in runs[-1][3])
+    unexpected = [module for module in heavy if module not in allowed]
+    failures = []
+    if budget is not None and import_ms > budget:
+        failures.append(f"import time {import_ms:.0f}ms > budget {budget:.0f}ms")
+    if len(unexpected) > 0:
+        failures.append(f"loads {', '.join(unexpected)}")
+    return {
+        "target": name,
+        "statement": statement,
+        "import_ms": import_ms,
+        "wall_ms": wall_ms,
+        "slowest": [{"package": package, "ms": ms} for package, ms in slowest],
+        "heavy_modules": heavy,
+        "budget_ms": budget,
+        "failures": failures
+    }
+
+def print_result(result):
+    status = "FAIL" if len(result["failures"]) > 0 else "ok"
+    print(f"*** {result['target']}: import={result['import_ms']:.1f}ms wall={result['wall_ms']:.1f}ms "
+          f"budget={result['budget_ms']}ms {status}")
+    print("    slowest: " + ", ".join(f"{entry['package']}={entry['ms']:.1f}ms" for entry in result["slowest"]))
+    if len(result["heavy_modules"]) > 0:
+        print(f"    heavy modules: {', '.join(result['heavy_modules'])}")
+    for failure in result["failures"]:
+        print(f"    FAIL: {failure}")
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Import time benchmark and regression guard of the CLI entry points')
+    parser.add_argument("--targets", type=str, nargs="+", choices=list(TARGETS.keys()), default=list(TARGETS.keys()))
+    parser.add_argument("--repeat", type=int, default=5, help='Runs per target, the median is reported')
+    parser.add_argument("--top", type=int, default=5, help='Packages with the highest self time to list')
+    parser.add_argument("--budget-scale", type=float, default=1.0, help='Multiplies the budgets, e.g. for slow CI machines')
+    parser.add_argument("--no-budget", action="store_true", help='Only check heavy modules, not the time budgets')
+    parser.add_argument("--json", type=str, help='Also write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    for name in args.targets:
+        statement, allowed, budget = TARGETS[name]
+        budget = None if args.no_budget else budget * args.budget_scale
+        result = run_target(name, statement, allowed, budget, args.repeat, args.top)
+        print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2)
+
+    failed = [result["target"] for result in results if len(result["failures"]) > 0]
+    if len(failed) > 0:
+        print(f"*** Import regressions in: {', '.join(failed)}")
+        sys.exit(1)
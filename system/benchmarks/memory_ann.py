@@ -0,0 +1,109 @@
+import argparse
+import json
+import time
+import numpy as np
+from rag.memory import IVFIndex
+
+# Recall@k and query latency of the IVF memory index against exact search.
+# Runs on synthetic clustered unit vectors so 10^7 rows fit without an embedder:
+#   python3 -m benchmarks.memory_ann --sizes 10000 100000 1000000 --nprobe 1 4 8 16
+
+def make_vectors(n, dim, centers, rng, chunk=1 << 20):
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, chunk):
+        size = min(chunk, n - start)
+        rows = centers[rng.integers(len(centers), size=size)]
+        rows = rows + (0.6 / np.sqrt(dim)) * rng.standard_normal((size, dim), dtype=np.float32)
+        vectors[start:start + size] = rows / np.linalg.norm(rows, axis=1, keepdims=True)
+    return vectors
+
+def exact_top_k(vectors, query, k):
+    scores = vectors @ query
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+def percentiles(latencies):
+    latencies = np.array(latencies) * 1000
+    return {"p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99))}
+
+def run_size(n, args, rng):
+    centers = rng.standard_normal((max(16, n // 1000), args.dim), dtype=np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    vectors = make_vectors(n, args.dim, centers, rng)
+    queries = make_vectors(args.queries, args.dim, centers, rng)
+
+    exact_latencies = []
+    truth = []
+    for query in queries:
+        start = time.perf_counter()
+        truth.append(exact_top_k(vectors, query, args.k))
+        exact_latencies.append(time.perf_counter() - start)
+
+    nlist = args.nlist or max(1, int(4 * np.sqrt(n)))
+    index = IVFIndex(args.dim, nlist=nlist)
+    start = time.perf_counter()
+    index.train(vectors)
+    train_time = time.perf_counter() - start
+    # incremental inserts, the way MemoryStore.add feeds the index
+    start = time.perf_counter()
+    for offset in range(0, n, args.batch):
+        index.add(vectors[offset:offset + args.batch], np.arange(offset, min(offset + args.batch, n)))
+    add_time = time.perf_counter() - start
+
+    result = {
+        "n": n,
+        "dim": args.dim,
+        "k": args.k,
+        "nlist": index.nlist,
+        "train_s": train_time,
+        "add_s": add_time,
+        "exact": percentiles(exact_latencies),
+        "ann": []
+    }
+    for nprobe in args.nprobe:
+        latencies = []
+        found = 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            ids, _ = index.search(query, args.k, nprobe)
+            latencies.append(time.perf_counter() - start)
+            found += len(np.intersect1d(ids, expected))
+        result["ann"].append({
+            "nprobe": nprobe,
+            "recall": found / (len(queries) * args.k),
+            **percentiles(latencies)
+        })
+    return result
+
+def print_result(result):
+    exact = result["exact"]
+    print(f"*** n={result['n']} dim={result['dim']} nlist={result['nlist']} "
+          f"train={result['train_s']:.1f}s add={result['add_s']:.1f}s")
+    print(f"    exact          recall@{result['k']}=1.000  p50={exact['p50_ms']:.3f}ms  p99={exact['p99_ms']:.3f}ms")
+    for ann in result["ann"]:
+        print(f"    ivf nprobe={ann['nprobe']:<4} recall@{result['k']}={ann['recall']:.3f}  "
+              f"p50={ann['p50_ms']:.3f}ms  p99={ann['p99_ms']:.3f}ms")
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Recall/latency benchmark of the approximate memory index')
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help='Store sizes, up to 10^7')
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, help='Index lists, default ~4 * sqrt(n)')
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--batch", type=int, default=100_000, help='Rows per incremental insert')
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=str, help='Also write the results to this file')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for n in args.sizes:
+        result = run_size(n, args, rng)
+        print_result(result)
+        results.append(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,100 @@
+import argparse
+import json
+import sys
+import time
+import numpy as np
+from rag.memory import BM25Index, MemoryStore
+from rag.embeddings import HashedNgramEmbedder
+
+# Build time, memory per document and query latency of the BM25 memory index,
+# plus lexical vs. vector vs. hybrid (RRF) query latency through MemoryStore:
+#   python3 -m benchmarks.memory_bm25 --sizes 10000 100000 1000000 --hybrid-max 100000
+
+def make_documents(n, vocabulary, words, rng):
+    # zipf distributed words, roughly the shape of short remembered facts
+    ranks = np.minimum(rng.zipf(1.2, size=n * words), vocabulary) - 1
+    terms = [f"w{rank}" for rank in ranks]
+    return [" ".join(terms[i * words:(i + 1) * words]) for i in range(n)]
+
+def make_queries(documents, count, rng):
+    # two words of a stored document, as MemoryLookup descriptions tend to be
+    queries = []
+    for row in rng.integers(len(documents), size=count):
+        words = documents[row].split()
+        queries.append(" ".join(rng.choice(words, size=2)))
+    return queries
+
+def percentiles(latencies):
+    latencies = np.array(latencies) * 1000
+    return {"p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99))}
+
+def time_queries(search, queries, k):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query, k)
+        latencies.append(time.perf_counter() - start)
+    return percentiles(latencies)
+
+def vocabulary_bytes(index):
+    return sys.getsizeof(index.vocabulary) + sum(sys.getsizeof(term) for term in index.vocabulary)
+
+def run_size(n, args, rng):
+    documents = make_documents(n, args.vocabulary, args.words, rng)
+    queries = make_queries(documents, args.queries, rng)
+
+    index = BM25Index()
+    start = time.perf_counter()
+    for offset in range(0, n, args.batch):
+        index.add(documents[offset:offset + args.batch])
+    build_time = time.perf_counter() - start
+    index.merge()
+
+    result = {
+        "n": n,
+        "terms": len(index.vocabulary),
+        "build_s": build_time,
+        "array_bytes_per_doc": index.nbytes() / n,
+        "total_bytes_per_doc": (index.nbytes() + vocabulary_bytes(index)) / n,
+        "lexical": time_queries(index.search, queries, args.k)
+    }
+    if n <= args.hybrid_max:
+        store = MemoryStore(embedder=HashedNgramEmbedder(dim=args.dim))
+        for offset in range(0, n, args.batch):
+            store.add(documents[offset:offset + args.batch])
+        store.search_lexical(queries[0])
+        result["store_vector"] = time_queries(lambda q, k: store.search(q, k, exact=True), queries, args.k)
+        result["store_hybrid"] = time_queries(store.search_hybrid, queries, args.k)
+    return result
+
+def print_result(result):
+    print(f"*** n={result['n']} terms={result['terms']} build={result['build_s']:.2f}s "
+          f"bytes/doc={result['array_bytes_per_doc']:.1f} (with vocabulary {result['total_bytes_per_doc']:.1f})")
+    for name in ("lexical", "store_vector", "store_hybrid"):
+        if name in result:
+            print(f"    {name:<13} p50={result[name]['p50_ms']:.3f}ms  p99={result[name]['p99_ms']:.3f}ms")
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Build time, memory and latency benchmark of the BM25 memory index')
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--vocabulary", type=int, default=100_000)
+    parser.add_argument("--words", type=int, default=12, help='Words per document')
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=10_000, help='Documents per incremental insert')
+    parser.add_argument("--hybrid-max", type=int, default=100_000, help='Largest size that is also embedded for the hybrid run')
+    parser.add_argument("--dim", type=int, default=256, help='Embedding dim of the hybrid run')
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=str, help='Also write the results to this file')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for n in args.sizes:
+        result = run_size(n, args, rng)
+        print_result(result)
+        results.append(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -1,18 +1,14 @@
-import sounddevice as sd
-import numpy as np
-from pydub import AudioSegment
-from pydub.playback import play
 from rag.models import get_model, get_client_for_model, BACKENDS, Backends
-import requests
 import os
 import time
-from multiprocessing import Process
 from queue import Queue
 import threading
 from nlp.text_to_speech import request_speech_to_text, requset_text_to_speech_openai
-import glob
 import asyncio
 
+# audio dependencies (pydub) and requests load when they are first used, the
+# recordings directory is created by make_output_dir() and not on import
+
 def timed(func):
     def _w(*a, **k):
         then = time.time()
@@ -21,17 +17,18 @@ def timed(func):
         return elapsed, res
     return _w
 
-# Constants and Output Directory
-timestamp = time.strftime("%Y%m%d-%H%M%S")
-output_dir = f"/tmp/recordings_{timestamp}"
-print(f"Recording files will be saved to {output_dir}")
-if not os.path.exists(output_dir):
-    os.makedirs(output_dir)
+# Constants
 sample_rate = 44100
 duration = 0.2
 min_level = -40
 silence_threshold = 10
-api_key = BACKENDS[Backends.DEEPINFRA].api_key
+
+def make_output_dir():
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    output_dir = f"/tmp/recordings_{timestamp}"
+    print(f"Recording files will be saved to {output_dir}")
+    os.makedirs(output_dir, exist_ok=True)
+    return output_dir
 
 async def fetch_response(prompt):
     messages = [{
@@ -112,6 +109,8 @@ def request_response(text):
 
 def recognize_speech(audio_file_path):
     """Function to send an audio file to speech recognition API and print the result."""
+    import requests
+    api_key = BACKENDS[Backends.DEEPINFRA].api_key
     with open(audio_file_path, 'rb') as audio_file:
         headers = {
             'Authorization': f'Bearer {api_key}'
@@ -133,6 +132,8 @@ def recognize_speech(audio_file_path):
     
 
 def play_audio_files(queue, output_dir="/tmp/recordings"):
+    from pydub import AudioSegment
+    from pydub.playback import play
     while True:
         audio_file = queue.get()
         if audio_file is None:
@@ -156,7 +157,8 @@ def run_async(prompt, queue, output_dir="/tmp/recordings"):
     loop = asyncio.get_event_loop()
     loop.run_until_complete(async_process())
 
-def main(prompt="How is the weather in Aachen today?", output_dir="/tmp/recordings"):
+def main(prompt="How is the weather in Aachen today?", output_dir=None):
+    output_dir = make_output_dir() if output_dir is None else output_dir
     audio_queue = Queue()
 
     # Start the audio playback thread
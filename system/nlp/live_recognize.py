@@ -1,15 +1,12 @@
-import sounddevice as sd
-import numpy as np
-from pydub import AudioSegment
-import requests
 import os
 import time
 import threading
 
+# audio dependencies (sounddevice, pydub) and requests load when they are
+# first used, the recordings directory is created by main() and not on import
+
 # Directory for recordings
 output_dir = "recordings"
-if not os.path.exists(output_dir):
-    os.makedirs(output_dir)
 
 # Configuration
 sample_rate = 44100 # Sample rate in Hz
@@ -18,6 +15,7 @@ silence_threshold = 3
 
 def record_audio():
     """Continuously record audio."""
+    import sounddevice as sd
     while True:
         myrecording = sd.rec(int(duration * sample_rate), samplerate=sample_rate, channels=2, dtype='int16')
         sd.wait()  # Wait until recording is finished
@@ -25,6 +23,7 @@ def record_audio():
 
 def process_recording(index, rec):
     """Save and process recorded audio."""
+    from pydub import AudioSegment
     # Convert numpy array to audio segment
     audio_segment = AudioSegment(
         rec.tobytes(),
@@ -39,6 +38,7 @@ def process_recording(index, rec):
 
 def concatenate_and_recognize(index):
     """Concatenate sound files and send to a speech recognition API."""
+    from pydub import AudioSegment
     concatenated = None
     for i in range(index):
         segment_path = os.path.join(output_dir, f"segment_{i:03d}.mp3")
@@ -64,6 +64,9 @@ def concatenate_and_recognize(index):
 
 def recognize_speech(audio_file_path):
     """Function to send an audio file to speech recognition API and print the result."""
+    import requests
+    from rag.models import BACKENDS, Backends
+    api_key = BACKENDS[Backends.DEEPINFRA].api_key
     with open(audio_file_path, 'rb') as audio_file:
         headers = {
             'Authorization': f'Bearer {api_key}'
@@ -91,6 +94,7 @@ def recognize_speech(audio_file_path):
         print(f"Failed to recognize speech for {audio_file_path} with status code {response.status_code}", flush=True)
 
 def main():
+    os.makedirs(output_dir, exist_ok=True)
     rec_gen = record_audio()
     for index, rec in enumerate(rec_gen):
         process_recording(index, rec)
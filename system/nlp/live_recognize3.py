@@ -1,31 +1,23 @@
-import sounddevice as sd
-import numpy as np
-from pydub import AudioSegment
-from pydub.playback import play
 from rag.models import get_model, get_client_for_model, BACKENDS, Backends
-import requests
 import os
 import time
 from multiprocessing import Process, Queue
 import threading
 from nlp.text_to_speech import request_speech_to_text
 from nlp import continous_reponse
-import glob
-
-# Constants and Output Directory
-timestamp = time.strftime("%Y%m%d-%H%M%S")
-output_dir = f"/tmp/recordings_{timestamp}"
-print(f"Recording files will be saved to {output_dir}")
-if not os.path.exists(output_dir):
-    os.makedirs(output_dir)
+
+# audio dependencies (sounddevice, pydub, numpy) and requests load in the
+# processes that use them, the recordings directory is created by main()
+
+# Constants
 sample_rate = 44100
 duration = 0.2
 min_level = -40
 silence_threshold = 6
-api_key = BACKENDS[Backends.DEEPINFRA].api_key
 
 def audio_recording(queue):
     """ Continuously record audio. """
+    import sounddevice as sd
     with sd.InputStream(samplerate=sample_rate, channels=2, dtype='int16') as stream:
         while True:
             data, _ = stream.read(int(sample_rate * duration))
@@ -40,8 +32,11 @@ def timed(func):
     return _w
 
 
-def audio_processing(queue):
+def audio_processing(queue, output_dir):
     """ Process and handle the audio data from the queue. """
+    import numpy as np
+    from pydub import AudioSegment
+    from pydub.playback import play
     index = 0
     silence_counter = 0
     concatenated = None
@@ -102,10 +97,11 @@ def audio_processing(queue):
         queue.close()
 
 SEGMENT_MAP = {}
-import asyncio
 
 def recognize_speech(audio_file_path):
     """Function to send an audio file to speech recognition API and print the result."""
+    import requests
+    api_key = BACKENDS[Backends.DEEPINFRA].api_key
     with open(audio_file_path, 'rb') as audio_file:
         headers = {
             'Authorization': f'Bearer {api_key}'
@@ -131,9 +127,10 @@ def recognize_speech(audio_file_path):
     
 
 def main():
+    output_dir = continous_reponse.make_output_dir()
     queue = Queue(maxsize=1000)  # Buffer up to 10 seconds
     recording_process = Process(target=audio_recording, args=(queue,))
-    processing_process = Process(target=audio_processing, args=(queue,))
+    processing_process = Process(target=audio_processing, args=(queue, output_dir))
     
     recording_process.start()
     processing_process.start()
@@ -1,4 +1,3 @@
-import requests
 import os
 from rag.models import get_model, get_client_for_model, BACKENDS, Backends
 
@@ -6,6 +5,7 @@ model_id = "VEJVJeXDkdy7O1Yr5tZS"
 API_KEY = os.getenv("ELVENLABS_API_KEY")
 
 def request_speech_to_text(prompt, output_path="output.mp3"):
+    import requests
 
     url = f"https://api.elevenlabs.io/v1/text-to-speech/{model_id}"
     CHUNK_SIZE = 1024
@@ -1,3 +1,10 @@
-from . import abs, models, agents
+import importlib
 
-__all__ = ['abs', 'models', 'agents']
\ No newline at end of file
+# submodules load on first access, importing e.g. rag.tokens doesn't import openai
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+__all__ = ['abs', 'models', 'agents']
@@ -1,34 +1,58 @@
+import asyncio
 import concurrent.futures
-from typing import List
+import os
+import queue
+import threading
+from typing import List, Mapping
+from types import MappingProxyType
 from dataclasses import dataclass, field
 import time
+from rag.plan import GraphPlan, compile_graph
+from rag.tracing import Tracer, RunTrace, get_default_tracer
+from rag.policy import EvaluationPolicy
+from rag.results import ResultStore
+from rag.log import log
 
 DEFAULT_MODEL = "meta-llama/Meta-Llama-3-70B-Instruct"
 
-def timed(func):
-    def _w(*a, **k):
-        then = time.time()
-        res = func(*a, **k)
-        elapsed = time.time() - then
-        return elapsed, res
-    return _w
+# full node results in the engine log, formatting them is costly under load
+VERBOSE = os.getenv("RAG_VERBOSE") is not None
 
 class RagNode:
     # some init params & a self.run(prompt, context) method
     name: str = None
     start_node: bool = False
     end_node: bool = False
+    # "any": run once all incoming edges resolved and at least one fired
+    # "all": run only if every incoming edge fired
+    join: str = "any"
+    # speculative nodes are cancelled once no node that needs them can run anymore
+    speculative: bool = False
+    # extra result names the node publishes through RagNodeResult.published
+    provides: tuple = ()
+    # the node emits its answer tokens while running, through NodeContext.emit_token
+    stream: bool = False
+    # "eager", "lazy" or "adaptive", see rag/policy.py
+    policy: str = "eager"
 
     def __init__(
             self,
             name: str,
             start_node: bool = False,
             end_node: bool = False,
+            join: str = "any",
+            speculative: bool = False,
+            stream: bool = False,
+            policy: str = "eager",
             **kwargs
         ):
         self.name = name
         self.start_node = start_node
         self.end_node = end_node
+        self.join = join
+        self.speculative = speculative
+        self.stream = stream
+        self.policy = policy
         self.create(**kwargs)
         
     def __repr__(self) -> str:
@@ -36,34 +60,46 @@ class RagNode:
         
     def create(self, *args, **kwargs):
         pass
+
+    async def arun(self, context):
+        # sync-node adapter, nodes without a native async variant run in a worker thread
+        return await asyncio.to_thread(self.run, context)
     
+class NodeCancelled(Exception):
+    pass
+
+class ResultRetracted(Exception):
+    # the full answer of a node invalidated the result it released early
+    pass
+
 @dataclass
 class YieldMessage:
     kind: str
     content: str
 
+EMPTY_RESULTS = MappingProxyType({})
+
 class NodeContext:
-    message_history: List[dict] = []
-    parent_results: dict = {}
-    all_results: dict = {}
-    prompt: str = ""
-    
-    def update_all_results(self, res=None):
-        if self.all_results is None:
-            self.all_results = self.parent_results
-        else:
-            self.all_results = {
-                **self.all_results,
-                **self.parent_results
-            }
-            
-        if res is not None:
-            self.parent_results = res
-            print("*** New parent results:", self.parent_results)
+    # every field is set per instance, mutable class defaults would be shared by all runs
+    message_history: List[dict]
+    # results of the nodes with an edge into this node
+    parent_results: Mapping
+    # snapshot of every result of the run so far (rag/results.py)
+    all_results: Mapping
+    prompt: str
+    cancel_event: threading.Event
+    emit: callable
+    # set by the engine while the node runs, see release_result
+    release: callable
     
-    def __init__(self, message_history, prompt):
+    def __init__(self, message_history, prompt, parent_results: Mapping = EMPTY_RESULTS):
         self.message_history = message_history
         self.prompt = prompt
+        self.parent_results = parent_results
+        self.all_results = EMPTY_RESULTS
+        self.cancel_event = None
+        self.emit = None
+        self.release = None
         
     def to_dict(self):
         return {
@@ -75,6 +111,27 @@ class NodeContext:
     def copy(self):
         return NodeContext(**self.to_dict())
 
+    def for_node(self, parent_results, all_results, cancel_event=None, emit=None):
+        context = NodeContext(self.message_history, self.prompt)
+        context.parent_results = parent_results
+        context.all_results = all_results
+        context.cancel_event = cancel_event
+        context.emit = emit
+        return context
+
+    def emit_token(self, token: str):
+        if self.emit is not None:
+            self.emit(token)
+
+    def release_result(self, res):
+        # completes the node with res before its run() returned, e.g. once the
+        # fields downstream nodes need are streamed, the later return is dropped
+        if self.release is not None:
+            self.release(res)
+
+    def is_cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
 class RagEdge:
     # connect two RagNodes
     start: str = None
@@ -95,129 +152,642 @@ class RagEdge:
     def __repr__(self) -> str:
         return f"RagEdge({self.start} -> {self.end})" + ("[disabled]" if self.disabled else "")
         
-    def update_state(self, context):
-        print(f"*** Updating edge {self}")
+    def update_state(self, context) -> bool:
+        # predicates toggle a per-run EdgeState, the edge itself is never mutated
+        log(f"*** Updating edge {self}")
+        state = EdgeState(self.start, self.end, self.disabled)
         if self.update_overwrite is not None:
-            self.update_overwrite(self, context)
+            self.update_overwrite(state, context)
+        return not state.disabled
+
+class EdgeState:
+    # __slots__ turns typos in edge predicates (e.g. 'edge.disabed') into errors
+    __slots__ = ("start", "end", "disabled")
+
+    def __init__(self, start, end, disabled):
+        self.start = start
+        self.end = end
+        self.disabled = disabled
+
+    def __repr__(self) -> str:
+        return f"EdgeState({self.start} -> {self.end})" + ("[disabled]" if self.disabled else "")
+
+def span_attributes(res):
+    # nodes describe their work for the trace in res.meta["trace"], e.g. model and usage
+    return {"forward": res.forward, **res.meta.get("trace", {})}
+
+class GraphRun:
+    # scheduling state of a single RagGraph run
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    SKIPPED = "skipped"
+    CANCELLED = "cancelled"
+
+    def __init__(self, plan: GraphPlan, context: NodeContext, trace: RunTrace = None, lazy: frozenset = frozenset()):
+        self.plan = plan
+        # None when tracing is off
+        self.trace = trace
+        # nodes that wait for a consumer to need them, see rag/policy.py
+        self.lazy = lazy
+        self.deferred = []
+        self.demanded = set()
+        # every node whose inputs were satisfied, whether it ran or not
+        self.runnable = set()
+        self.store = ResultStore()
+        # edge predicates see this run's own context, never one shared with other runs
+        self.context = context.for_node(EMPTY_RESULTS, self.store.snapshot())
+        self.state = {name: self.PENDING for name in plan.outgoing}
+        self.fired = {}
+        self.end_results = {}
+        self.running = set()
+        # nodes that released their result early and whose run() hasn't returned yet,
+        # they are only settled once the final result arrives
+        self.released = set()
+        self.cancel_events = {}
+        self.cancelled = []
+        self.token_buffers = {}
+        self.streaming = set()
+
+    def start(self):
+        start_node = self.plan.start_node
+        self.state[start_node.name] = self.DONE
+        return self.ready_after(start_node.name, self.schedule(self.prune(self.resolve(start_node.name, True))))
+
+    def ready_after(self, name, ready):
+        # the completion of name made the ready nodes runnable
+        if self.trace is not None:
+            self.trace.ready([node.name for node in ready], name)
+        return ready
+
+    def mark_running(self, node):
+        self.state[node.name] = self.RUNNING
+        self.running.add(node.name)
+        if self.trace is not None:
+            self.trace.submit(node.name)
+
+    def node_context(self, node, emit=None):
+        parent_results = {}
+        for edge in self.plan.incoming[node.name]:
+            if edge.start in self.store:
+                parent_results[edge.start] = self.store.get(edge.start)
+        self.cancel_events[node.name] = threading.Event()
+        return self.context.for_node(
+            MappingProxyType(parent_results),
+            self.store.snapshot(),
+            cancel_event=self.cancel_events[node.name],
+            emit=emit if node.stream else None
+        )
+
+    def is_committed(self, name):
+        # the tokens of a streaming node are part of the answer once its output
+        # is certain to reach an end node, e.g. a speculative casual response
+        # after the categorizer enabled the edge of the end node it feeds
+        node = self.plan.nodes[name]
+        if node.end_node:
+            return True
+        for edge in self.plan.outgoing[name]:
+            end = self.plan.nodes[edge.end]
+            if self.state[end.name] in (self.SKIPPED, self.CANCELLED) or end.join != "all":
+                continue
+            others = [e for e in self.plan.incoming[end.name] if e is not edge]
+            if all(self.fired.get(e) is True for e in others) and self.is_committed(end.name):
+                return True
+        return False
+
+    def on_token(self, node, token):
+        # returns the tokens that can be released to the caller
+        if self.state[node.name] in (self.SKIPPED, self.CANCELLED):
+            return []
+        if node.name in self.streaming:
+            return [token]
+        self.token_buffers.setdefault(node.name, []).append(token)
+        return self.flush_tokens()
+
+    def flush_tokens(self):
+        tokens = []
+        for name in list(self.token_buffers):
+            if self.state[name] in (self.SKIPPED, self.CANCELLED):
+                del self.token_buffers[name]
+            elif self.is_committed(name):
+                self.streaming.add(name)
+                tokens.extend(self.token_buffers.pop(name))
+        return tokens
+
+    def complete(self, node, res):
+        self.state[node.name] = self.DONE
+        self.running.discard(node.name)
+        self.store.add(node.name, res)
+        self.context.all_results = self.store.snapshot()
+        if node.end_node:
+            self.end_results[node.name] = res
+        # results the node publishes under other names resolve their own edges
+        ready = []
+        for name in self.plan.published[node.name]:
+            published = res.published.get(name)
+            self.state[name] = self.DONE if published is not None else self.SKIPPED
+            if published is not None:
+                self.store.add(name, published)
+                self.context.all_results = self.store.snapshot()
+            forward = published is not None and published.forward
+            ready.extend(n for n in self.resolve(name, forward) if n not in ready)
+        ready.extend(n for n in self.resolve(node.name, res.forward) if n not in ready)
+        return self.ready_after(node.name, self.schedule(self.prune(ready)))
+
+    def release(self, node):
+        self.released.add(node.name)
+
+    def is_consumed(self, name):
+        # a released result is still in use while a consumer that received it
+        # runs, ran or can still run
+        if self.plan.nodes[name].end_node:
+            return True
+        return any(
+            self.fired.get(edge) is True and (
+                self.state[edge.end] in (self.RUNNING, self.DONE)
+                or (self.state[edge.end] == self.PENDING and self.is_needed(edge.end))
+            )
+            for edge in self.plan.outgoing[name]
+        )
+
+    def is_active(self):
+        # the run ends with its end node, but not before the released nodes settled
+        if len(self.released) > 0:
+            return True
+        return len(self.running) > 0 and len(self.end_results) == 0
+
+    def pop_cancelled(self):
+        cancelled = self.cancelled
+        self.cancelled = []
+        return cancelled
+
+    def is_needed(self, name, memo=None):
+        # a node is needed if an end node that can still run depends on it
+        memo = {} if memo is None else memo
+        if name not in memo:
+            memo[name] = False
+            node = self.plan.nodes.get(name)
+            if self.state[name] not in (self.SKIPPED, self.CANCELLED):
+                memo[name] = (node is not None and node.end_node) or any(
+                    self.fired.get(edge) is not False
+                    and self.state[edge.end] == self.PENDING
+                    and self.is_needed(edge.end, memo)
+                    for edge in self.plan.outgoing[name]
+                ) or any(
+                    self.is_needed(published, memo)
+                    for published in self.plan.published.get(name, ())
+                )
+        return memo[name]
+
+    def is_demanded(self, name, memo=None):
+        # a consumer will run with the result: every other input of a consumer
+        # fired (or is itself a deferred node) and the consumer leads to an end node
+        memo = {} if memo is None else memo
+        if name not in memo:
+            memo[name] = False
+            node = self.plan.nodes.get(name)
+            deferred = {n.name for n in self.deferred}
+            memo[name] = (node is not None and node.end_node) or any(
+                self.state[edge.end] == self.PENDING
+                and (self.plan.nodes[edge.end].join != "all" or all(
+                    self.fired.get(other) is True or other.start in deferred
+                    for other in self.plan.incoming[edge.end] if other is not edge
+                ))
+                and self.is_demanded(edge.end, memo)
+                for edge in self.plan.outgoing[name]
+            ) or any(
+                self.is_demanded(published, memo)
+                for published in self.plan.published.get(name, ())
+            )
+        return memo[name]
+
+    def schedule(self, ready):
+        # lazy nodes wait in self.deferred until a consumer needs their result,
+        # they are skipped once no consumer can run anymore
+        changed = True
+        while changed:
+            changed = False
+            for node in list(ready):
+                if node.name in self.lazy and node.name not in self.demanded:
+                    ready.remove(node)
+                    self.deferred.append(node)
+            for node in list(self.deferred):
+                if self.is_demanded(node.name):
+                    log(f"*** Demanded lazy {node}")
+                    self.deferred.remove(node)
+                    self.demanded.add(node.name)
+                    ready.append(node)
+                    changed = True
+                elif not self.is_needed(node.name):
+                    log(f"*** Not starting lazy {node}")
+                    self.deferred.remove(node)
+                    self.state[node.name] = self.SKIPPED
+                    ready.extend(n for n in self.resolve(node.name, False) if n not in ready)
+                    ready = self.prune(ready)
+                    changed = True
+        if len(ready) == 0 and len(self.running) == 0 and len(self.deferred) > 0:
+            # nothing left that could demand them, run them rather than stall
+            ready = list(self.deferred)
+            self.deferred = []
+        return ready
+
+    def usage(self, names):
+        # {name: (hit, elapsed)} of the given nodes that became runnable in this run,
+        # a hit is a result that a consumer ran with
+        usage = {}
+        for name in names:
+            if name not in self.runnable:
+                continue
+            hit = self.state[name] == self.DONE and (self.plan.nodes[name].end_node or any(
+                self.fired.get(edge) is True and self.state[edge.end] in (self.RUNNING, self.DONE)
+                for edge in self.plan.outgoing[name]
+            ) or any(
+                self.state[published] == self.DONE for published in self.plan.published.get(name, ())
+            ))
+            result = self.store.get(name)
+            usage[name] = (hit, result.meta.get("elapsed") if result is not None else None)
+        return usage
+
+    def prune(self, ready):
+        # speculative nodes that no runnable node depends on anymore are not
+        # started, running ones are cancelled and their results discarded
+        pruned = True
+        while pruned:
+            pruned = False
+            memo = {}
+            for node in list(ready):
+                if node.speculative and not self.is_needed(node.name, memo):
+                    log(f"*** Not starting speculative {node}")
+                    ready.remove(node)
+                    self.state[node.name] = self.SKIPPED
+                    ready.extend(n for n in self.resolve(node.name, False) if n not in ready)
+                    pruned = True
+                    break
+            if pruned:
+                continue
+            for name in list(self.running):
+                node = self.plan.nodes[name]
+                if node.speculative and not self.is_needed(name, memo):
+                    log(f"*** Cancelling speculative {node}")
+                    self.running.discard(name)
+                    self.state[name] = self.CANCELLED
+                    self.cancel_events[name].set()
+                    self.cancelled.append(node)
+                    if self.trace is not None:
+                        self.trace.finish(name, self.CANCELLED)
+                    ready.extend(n for n in self.resolve(name, False) if n not in ready)
+                    pruned = True
+                    break
+        # a released node still streams its full answer, its edges already
+        # resolved so the consumers it fed are skipped or cancelled by now
+        for name in list(self.released):
+            node = self.plan.nodes[name]
+            if node.speculative and not self.is_consumed(name):
+                log(f"*** Cancelling released speculative {node}")
+                self.released.discard(name)
+                self.state[name] = self.CANCELLED
+                self.cancel_events[name].set()
+                self.cancelled.append(node)
+                if self.trace is not None:
+                    self.trace.finish(name, self.CANCELLED)
+        return ready
+
+    def resolve(self, name, forward):
+        # decide the outgoing edges of a finished node and return the nodes
+        # that became runnable, skipped nodes propagate their skip downstream
+        ready = []
+        finished = [(name, forward)]
+        if not forward:
+            finished.extend(self.skip_published(name))
+        while len(finished) > 0:
+            start, forward = finished.pop()
+            for edge in self.plan.outgoing[start]:
+                self.fired[edge] = forward and edge.update_state(self.context)
+                if self.trace is not None:
+                    self.trace.edge(edge.start, edge.end, self.fired[edge])
+                end = self.plan.nodes[edge.end]
+                decision = self.decide(end)
+                if decision is True:
+                    self.runnable.add(end.name)
+                    if end not in ready:
+                        ready.append(end)
+                elif decision is False:
+                    log(f"*** Skipping {end}")
+                    self.state[end.name] = self.SKIPPED
+                    finished.append((end.name, False))
+                    finished.extend(self.skip_published(end.name))
+        return ready
+
+    def skip_published(self, name):
+        # a node that never produces a result can't publish one either
+        skipped = []
+        for published in self.plan.published.get(name, ()):
+            if self.state[published] == self.PENDING:
+                self.state[published] = self.SKIPPED
+                skipped.append((published, False))
+        return skipped
+
+    def decide(self, node):
+        # True: runnable, False: can never run, None: still waiting
+        if self.state[node.name] != self.PENDING:
+            return None
+        fired = [self.fired.get(edge) for edge in self.plan.incoming[node.name]]
+        if node.join == "all":
+            if False in fired:
+                return False
+            if None in fired:
+                return None
+            return True
+        if None in fired:
+            return None
+        return True in fired
 
 class RagGraph:
-    
-    yield_messages: List[YieldMessage] = []
+    # holds no per-run state, any number of runs can share one graph
     
     def __init__(
             self, 
             nodes: List[RagNode],
-            edges: List[RagEdge]
+            edges: List[RagEdge],
+            tracer: Tracer = None,
+            policy: EvaluationPolicy = None
         ):
         self.nodes = nodes
         self.edges = edges
+        self.plan = None
+        # span tracing of every run, see rag/tracing.py
+        self.tracer = get_default_tracer() if tracer is None else tracer
+        # hit rates and latencies of the adaptive nodes, see rag/policy.py
+        self.policy = EvaluationPolicy() if policy is None else policy
+        
+    def compile(self, strict: bool = False) -> GraphPlan:
+        # validate the graph and build the topology indexes once, every run reuses the plan
+        self.plan = compile_graph(self.nodes, self.edges, strict=strict)
+        for warning in self.plan.warnings:
+            log("*** Graph warning:", warning)
+        return self.plan
+
+    def get_plan(self) -> GraphPlan:
+        if self.plan is None:
+            self.compile()
+        return self.plan
         
     def get_start_node(self):
-        for node in self.nodes:
-            if node.start_node:
-                return node
-        return None
+        return self.get_plan().start_node
     
     def get_node(self, name):
-        for node in self.nodes:
-            if node.name == name:
-                return node
-        return None
-    
-    def get_sibling_nodes(self, node):
-        siblings = []
-        for edge in self.edges:
-            if (not edge.disabled) and (edge.start == node.name):
-                siblings.append(self.get_node(edge.end))
-        return siblings
-    
-    def update_edges(self, start_node, context):
-        for edge in self.edges:
-            if edge.start == start_node.name:
-                edge.update_state(context)
-    
-    def run_nodes(self, nodes, context):
-        node_res = {}
-        with concurrent.futures.ThreadPoolExecutor(max_workers=len(nodes)) as executor:
-            futures = [executor.submit(timed(node.run), context) for node in nodes]
-
-            results = [future.result() for future in futures]
-            
-            for result in results:
-                elapsed, res = result
-                format_time = "{:.2f}".format(elapsed)
-                print("Elapsed:", format_time, "Result:", res.response)
-                node_res[res.node_name] = res
-        return node_res
-    
-    def check_for_end_node(self, nodes):
-        for node in nodes:
-            if node.end_node:
-                return node
-        return None
+        return self.get_plan().get_node(name)
     
-    def run_subgraph2(self, 
-            nodes: List[RagNode],
+    def get_incoming_edges(self, node):
+        return self.get_plan().incoming[node.name]
+
+    def get_outgoing_edges(self, node):
+        return self.get_plan().outgoing[node.name]
+
+    def start_run(self, context):
+        trace = self.tracer.start_run(context.prompt) if self.tracer is not None else None
+        plan = self.get_plan()
+        return GraphRun(plan, context, trace, self.policy.lazy_nodes(plan))
+
+    def run_node(self, node, context, done_queue):
+        try:
+            started = time.perf_counter()
+            context.release = lambda res: done_queue.put(("release", node, (started, time.perf_counter() - started, res)))
+            res = node.run(context)
+            done_queue.put(("done", node, (started, time.perf_counter() - started, res)))
+        except Exception as e:
+            done_queue.put(("error", node, e))
+
+    def iter_dataflow(
+            self,
             context: NodeContext
         ):
-        print("*** Running subgraph ***")
-        siblings = []
-        for node in nodes:
-            self.update_edges(node, context)
-            sibls = self.get_sibling_nodes(node)
-            for s in sibls:
-                if s not in siblings:
-                    siblings.append(s)
-                    
-        print("*** Siblings:", siblings)
-        
-        if len(siblings) == 0:
-            print("No futher siblings to traverse")
-            return context
-        
-        res = self.run_nodes(siblings, context)
-        context.update_all_results(res)
-        
-        next_nodes = []
-        for node_name, node_res in res.items():
-            print(f"===> Node: {node_name}, response: {node_res.response}")
-            if len(node_res.yield_messages) > 0:
-                for msg in node_res.yield_messages:
-                    print(f"=====> Yielded message: {msg.content}")
-                self.yield_messages.extend(node_res.yield_messages)
-            if node_res.forward:
-                node = self.get_node(node_name)
-                
-                if node not in next_nodes:
-                    next_nodes.append(node)
-        
-        print("*** Next nodes:", next_nodes)
-        end_node = self.check_for_end_node(next_nodes)
-        if end_node is not None:
-            print("End node found:", end_node)
-            return context
-        return self.run_subgraph2(next_nodes, context)
-    
+        # Every node is submitted as soon as its own incoming edges resolved,
+        # results and edge predicates are applied as each node completes.
+        # Yields the YieldMessages of the nodes and the answer tokens as they arrive.
+        log("*** Running dataflow ***")
+        run = self.start_run(context)
+        done_queue = queue.Queue()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.nodes))
+        futures = {}
+
+        def submit(nodes):
+            for node in nodes:
+                log("*** Submitting:", node)
+                run.mark_running(node)
+                emit = lambda token, node=node: done_queue.put(("token", node, token))
+                futures[node.name] = executor.submit(
+                    self.run_node, node, run.node_context(node, emit), done_queue
+                )
+            # in-flight calls of cancelled nodes see their cancel_event and close the stream
+            for node in run.pop_cancelled():
+                futures[node.name].cancel()
+
+        try:
+            submit(run.start())
+            while run.is_active():
+                kind, node, payload = done_queue.get()
+                for event in self.handle_event(run, kind, node, payload, submit):
+                    yield event
+        finally:
+            # don't wait for branches whose results are no longer needed
+            for name in run.running | run.released:
+                run.cancel_events[name].set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.close_run(run)
+
+        self.finish_run(run, context)
+
+    async def arun_node(self, node, context, put_event):
+        try:
+            started = time.perf_counter()
+            # sync nodes release from their worker thread
+            context.release = lambda res: put_event(("release", node, (started, time.perf_counter() - started, res)))
+            res = await node.arun(context)
+            put_event(("done", node, (started, time.perf_counter() - started, res)))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            put_event(("error", node, e))
+
+    async def aiter_dataflow(
+            self,
+            context: NodeContext
+        ):
+        # same scheduling as iter_dataflow, every node is a task on the running event loop
+        log("*** Running async dataflow ***")
+        run = self.start_run(context)
+        done_queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        loop_thread = threading.get_ident()
+        tasks = {}
+
+        def put_event(event):
+            # sync nodes emit from their worker thread
+            if threading.get_ident() == loop_thread:
+                done_queue.put_nowait(event)
+            else:
+                loop.call_soon_threadsafe(done_queue.put_nowait, event)
+
+        def submit(nodes):
+            for node in nodes:
+                log("*** Submitting:", node)
+                run.mark_running(node)
+                emit = lambda token, node=node: put_event(("token", node, token))
+                tasks[node.name] = asyncio.create_task(
+                    self.arun_node(node, run.node_context(node, emit), put_event)
+                )
+            # cancelling the task aborts the in-flight request
+            for node in run.pop_cancelled():
+                tasks[node.name].cancel()
+
+        try:
+            submit(run.start())
+            while run.is_active():
+                kind, node, payload = await done_queue.get()
+                for event in self.handle_event(run, kind, node, payload, submit):
+                    yield event
+        finally:
+            # the run is over, remaining tasks can't contribute to the result
+            for task in tasks.values():
+                task.cancel()
+            self.close_run(run)
+
+        self.finish_run(run, context)
+
+    def handle_event(self, run, kind, node, payload, submit):
+        if node.name in run.released and kind != "token":
+            return self.settle_released(run, kind, node, payload)
+        if node.name not in run.running and kind != "token":
+            log(f"*** Discarding result of cancelled {node}")
+            return []
+        if kind == "error":
+            if run.trace is not None:
+                run.trace.finish(node.name, "error", attributes={"error": repr(payload)})
+            raise payload
+        if kind == "token":
+            return [YieldMessage("token", token) for token in run.on_token(node, payload)]
+        if kind == "release":
+            # NodeContext.release_result, the node completes but keeps running
+            run.release(node)
+        started, elapsed, res = payload
+        if run.trace is not None:
+            run.trace.started_at(node.name, started)
+            run.trace.finish(node.name, run.DONE, started + elapsed, span_attributes(res))
+        submit(self.node_done(run, node, elapsed, res))
+        tokens = [YieldMessage("token", token) for token in run.flush_tokens()]
+        return res.yield_messages + tokens
+
+    def settle_released(self, run, kind, node, payload):
+        # the final result of a node that released early, the consumers already
+        # run with the released one so a failed full answer fails the run
+        if kind == "release":
+            return []
+        run.released.discard(node.name)
+        if kind == "done":
+            res = payload[2]
+            if res.forward:
+                if run.trace is not None:
+                    # the drained stream carries the usage the released result lacked
+                    run.trace.annotate(node.name, span_attributes(res))
+                return []
+            payload = ResultRetracted(f"{node} retracted its released result, the full answer is invalid")
+        if run.trace is not None:
+            run.trace.finish(node.name, "error", attributes={"error": repr(payload)})
+        raise payload
+
+    def node_done(self, run, node, elapsed, res):
+        format_time = "{:.2f}".format(elapsed)
+        if VERBOSE:
+            log("Elapsed:", format_time, "Node:", node.name, "Result:", res.response)
+        else:
+            log("Elapsed:", format_time, "Node:", node.name)
+        res.meta["elapsed"] = elapsed
+        for msg in res.yield_messages:
+            log(f"=====> Yielded message: {msg.content}")
+        return run.complete(node, res)
+
+    def finish_run(self, run, context):
+        if len(run.end_results) == 0:
+            log("No futher nodes to traverse")
+        context.parent_results = MappingProxyType(run.end_results)
+        context.all_results = run.store.snapshot()
+        return context
+
+    def close_run(self, run):
+        if run.trace is not None:
+            self.tracer.finish_run(run.trace, next(iter(run.end_results), None))
+        adaptive = [name for name, node in run.plan.nodes.items() if node.policy == "adaptive"]
+        if len(adaptive) > 0:
+            self.policy.record(run.usage(adaptive))
+
     def get_final_result(self, context):
         end_node_names = list(context.parent_results.keys())
+        if len(end_node_names) == 0:
+            raise Exception("No end node reached.")
         assert len(end_node_names) == 1, "Multiple end nodes found."
         end_node_name = end_node_names[0]
         return context.parent_results[end_node_name].response
 
+    def run_dataflow(self, context: NodeContext):
+        for _ in self.iter_dataflow(context):
+            pass
+        return context
+
+    async def arun_dataflow(self, context: NodeContext):
+        async for _ in self.aiter_dataflow(context):
+            pass
+        return context
+
+    def stream(
+            self,
+            context: NodeContext,
+        ):
+        # progress YieldMessages and "token" messages of the answer as they arrive,
+        # the last message is the final result (kind "result")
+        log("Start node:", self.get_start_node())
+        for event in self.iter_dataflow(context):
+            yield event
+        yield YieldMessage("result", self.get_final_result(context))
+
+    async def astream(
+            self,
+            context: NodeContext,
+        ):
+        log("Start node:", self.get_start_node())
+        async for event in self.aiter_dataflow(context):
+            yield event
+        yield YieldMessage("result", self.get_final_result(context))
+
     def run(
             self,
             context: NodeContext,
         ):
-        start_node = self.get_start_node()
-        if start_node is None:
-            raise Exception("No start node found.")
-        
-        print("Start node:", start_node)
-        context = self.run_subgraph2([start_node], context)
-        
-        end_result = self.get_final_result(context)
-        print("Yield messages:", self.yield_messages)
-        print("Final results:", end_result)
+        end_result = None
+        yield_messages = []
+        for event in self.stream(context):
+            if event.kind == "result":
+                end_result = event.content
+            elif event.kind != "token":
+                yield_messages.append(event)
+        log("Yield messages:", yield_messages)
+        log("Final results:", end_result)
+        return end_result
+
+    async def arun(
+            self,
+            context: NodeContext,
+        ):
+        end_result = None
+        yield_messages = []
+        async for event in self.astream(context):
+            if event.kind == "result":
+                end_result = event.content
+            elif event.kind != "token":
+                yield_messages.append(event)
+        log("Yield messages:", yield_messages)
+        log("Final results:", end_result)
+        return end_result
         
 @dataclass
 class RagNodeResult:
@@ -226,6 +796,7 @@ class RagNodeResult:
     yield_messages: List[YieldMessage] = field(default_factory=list)
     response: dict = None
     forward: bool = True
+    published: dict = field(default_factory=dict)
     
     def to_dict(self):
         return {
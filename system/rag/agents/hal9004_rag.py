@@ -1,88 +1,122 @@
 from rag.abs import RagEdge, RagNode, NodeContext
-from rag.nodes import ParamExtractorNode, CasualResponseNode, ToolSelectorNode, ToolCasualEndNode, WebSearchLookup, WebSearchResponse
+from rag.nodes import ParamExtractorNode, FusedExtractorNode, ExtractorSpec, CasualResponseNode, ToolSelectorNode, ToolCasualEndNode, WebSearchLookup, WebSearchDistill, WebSearchResponse, MemoryRetrievalNode, MemoryResponse
 from rag.abs import RagGraph
+from rag.log import log
+
+web_extract = dict(
+    schema={
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string",
+                "description": "The search query"
+            }
+        }
+    },
+    tool_description="""The web search function will search the web for the given query, this can be especially useful when the user want to search for current information.""",
+    schema_example="""{
+    "query": "the users search query"
+    }""",
+    tool_name="web_search"
+)
+
+memory_lookup = dict(
+    schema={
+        "type": "object",
+        "properties": {
+            "description": {
+                "type": "string",
+                "description": "A clear meomory lookup description"
+            }
+        }
+    },
+    tool_description="""The memory lookup function will search the bots memory for the given description, this can be especially useful when the user want to recall a previous conversation or information.""",
+    schema_example="""{
+    "description": "The users memory lookup description"
+    }""",
+    tool_name="memory_lookup"
+)
+
+intend_categorizer = dict(
+    schema={
+        "type": "object",
+        "properties": {
+            "intends": {
+                "type": "array",
+                "items": {
+                    "type": "string",
+                    "enum": ["web_search", "memory_lookup", "casual"]
+                },
+                "description": "List of user intends"
+            }
+        }
+    },
+    schema_example="""{
+    "intends": "List of user intends"
+    }""",
+    tool_name="intend_categorizer",
+    tool_description="""
+The tool usage categorizer function should list all intends the user has, here are the descriptions of the indends:
+
+- web_search: The web search function will search the web for the given query, this can be especially useful when the user want to search for current information.
+- memory_lookup: The memory lookup function will search the bots memory for the given description, this can be especially useful when the user want to recall a previous conversation or information.
+- casual: The casual function is a casual conversation with the bot, this can be especially useful when the user want to have a casual conversation with the bot.
+The casual function can only be used without the other functions intends.
+"""
+)
 
 nodes = [
     RagNode("StartNode", start_node=True),
     CasualResponseNode(
         "CasualResponse",
+        speculative=True,
+        stream=True,
+        cache=True,
+        router=True,
         system_prompt="You are an Higly intelligent and carismatic AI, you should respond presicely but still casual to the users prompt."
     ),
     ParamExtractorNode(
         "WebExtract",
-        schema={
-            "type": "object",
-            "properties": {
-                "query": {
-                    "type": "string",
-                    "description": "The search query"
-                }
-            }
-        },
-        tool_description="""The web search function will search the web for the given query, this can be especially useful when the user want to search for current information.""",
-        schema_example="""{
-        "query": "the users search query"
-        }""",
-        tool_name="web_search"
+        speculative=True,
+        policy="adaptive",
+        cache=True,
+        release_fields=["query"],
+        **web_extract
     ),
     ParamExtractorNode(
         "MemoryLookup",
-        schema={
-            "type": "object",
-            "properties": {
-                "description": {
-                    "type": "string",
-                    "description": "A clear meomory lookup description"
-                }
-            }
-        },
-        tool_description="""The memory lookup function will search the bots memory for the given description, this can be especially useful when the user want to recall a previous conversation or information.""",
-        schema_example="""{
-        "description": "The users memory lookup description"
-        }""",
-        tool_name="memory_lookup"
+        speculative=True,
+        policy="adaptive",
+        cache=True,
+        release_fields=["description"],
+        **memory_lookup
     ),
+    # the intends are a small enum, near-identical prompts share them, the
+    # parameter extractors copy entities from the prompt and must not
     ParamExtractorNode(
         "ToolUsageCategorizer",
-        schema={
-            "type": "object",
-            "properties": {
-                "intends": {
-                    "type": "array",
-                    "items": {
-                        "type": "string",
-                        "enum": ["web_search", "memory_lookup", "casual"]
-                    },
-                    "description": "List of user intends"
-                }
-            }
-        },
-        schema_example="""{
-        "intends": "List of user intends"
-        }""",
-        tool_name="intend_categorizer",
-        tool_description="""
-The tool usage categorizer function should list all intends the user has, here are the descriptions of the indends:
-
-- web_search: The web search function will search the web for the given query, this can be especially useful when the user want to search for current information.
-- memory_lookup: The memory lookup function will search the bots memory for the given description, this can be especially useful when the user want to recall a previous conversation or information.
-- casual: The casual function is a casual conversation with the bot, this can be especially useful when the user want to have a casual conversation with the bot.
-The casual function can only be used without the other functions intends.
-""",
+        cache=True,
+        semantic_cache=True,
+        router=True,
+        release_fields=["intends"],
+        **intend_categorizer
     ),
     ToolSelectorNode("ToolSelector"),
-    WebSearchLookup("WebSearchLookup"),
-    WebSearchResponse("WebSearchResponse", end_node=True),
-    ToolCasualEndNode("EndNode", end_node=True)
+    WebSearchLookup("WebSearchLookup", join="all", search_cache=True),
+    WebSearchDistill("WebSearchDistill", token_budget=600),
+    WebSearchResponse("WebSearchResponse", end_node=True, stream=True, router=True),
+    MemoryRetrievalNode("MemoryRetrieval", join="all", mode="hybrid"),
+    MemoryResponse("MemoryLookupResponse", end_node=True, stream=True, router=True),
+    ToolCasualEndNode("EndNode", end_node=True, join="all")
 ]
 
 def end_casual_check(edge, context: NodeContext):
     selected_tools = context.all_results["ToolUsageCategorizer"].response["intends"]
     if "casual" in selected_tools and len(selected_tools) == 1:
-        edge.disabed = False
+        edge.disabled = False
     else:
         edge.disabled = True
-    print(f"*** End casual edge disabled: {edge.disabled}")
+    log(f"*** End casual edge disabled: {edge.disabled}")
     
 def use_webseach_check(edge, context: NodeContext):
     selected_tools = context.all_results["ToolUsageCategorizer"].response["intends"]
@@ -90,7 +124,7 @@ def use_webseach_check(edge, context: NodeContext):
         edge.disabled = False
     else:
         edge.disabled = True
-    print(f"*** Web search edge disabled: {edge.disabled}")
+    log(f"*** Web search edge disabled: {edge.disabled}")
     
 def end_websearch_response(edge, context: NodeContext):
     selected_tools = context.all_results["ToolUsageCategorizer"].response["intends"]
@@ -98,7 +132,23 @@ def end_websearch_response(edge, context: NodeContext):
         edge.disabled = False
     else:
         edge.disabled = True
-    print(f"*** Web search edge disabled: {edge.disabled}")
+    log(f"*** Web search edge disabled: {edge.disabled}")
+
+def use_memory_check(edge, context: NodeContext):
+    selected_tools = context.all_results["ToolUsageCategorizer"].response["intends"]
+    if "memory_lookup" in selected_tools:
+        edge.disabled = False
+    else:
+        edge.disabled = True
+    log(f"*** Memory lookup edge disabled: {edge.disabled}")
+    
+def end_memory_response(edge, context: NodeContext):
+    selected_tools = context.all_results["ToolUsageCategorizer"].response["intends"]
+    if ("memory_lookup" in selected_tools) and len(selected_tools) == 1:
+        edge.disabled = False
+    else:
+        edge.disabled = True
+    log(f"*** Memory response edge disabled: {edge.disabled}")
 
 edges = [
     # Inital stage
@@ -118,49 +168,93 @@ edges = [
         start="StartNode",
         end="ToolUsageCategorizer"
     ),
-    # Process first stage results
-    RagEdge(
-        start="WebExtract",
-        end="ToolSelector"
-    ),
+    # Process first stage results, only the categorizer gates the tool selection
     RagEdge(
         start="ToolUsageCategorizer",
         end="ToolSelector"
     ),
-    RagEdge(
-        start="MemoryLookup",
-        end="ToolSelector"
-    ),
-    RagEdge(
-        start="CasualResponse",
-        end="ToolSelector"
-    ),
     
     RagEdge(
         start="ToolSelector",
         end="WebSearchLookup",
         update_overwrite=use_webseach_check
     ),
+    RagEdge(
+        start="WebExtract",
+        end="WebSearchLookup"
+    ),
     
     RagEdge(
         start="WebSearchLookup",
+        end="WebSearchDistill"
+    ),
+    RagEdge(
+        start="WebSearchDistill",
         end="WebSearchResponse",
         update_overwrite=end_websearch_response
     ),
 
+    RagEdge(
+        start="ToolSelector",
+        end="MemoryRetrieval",
+        update_overwrite=use_memory_check
+    ),
+    RagEdge(
+        start="MemoryLookup",
+        end="MemoryRetrieval"
+    ),
+    
+    RagEdge(
+        start="MemoryRetrieval",
+        end="MemoryLookupResponse",
+        update_overwrite=end_memory_response
+    ),
+
     RagEdge( # Happy-Path to casual response
         start="ToolSelector",
         end="EndNode",
         update_overwrite=end_casual_check
+    ),
+    RagEdge(
+        start="CasualResponse",
+        end="EndNode"
+    )
+]
+
+# Variant that asks for the parameters of all first stage tools in one completion,
+# the sub-results are published under the original node names.
+fused_extractor_names = ["WebExtract", "MemoryLookup", "ToolUsageCategorizer"]
+
+fused_nodes = [node for node in nodes if node.name not in fused_extractor_names] + [
+    FusedExtractorNode(
+        "FirstStageExtract",
+        cache=True,
+        router=True,
+        extractors=[
+            ExtractorSpec("WebExtract", **web_extract),
+            ExtractorSpec("MemoryLookup", **memory_lookup),
+            ExtractorSpec("ToolUsageCategorizer", **intend_categorizer)
+        ]
+    )
+]
+
+fused_edges = [
+    RagEdge(
+        start="StartNode",
+        end="FirstStageExtract"
     )
+] + [
+    edge for edge in edges
+    if not (edge.start == "StartNode" and edge.end in fused_extractor_names)
 ]
 
 
-def get_graph() -> RagGraph:
+def get_graph(fused_extraction: bool = False) -> RagGraph:
     graph = RagGraph(
-        nodes=nodes,
-        edges=edges
+        nodes=fused_nodes if fused_extraction else nodes,
+        edges=fused_edges if fused_extraction else edges
     )
+    graph.compile()
     return graph
     
 
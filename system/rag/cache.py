@@ -0,0 +1,179 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.getenv(
+    "RAG_COMPLETION_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "tims_ragged_system", "completions.sqlite3")
+)
+
+def make_key(params: dict) -> str:
+    # content address of a request, independent of dict ordering
+    canonical = json.dumps(params, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class LRUCache:
+    # in-memory tier, evicts least recently used entries once max_bytes is exceeded
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key, now):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, size, value = entry
+        if expires_at is not None and expires_at <= now:
+            self.pop(key)
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value, size, expires_at):
+        self.pop(key)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (expires_at, size, value)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, evicted_size, _) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+class SQLiteCache:
+    # persistent tier, survives restarts and is shared by processes on one host
+    purge_every = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        self.puts = 0
+        self.purge(time.time())
+
+    def get(self, key, now):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, expires_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None, None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= now:
+            return None, None
+        return value, expires_at
+
+    def put(self, key, value, expires_at):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO completions (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+            self.puts += 1
+        if self.puts % self.purge_every == 0:
+            self.purge(time.time())
+
+    def purge(self, now):
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM completions WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+            )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+class CompletionCache:
+    # content-addressed cache for deterministic completions,
+    # memory LRU in front of an optional on-disk SQLite tier
+
+    def __init__(
+            self,
+            path: str = None,
+            max_bytes: int = 64 * 1024 * 1024,
+            ttl: float = None
+        ):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.memory = LRUCache(max_bytes)
+        self.disk = SQLiteCache(path) if path is not None else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            value = self.memory.get(key, now)
+            if value is not None:
+                self.memory_hits += 1
+                return json.loads(value)
+        if self.disk is not None:
+            value, expires_at = self.disk.get(key, now)
+            if value is not None:
+                with self.lock:
+                    self.disk_hits += 1
+                    self.memory.put(key, value, len(value), expires_at)
+                return json.loads(value)
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value: dict, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        encoded = json.dumps(value, ensure_ascii=False)
+        with self.lock:
+            self.memory.put(key, encoded, len(encoded), expires_at)
+        if self.disk is not None:
+            self.disk.put(key, encoded, expires_at)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self.memory.entries),
+                "memory_bytes": self.memory.size,
+                "evictions": self.memory.evictions
+            }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_default_cache() -> CompletionCache:
+    # created on first use, so importing rag never touches the filesystem
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = CompletionCache(path=DEFAULT_CACHE_PATH)
+    return _default_cache
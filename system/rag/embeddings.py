@@ -0,0 +1,57 @@
+from typing import List
+import zlib
+import numpy as np
+from rag.models import BACKENDS, Backends, BackendConfig, CLIENTS
+from rag.limits import get_limiter
+
+class Embedder:
+    # maps texts to L2 normalized float32 vectors, shape (len(texts), dim)
+    dim: int = None
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def embed_one(self, text: str) -> np.ndarray:
+        return self.embed([text])[0]
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+class HashedNgramEmbedder(Embedder):
+    # local, dependency free default: hashed character n-gram counts,
+    # good enough to catch paraphrases and near-identical prompts offline
+
+    def __init__(self, dim: int = 1024, ngram_range=(3, 5)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def features(self, text: str):
+        text = " " + " ".join(text.lower().split()) + " "
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(max(len(text) - n + 1, 0)):
+                yield zlib.crc32(text[i:i + n].encode("utf-8"))
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            hashes = np.fromiter(self.features(text), dtype=np.uint32)
+            if len(hashes) > 0:
+                np.add.at(vectors[row], hashes % self.dim, 1.0)
+        return normalize(vectors)
+
+class OpenAIEmbedder(Embedder):
+    # embeddings endpoint of any openai compatible backend in rag.models
+
+    def __init__(self, model: str = "text-embedding-3-small", dim: int = 1536, backend: BackendConfig = None):
+        self.model = model
+        self.dim = dim
+        self.backend = BACKENDS[Backends.OPENAI] if backend is None else backend
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        client = CLIENTS.get_client(self.backend)
+        response = get_limiter(self.backend).call(lambda: client.embeddings.create(model=self.model, input=texts))
+        vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+        return normalize(vectors)
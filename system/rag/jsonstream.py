@@ -0,0 +1,109 @@
+import json
+
+# Incremental parser for a JSON object that arrives in chunks, e.g. a streamed
+# extractor completion. It scans each character once and reports every top
+# level field as soon as its value is complete, long before the closing brace:
+#   parser.feed('{"query": "weather in Aa')   -> {}
+#   parser.feed('chen", "reason')             -> {"query": "weather in Aachen"}
+# Text before the opening brace (e.g. a ```json fence) is skipped.
+
+class IncrementalJSONParser:
+
+    def __init__(self):
+        self.text = []
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        # top level object: "key", "colon", "value", "after_value"
+        self.expect = None
+        self.key_start = None
+        self.key = None
+        self.value_start = None
+        self.fields = {}
+        self.done = False
+        self.failed = False
+
+    def feed(self, chunk: str) -> dict:
+        # returns the fields completed by this chunk
+        if self.done or self.failed or not chunk:
+            return {}
+        start = self.position
+        self.text.append(chunk)
+        completed = {}
+        for offset, char in enumerate(chunk):
+            index = start + offset
+            self.step(char, index, completed)
+            if self.done or self.failed:
+                break
+        self.position = start + len(chunk)
+        return completed
+
+    def source(self, start, end) -> str:
+        # joins the chunks once per completed field, not per character
+        text = "".join(self.text)
+        self.text = [text]
+        return text[start:end]
+
+    def complete_value(self, end, completed):
+        try:
+            value = json.loads(self.source(self.value_start, end))
+        except ValueError:
+            self.failed = True
+            return
+        self.fields[self.key] = value
+        completed[self.key] = value
+        self.key = None
+        self.value_start = None
+        self.expect = "after_value"
+
+    def step(self, char, index, completed):
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif char == "\\":
+                self.escape = True
+            elif char == '"':
+                self.in_string = False
+                if self.depth == 1 and self.expect == "key":
+                    self.key = json.loads(self.source(self.key_start, index + 1))
+                    self.expect = "colon"
+                elif self.depth == 1 and self.expect == "value":
+                    self.complete_value(index + 1, completed)
+            return
+
+        if self.depth == 0:
+            if char == "{":
+                self.depth = 1
+                self.expect = "key"
+            return
+
+        if self.depth == 1 and self.expect == "value" and self.value_start is None:
+            if char.isspace():
+                return
+            self.value_start = index
+
+        if char == '"':
+            self.in_string = True
+            if self.depth == 1 and self.expect == "key":
+                self.key_start = index
+        elif char in "{[":
+            self.depth += 1
+        elif char in "}]":
+            if self.depth == 1:
+                self.end_scalar(index, completed)
+                self.done = True
+            self.depth -= 1
+            if self.depth == 1 and self.expect == "value" and self.value_start is not None:
+                self.complete_value(index + 1, completed)
+        elif self.depth == 1:
+            if char == ":" and self.expect == "colon":
+                self.expect = "value"
+            elif char == ",":
+                self.end_scalar(index, completed)
+                self.expect = "key"
+
+    def end_scalar(self, index, completed):
+        # numbers, true, false and null only end at the next ',' or '}'
+        if self.expect == "value" and self.value_start is not None:
+            self.complete_value(index, completed)
@@ -0,0 +1,361 @@
+from collections import deque
+import asyncio
+import random
+import threading
+import time
+from rag.models import BackendConfig
+from rag.log import log
+
+# Client side rate limiting per backend: token buckets for requests/min and
+# tokens/min, an AIMD concurrency cap that halves when many recent calls got
+# a 429/5xx and grows by one slot per window of successful calls, and retries
+# that honour Retry-After. Calls beyond the cap wait in a FIFO queue instead of turning
+# into 429s, the openai clients themselves don't retry (max_retries=0).
+
+def retryable_errors():
+    # the caller already imported openai with its client (rag/models.py)
+    import openai
+    return (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+def is_rate_limit(error) -> bool:
+    import openai
+    return isinstance(error, openai.RateLimitError)
+
+class TokenBucket:
+    # refills rate_per_minute / 60 per second up to burst, a reservation may
+    # take the bucket negative and returns how long the caller has to wait
+
+    def __init__(self, rate_per_minute: float, burst: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.burst = rate_per_minute if burst is None else burst
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float = 1.0) -> float:
+        with self.lock:
+            self.refill(time.monotonic())
+            # requests larger than the burst would never fit
+            self.tokens -= min(amount, self.burst)
+            return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount: float):
+        # charge (or refund) the difference between the estimate and the reported usage
+        with self.lock:
+            self.tokens -= amount
+
+class Waiter:
+    # a call queued for a concurrency slot, woken from whichever thread releases one
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self.resolve)
+
+    def resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+class BackendLimiter:
+
+    def __init__(
+            self,
+            name: str,
+            rpm: float = None,
+            tpm: float = None,
+            max_concurrency: int = 64,
+            min_concurrency: int = 1,
+            initial_concurrency: int = None,
+            decrease: float = 0.5,
+            overload_threshold: float = 0.3,
+            max_retries: int = 3,
+            base_backoff: float = 0.5,
+            max_backoff: float = 30.0
+        ):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency if initial_concurrency is None else initial_concurrency)
+        self.decrease = decrease
+        # share of recent calls answered with 429/5xx (exponentially weighted,
+        # alpha 0.05) above which the limit decreases, sporadic errors of a
+        # backend below its capacity don't shrink it
+        self.overload_threshold = overload_threshold
+        self.overload_rate = 0.0
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+        self.waiters = deque()
+        self.in_flight = 0
+        # number of decreases so far, a call only decreases the limit if it was
+        # sent after the last decrease
+        self.decreases = 0
+        self.stats = {
+            "calls": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "errors": 0,
+            "queued": 0,
+            "peak_queue_depth": 0,
+            "queue_wait": 0.0,
+            "throttle_wait": 0.0,
+            # calls whose estimate was corrected with the reported usage, and
+            # calls without usage that keep their estimate in the tokens/min bucket
+            "settled": 0,
+            "unsettled": 0,
+            "settled_tokens": 0.0
+        }
+
+    # concurrency slots
+
+    def try_acquire(self, waiter: Waiter = None) -> bool:
+        with self.lock:
+            if self.in_flight < int(self.limit) and len(self.waiters) == 0:
+                self.in_flight += 1
+                return True
+            if waiter is not None:
+                self.waiters.append(waiter)
+                self.stats["queued"] += 1
+                self.stats["peak_queue_depth"] = max(self.stats["peak_queue_depth"], len(self.waiters))
+            return False
+
+    def acquire(self):
+        if self.try_acquire():
+            return
+        waiter = Waiter()
+        if not self.try_acquire(waiter):
+            started = time.monotonic()
+            waiter.event.wait()
+            self.add_stat("queue_wait", time.monotonic() - started)
+
+    async def aacquire(self):
+        if self.try_acquire():
+            return
+        waiter = Waiter(asyncio.get_running_loop())
+        if self.try_acquire(waiter):
+            return
+        started = time.monotonic()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self.lock:
+                granted = waiter not in self.waiters
+                if not granted:
+                    self.waiters.remove(waiter)
+            # the slot was handed over while the call was cancelled
+            if granted:
+                self.release()
+            raise
+        self.add_stat("queue_wait", time.monotonic() - started)
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+            woken = self.grant()
+        for waiter in woken:
+            waiter.wake()
+
+    def grant(self):
+        # hands free slots to queued calls in order, called with the lock held
+        woken = []
+        while len(self.waiters) > 0 and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            woken.append(self.waiters.popleft())
+        return woken
+
+    # AIMD
+
+    def on_success(self):
+        with self.lock:
+            self.overload_rate *= 0.95
+            # one more slot per window of limit successful calls
+            self.limit = min(float(self.max_concurrency), self.limit + 1.0 / max(self.limit, 1.0))
+            woken = self.grant()
+        for waiter in woken:
+            waiter.wake()
+
+    def on_overload(self, window: int):
+        # the backend-wide reaction to 429/5xx, Retry-After only delays the
+        # retry of the rejected call (see backoff), pausing every queued call
+        # on one 429 collapses the throughput
+        with self.lock:
+            self.overload_rate = 0.95 * self.overload_rate + 0.05
+            # the calls of one burst were sent at the same limit and fail
+            # together, only the first of them decreases it
+            if self.overload_rate >= self.overload_threshold and window == self.decreases:
+                self.limit = max(float(self.min_concurrency), self.limit * self.decrease)
+                self.decreases += 1
+
+    # rates and retries
+
+    def throttle(self, tokens: float) -> float:
+        # seconds to wait before the call may go out
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        if wait > 0:
+            self.add_stat("throttle_wait", wait)
+        return wait
+
+    def refund(self, tokens: float):
+        # the call was cancelled before it went out
+        if self.requests is not None:
+            self.requests.adjust(-1)
+        if self.tokens is not None and tokens:
+            self.tokens.adjust(-tokens)
+
+    def settle(self, estimated: float, used: float):
+        if self.tokens is None or not estimated:
+            return
+        if used is None:
+            self.add_stat("unsettled", 1)
+            return
+        with self.lock:
+            self.stats["settled"] += 1
+            self.stats["settled_tokens"] += used - estimated
+        self.tokens.adjust(used - estimated)
+
+    def retry_after(self, error) -> float:
+        response = getattr(error, "response", None)
+        if response is not None:
+            headers = response.headers
+            try:
+                if headers.get("retry-after-ms") is not None:
+                    return float(headers["retry-after-ms"]) / 1000
+                if headers.get("retry-after") is not None:
+                    return float(headers["retry-after"])
+            except ValueError:
+                pass
+        return None
+
+    def backoff(self, error, attempt: int, window: int) -> float:
+        # Retry-After if the backend sent one, exponential backoff with full jitter otherwise
+        retry_after = self.retry_after(error)
+        if is_rate_limit(error) or getattr(error, "status_code", 0) >= 500:
+            self.on_overload(window)
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+    def record_failure(self, error):
+        if is_rate_limit(error):
+            self.add_stat("rate_limited", 1)
+        else:
+            self.add_stat("errors", 1)
+
+    def call(self, request, tokens: float = None, usage=None, retries: int = None):
+        # request() sends the call, usage(result) returns the tokens it consumed
+        retries = self.max_retries if retries is None else retries
+        self.add_stat("calls", 1)
+        for attempt in range(retries + 1):
+            time.sleep(self.throttle(tokens))
+            self.acquire()
+            window = self.decreases
+            try:
+                result = request()
+            except retryable_errors() as e:
+                self.record_failure(e)
+                delay = self.backoff(e, attempt, window)
+                if attempt == retries:
+                    raise
+            else:
+                self.on_success()
+                self.settle(tokens, usage(result) if usage is not None else None)
+                return result
+            finally:
+                self.release()
+            self.add_stat("retries", 1)
+            log(f"*** {self.name} overloaded, retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+    async def acall(self, request, tokens: float = None, usage=None, retries: int = None):
+        # request() returns the awaitable of the call
+        retries = self.max_retries if retries is None else retries
+        self.add_stat("calls", 1)
+        for attempt in range(retries + 1):
+            try:
+                await asyncio.sleep(self.throttle(tokens))
+            except asyncio.CancelledError:
+                # e.g. a speculative node that is no longer needed
+                self.refund(tokens)
+                raise
+            await self.aacquire()
+            window = self.decreases
+            try:
+                result = await request()
+            except retryable_errors() as e:
+                self.record_failure(e)
+                delay = self.backoff(e, attempt, window)
+                if attempt == retries:
+                    raise
+            else:
+                self.on_success()
+                self.settle(tokens, usage(result) if usage is not None else None)
+                return result
+            finally:
+                self.release()
+            self.add_stat("retries", 1)
+            log(f"*** {self.name} overloaded, retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    def add_stat(self, name, value):
+        with self.lock:
+            self.stats[name] += value
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "in_flight": self.in_flight,
+                "queue_depth": len(self.waiters),
+                "concurrency_limit": self.limit,
+                "decreases": self.decreases,
+                "overload_rate": self.overload_rate,
+                **self.stats
+            }
+
+class LimiterRegistry:
+    # one limiter per BackendConfig, shared by every node and thread
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.limiters = {}
+
+    def get(self, backend: BackendConfig) -> BackendLimiter:
+        limiter = self.limiters.get(backend)
+        if limiter is None:
+            with self.lock:
+                limiter = self.limiters.get(backend)
+                if limiter is None:
+                    limiter = BackendLimiter(
+                        backend.name,
+                        rpm=backend.rpm,
+                        tpm=backend.tpm,
+                        max_concurrency=backend.max_concurrency
+                    )
+                    self.limiters[backend] = limiter
+        return limiter
+
+    def metrics(self):
+        with self.lock:
+            limiters = list(self.limiters.values())
+        return {limiter.name: limiter.metrics() for limiter in limiters}
+
+LIMITERS = LimiterRegistry()
+
+def get_limiter(backend: BackendConfig) -> BackendLimiter:
+    return LIMITERS.get(backend)
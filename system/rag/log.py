@@ -0,0 +1,19 @@
+import os
+import sys
+
+# Diagnostics of the engine and the nodes go to stderr, stdout carries the
+# answer that run_agent.py streams token by token:
+#   python3 run_agent.py -p "How are you?" 2>/dev/null
+# RAG_QUIET=1 (or set_quiet(True)) turns them off, e.g. for benchmarks that
+# would otherwise measure writing them.
+
+QUIET = os.getenv("RAG_QUIET") is not None
+
+def set_quiet(quiet: bool):
+    global QUIET
+    QUIET = quiet
+
+def log(*args):
+    if QUIET:
+        return
+    print(*args, file=sys.stderr, flush=True)
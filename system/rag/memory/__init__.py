@@ -0,0 +1,11 @@
+from .store import MemoryStore, MemoryHit, get_default_store
+from .ivf import IVFIndex
+from .bm25 import BM25Index
+
+__all__ = [
+    "MemoryStore",
+    "MemoryHit",
+    "get_default_store",
+    "IVFIndex",
+    "BM25Index"
+]
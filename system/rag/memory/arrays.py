@@ -0,0 +1,24 @@
+import numpy as np
+
+class GrowableArray:
+    # append-only numpy buffer with amortized O(1) appends
+
+    def __init__(self, dtype, row_shape=()):
+        self.dtype = dtype
+        self.row_shape = row_shape
+        self.data = np.zeros((16,) + row_shape, dtype=dtype)
+        self.size = 0
+
+    def extend(self, rows):
+        rows = np.asarray(rows, dtype=self.dtype).reshape((-1,) + self.row_shape)
+        needed = self.size + len(rows)
+        if needed > len(self.data):
+            capacity = max(needed, 2 * len(self.data))
+            grown = np.zeros((capacity,) + self.row_shape, dtype=self.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:needed] = rows
+        self.size = needed
+
+    def view(self):
+        return self.data[:self.size]
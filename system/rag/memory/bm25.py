@@ -0,0 +1,156 @@
+from collections import Counter
+from typing import List, Tuple
+import re
+import numpy as np
+from rag.memory.arrays import GrowableArray
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    # Lexical index over the memory texts. Postings are flat arrays in CSR layout:
+    # doc_ids[offsets[t]:offsets[t + 1]] holds the documents of term t, tfs the
+    # term counts. New postings go to an append buffer that is merged into the
+    # CSR arrays once it outgrows a fraction of them, so inserts stay cheap.
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, merge_ratio: float = 0.25, min_buffer: int = 65536):
+        self.k1 = k1
+        self.b = b
+        self.merge_ratio = merge_ratio
+        self.min_buffer = min_buffer
+        self.vocabulary = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.tfs = np.zeros(0, dtype=np.uint16)
+        self.pending_terms = GrowableArray(np.int32)
+        self.pending_docs = GrowableArray(np.int32)
+        self.pending_tfs = GrowableArray(np.uint16)
+        self.df = GrowableArray(np.int32)
+        self.lengths = GrowableArray(np.int32)
+        self.total_length = 0
+        self.count = 0
+
+    def add(self, texts: List[str]):
+        # documents are numbered in insertion order, matching the memory store rows
+        terms, docs, tfs, lengths = [], [], [], []
+        for doc_id, text in enumerate(texts, start=self.count):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_id = self.vocabulary.get(term)
+                if term_id is None:
+                    term_id = self.vocabulary[term] = len(self.vocabulary)
+                terms.append(term_id)
+                docs.append(doc_id)
+                tfs.append(min(tf, 65535))
+        terms = np.array(terms, dtype=np.int32)
+        if len(self.vocabulary) > self.df.size:
+            self.df.extend(np.zeros(len(self.vocabulary) - self.df.size, dtype=np.int32))
+        np.add.at(self.df.view(), terms, 1)
+        self.pending_terms.extend(terms)
+        self.pending_docs.extend(docs)
+        self.pending_tfs.extend(tfs)
+        self.lengths.extend(lengths)
+        self.total_length += sum(lengths)
+        self.count += len(texts)
+        if self.pending_terms.size > max(self.min_buffer, self.merge_ratio * len(self.doc_ids)):
+            self.merge()
+
+    def merge(self):
+        # stable sort by term keeps the doc ids of every postings list ascending
+        if self.pending_terms.size == 0:
+            return
+        merged_terms = np.repeat(np.arange(len(self.offsets) - 1, dtype=np.int32), np.diff(self.offsets))
+        terms = np.concatenate([merged_terms, self.pending_terms.view()])
+        order = np.argsort(terms, kind="stable")
+        self.doc_ids = np.concatenate([self.doc_ids, self.pending_docs.view()])[order]
+        self.tfs = np.concatenate([self.tfs, self.pending_tfs.view()])[order]
+        counts = np.bincount(terms, minlength=len(self.vocabulary))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.pending_terms = GrowableArray(np.int32)
+        self.pending_docs = GrowableArray(np.int32)
+        self.pending_tfs = GrowableArray(np.uint16)
+
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        docs = [self.doc_ids[0:0]]
+        tfs = [self.tfs[0:0]]
+        if term_id < len(self.offsets) - 1:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs.append(self.doc_ids[start:end])
+            tfs.append(self.tfs[start:end])
+        if self.pending_terms.size > 0:
+            mask = self.pending_terms.view() == term_id
+            docs.append(self.pending_docs.view()[mask])
+            tfs.append(self.pending_tfs.view()[mask])
+        return np.concatenate(docs), np.concatenate(tfs)
+
+    def search(self, text: str, k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+        # returns (doc ids, bm25 scores) of the top-k, best first
+        term_ids = {self.vocabulary[term] for term in tokenize(text) if term in self.vocabulary}
+        if self.count == 0 or len(term_ids) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        lengths = self.lengths.view()
+        average_length = max(self.total_length / self.count, 1.0)
+        all_docs = []
+        all_scores = []
+        for term_id in term_ids:
+            docs, tfs = self.postings(term_id)
+            df = self.df.view()[term_id]
+            idf = np.log(1.0 + (self.count - df + 0.5) / (df + 0.5))
+            tfs = tfs.astype(np.float32)
+            norm = self.k1 * (1.0 - self.b + self.b * lengths[docs] / average_length)
+            all_docs.append(docs)
+            all_scores.append(idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+        all_docs = np.concatenate(all_docs)
+        if len(all_docs) * 8 > self.count:
+            # common terms, accumulating into a dense score vector beats sorting
+            scores = np.bincount(all_docs, weights=np.concatenate(all_scores), minlength=self.count)
+            docs = np.flatnonzero(scores)
+            scores = scores[docs]
+        else:
+            docs, inverse = np.unique(all_docs, return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return docs[top].astype(np.int64), scores[top].astype(np.float32)
+
+    def nbytes(self) -> int:
+        # array memory only, the vocabulary dict comes on top
+        arrays = [self.offsets, self.doc_ids, self.tfs]
+        buffers = [self.pending_terms, self.pending_docs, self.pending_tfs, self.df, self.lengths]
+        return sum(a.nbytes for a in arrays) + sum(b.data.nbytes for b in buffers)
+
+    def save(self, path):
+        self.merge()
+        terms = [None] * len(self.vocabulary)
+        for term, term_id in self.vocabulary.items():
+            terms[term_id] = term
+        np.savez(
+            path,
+            terms=np.frombuffer("\n".join(terms).encode("utf-8"), dtype=np.uint8),
+            offsets=self.offsets,
+            doc_ids=self.doc_ids,
+            tfs=self.tfs,
+            df=self.df.view(),
+            lengths=self.lengths.view(),
+            params=np.array([self.k1, self.b], dtype=np.float64)
+        )
+
+    @classmethod
+    def load(cls, path) -> "BM25Index":
+        data = np.load(path)
+        k1, b = [float(v) for v in data["params"]]
+        index = cls(k1=k1, b=b)
+        terms = data["terms"].tobytes().decode("utf-8")
+        index.vocabulary = {term: term_id for term_id, term in enumerate(terms.split("\n"))} if terms else {}
+        index.offsets = data["offsets"]
+        index.doc_ids = data["doc_ids"]
+        index.tfs = data["tfs"]
+        index.df.extend(data["df"])
+        index.lengths.extend(data["lengths"])
+        index.total_length = int(index.lengths.view().sum())
+        index.count = index.lengths.size
+        return index
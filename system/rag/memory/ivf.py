@@ -0,0 +1,120 @@
+from typing import Tuple
+import numpy as np
+from rag.memory.arrays import GrowableArray
+
+def kmeans(vectors: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    # spherical k-means, vectors are L2 normalized so the dot product is the cosine
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = assign(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=nlist)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        empty = counts == 0
+        sums = np.zeros_like(centroids)
+        sums[~empty] = np.add.reduceat(vectors[order], starts[~empty], axis=0)
+        # re-seed empty lists with random vectors
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+def assign(vectors: np.ndarray, centroids: np.ndarray, chunk_floats: int = 1 << 25) -> np.ndarray:
+    # nearest centroid per vector, chunked so the score matrix stays ~128MB
+    chunk = max(1, chunk_floats // len(centroids))
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk):
+        scores = vectors[start:start + chunk] @ centroids.T
+        assignment[start:start + chunk] = np.argmax(scores, axis=1)
+    return assignment
+
+class IVFIndex:
+    # Inverted file index: vectors are bucketed by their nearest k-means centroid,
+    # a query only scans the nprobe buckets whose centroids are closest to it.
+    # Buckets hold copies of their vectors so each probe is one contiguous matmul.
+
+    def __init__(self, dim: int, nlist: int = 256, nprobe: int = 8, iterations: int = 10):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.centroids = None
+        self.list_ids = []
+        self.list_vectors = []
+        self.count = 0
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def train(self, vectors: np.ndarray, max_samples: int = 256 * 1024, seed: int = 0):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.nlist = min(self.nlist, len(vectors))
+        if len(vectors) > max_samples:
+            rng = np.random.default_rng(seed)
+            vectors = vectors[rng.choice(len(vectors), size=max_samples, replace=False)]
+        self.centroids = kmeans(vectors, self.nlist, self.iterations, seed)
+        self.list_ids = [GrowableArray(np.int64) for _ in range(self.nlist)]
+        self.list_vectors = [GrowableArray(np.float32, (self.dim,)) for _ in range(self.nlist)]
+
+    def add(self, vectors: np.ndarray, ids: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        ids = np.asarray(ids, dtype=np.int64)
+        assignment = assign(vectors, self.centroids)
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(self.nlist + 1))
+        for list_id in range(self.nlist):
+            rows = order[bounds[list_id]:bounds[list_id + 1]]
+            if len(rows) > 0:
+                self.list_ids[list_id].extend(ids[rows])
+                self.list_vectors[list_id].extend(vectors[rows])
+        self.count += len(ids)
+
+    def search(self, query: np.ndarray, k: int = 5, nprobe: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        # returns (ids, scores) of the approximate top-k, best first
+        nprobe = min(self.nprobe if nprobe is None else nprobe, self.nlist)
+        coarse = self.centroids @ query
+        probes = np.argpartition(-coarse, nprobe - 1)[:nprobe]
+        ids = []
+        scores = []
+        for list_id in probes:
+            if self.list_ids[list_id].size > 0:
+                ids.append(self.list_ids[list_id].view())
+                scores.append(self.list_vectors[list_id].view() @ query)
+        if len(ids) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        ids = np.concatenate(ids)
+        scores = np.concatenate(scores)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return ids[top], scores[top]
+
+    def save(self, path):
+        # buckets are stored back to back, list_offsets delimit them
+        sizes = [ids.size for ids in self.list_ids]
+        np.savez(
+            path,
+            centroids=self.centroids,
+            list_offsets=np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64),
+            ids=np.concatenate([ids.view() for ids in self.list_ids]),
+            vectors=np.concatenate([vectors.view() for vectors in self.list_vectors]),
+            params=np.array([self.dim, self.nlist, self.nprobe, self.iterations], dtype=np.int64)
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        data = np.load(path)
+        dim, nlist, nprobe, iterations = [int(v) for v in data["params"]]
+        index = cls(dim, nlist=nlist, nprobe=nprobe, iterations=iterations)
+        index.centroids = data["centroids"]
+        index.list_ids = [GrowableArray(np.int64) for _ in range(nlist)]
+        index.list_vectors = [GrowableArray(np.float32, (dim,)) for _ in range(nlist)]
+        offsets, ids, vectors = data["list_offsets"], data["ids"], data["vectors"]
+        for list_id in range(nlist):
+            index.list_ids[list_id].extend(ids[offsets[list_id]:offsets[list_id + 1]])
+            index.list_vectors[list_id].extend(vectors[offsets[list_id]:offsets[list_id + 1]])
+        index.count = len(ids)
+        return index
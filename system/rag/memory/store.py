@@ -0,0 +1,271 @@
+from dataclasses import dataclass
+from typing import List
+import json
+import os
+import threading
+import time
+import numpy as np
+from rag.embeddings import Embedder, HashedNgramEmbedder
+from rag.memory.arrays import GrowableArray
+from rag.memory.ivf import IVFIndex
+from rag.memory.bm25 import BM25Index
+from rag.log import log
+
+DEFAULT_MEMORY_PATH = os.getenv(
+    "RAG_MEMORY_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "tims_ragged_system", "memory")
+)
+
+@dataclass
+class MemoryHit:
+    index: int
+    score: float
+    text: str
+    timestamp: float
+
+    def to_dict(self):
+        return {
+            "index": self.index,
+            "score": self.score,
+            "text": self.text,
+            "timestamp": self.timestamp
+        }
+
+class MemoryStore:
+    # Embeddings live in one contiguous float32 matrix, metadata in compact side
+    # arrays (timestamps, offsets into a utf-8 text blob). With a path every
+    # array is an append-only file that is memory-mapped on open, so startup
+    # doesn't load or parse anything.
+    # enable_ann() adds an IVF index for approximate search over large stores,
+    # a BM25 index for keyword search is built on the first lexical query.
+
+    def __init__(self, path: str = None, embedder: Embedder = None):
+        self.path = path
+        self.embedder = HashedNgramEmbedder() if embedder is None else embedder
+        self.dim = self.embedder.dim
+        self.lock = threading.Lock()
+        self.count = 0
+        self.index = None
+        self.ann_nlist = None
+        self.ann_nprobe = 8
+        self.ann_train_size = None
+        self.lexical = None
+        self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self.timestamps = np.zeros(0, dtype=np.float64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.texts = b""
+        if path is None:
+            self.vector_buffer = GrowableArray(np.float32, (self.dim,))
+            self.timestamp_buffer = GrowableArray(np.float64)
+            self.offset_buffer = GrowableArray(np.int64)
+            self.offset_buffer.extend([0])
+            self.text_buffer = bytearray()
+        else:
+            self.open()
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def open(self):
+        os.makedirs(self.path, exist_ok=True)
+        manifest_path = self.file("manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest["dim"] != self.dim:
+                raise ValueError(f"Memory at {self.path} has dim {manifest['dim']}, embedder has {self.dim}")
+        else:
+            with open(manifest_path, "w") as f:
+                json.dump({"dim": self.dim, "embedder": type(self.embedder).__name__}, f)
+            with open(self.file("offsets.i64"), "wb") as f:
+                f.write(np.zeros(1, dtype=np.int64).tobytes())
+            for name in ("vectors.f32", "timestamps.f64", "texts.bin"):
+                open(self.file(name), "ab").close()
+        self.remap()
+        self.truncate_uncommitted()
+
+    def map_file(self, name, dtype, shape):
+        if shape[0] == 0 or os.path.getsize(self.file(name)) == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self.file(name), dtype=dtype, mode="r", shape=shape)
+
+    def remap(self):
+        # the offsets file is written last, its length is the committed row count
+        offsets_size = os.path.getsize(self.file("offsets.i64")) // 8
+        count = offsets_size - 1
+        self.offsets = self.map_file("offsets.i64", np.int64, (offsets_size,))
+        self.vectors = self.map_file("vectors.f32", np.float32, (count, self.dim))
+        self.timestamps = self.map_file("timestamps.f64", np.float64, (count,))
+        self.texts = self.map_file("texts.bin", np.uint8, (int(self.offsets[-1]),))
+        self.count = count
+
+    def truncate_uncommitted(self):
+        # an interrupted add() leaves bytes behind the committed rows, the next
+        # add() would append after them and the side files would no longer line up
+        for name, size in (
+                ("vectors.f32", self.count * self.dim * 4),
+                ("timestamps.f64", self.count * 8),
+                ("texts.bin", int(self.offsets[-1])),
+                ("offsets.i64", (self.count + 1) * 8)
+            ):
+            if os.path.getsize(self.file(name)) > size:
+                os.truncate(self.file(name), size)
+
+    def add(self, texts: List[str], timestamps: List[float] = None) -> List[int]:
+        vectors = self.embedder.embed(texts)
+        now = time.time()
+        timestamps = [now] * len(texts) if timestamps is None else timestamps
+        encoded = [text.encode("utf-8") for text in texts]
+        with self.lock:
+            start = self.count
+            ends = int(self.offsets[-1]) + np.cumsum([len(e) for e in encoded], dtype=np.int64)
+            if self.path is None:
+                self.vector_buffer.extend(vectors)
+                self.timestamp_buffer.extend(timestamps)
+                self.offset_buffer.extend(ends)
+                self.text_buffer.extend(b"".join(encoded))
+                self.vectors = self.vector_buffer.view()
+                self.timestamps = self.timestamp_buffer.view()
+                self.offsets = self.offset_buffer.view()
+                self.texts = self.text_buffer
+                self.count += len(texts)
+            else:
+                self.truncate_uncommitted()
+                for name, data in (
+                        ("vectors.f32", vectors.astype(np.float32).tobytes()),
+                        ("timestamps.f64", np.asarray(timestamps, dtype=np.float64).tobytes()),
+                        ("texts.bin", b"".join(encoded)),
+                        ("offsets.i64", ends.tobytes())
+                    ):
+                    with open(self.file(name), "ab") as f:
+                        f.write(data)
+                        f.flush()
+                        os.fsync(f.fileno())
+                self.remap()
+            self.update_index()
+            # the BM25 index only follows once a lexical search requested it
+            if self.lexical is not None:
+                self.get_lexical()
+            return list(range(start, start + len(texts)))
+
+    def enable_ann(self, nlist: int = None, nprobe: int = 8, train_size: int = 10000):
+        # searches stay exact until the store holds train_size rows,
+        # nlist defaults to ~4 * sqrt(rows) at training time
+        with self.lock:
+            self.ann_nlist = nlist
+            self.ann_nprobe = nprobe
+            self.ann_train_size = train_size
+            if self.index is None and self.path is not None and os.path.exists(self.file("ivf.npz")):
+                self.index = IVFIndex.load(self.file("ivf.npz"))
+                # saved before rows were truncated on open, it would return ids past the store
+                if self.index.count > self.count:
+                    log(f"*** Memory index has {self.index.count} rows, store {self.count}, retraining")
+                    self.index = None
+            if self.index is not None:
+                self.index.nprobe = nprobe
+            self.update_index()
+
+    def update_index(self):
+        # lock is held, trains once enough rows exist and indexes rows added since
+        if self.ann_train_size is None:
+            return
+        if self.index is None:
+            if self.count < self.ann_train_size:
+                return
+            nlist = self.ann_nlist or max(1, int(4 * np.sqrt(self.count)))
+            self.index = IVFIndex(self.dim, nlist=nlist, nprobe=self.ann_nprobe)
+            log(f"*** Training memory index with {nlist} lists on {self.count} rows")
+            self.index.train(self.vectors[:self.count])
+        if self.index.count < self.count:
+            self.index.add(self.vectors[self.index.count:self.count], np.arange(self.index.count, self.count))
+
+    def get_lexical(self) -> BM25Index:
+        # lock is held, loads or builds the BM25 index and catches up on new rows
+        if self.lexical is None:
+            if self.path is not None and os.path.exists(self.file("bm25.npz")):
+                self.lexical = BM25Index.load(self.file("bm25.npz"))
+                if self.lexical.count > self.count:
+                    log(f"*** BM25 index has {self.lexical.count} rows, store {self.count}, rebuilding")
+                    self.lexical = BM25Index()
+            else:
+                self.lexical = BM25Index()
+        if self.lexical.count < self.count:
+            self.lexical.add([self.get_text(index) for index in range(self.lexical.count, self.count)])
+        return self.lexical
+
+    def save_index(self):
+        # writes the IVF index (if enabled) and the BM25 index (if a lexical
+        # search built it or it was saved before), rows appended after the
+        # save are re-indexed on the next open
+        with self.lock:
+            if self.path is None:
+                return
+            if self.lexical is not None or os.path.exists(self.file("bm25.npz")):
+                self.get_lexical()
+            for name, index in (("ivf.npz", self.index), ("bm25.npz", self.lexical)):
+                if index is None:
+                    continue
+                temp_path = self.file(name + ".tmp")
+                with open(temp_path, "wb") as f:
+                    index.save(f)
+                os.replace(temp_path, self.file(name))
+
+    def get_text(self, index: int) -> str:
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        return bytes(self.texts[start:end]).decode("utf-8")
+
+    def hit(self, index, score):
+        return MemoryHit(
+            index=int(index),
+            score=float(score),
+            text=self.get_text(int(index)),
+            timestamp=float(self.timestamps[index])
+        )
+
+    def search_vector(self, query: np.ndarray, k: int = 5, exact: bool = False, nprobe: int = None) -> List[MemoryHit]:
+        if not exact and self.index is not None:
+            with self.lock:
+                ids, scores = self.index.search(query, k, nprobe)
+            return [self.hit(index, score) for index, score in zip(ids, scores)]
+        # exact top-k: one matrix-vector product and an argpartition
+        with self.lock:
+            vectors = self.vectors[:self.count]
+        if len(vectors) == 0:
+            return []
+        scores = vectors @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self.hit(index, scores[index]) for index in top]
+
+    def search(self, text: str, k: int = 5, exact: bool = False, nprobe: int = None) -> List[MemoryHit]:
+        return self.search_vector(self.embedder.embed_one(text), k, exact, nprobe)
+
+    def search_lexical(self, text: str, k: int = 5) -> List[MemoryHit]:
+        with self.lock:
+            ids, scores = self.get_lexical().search(text, k)
+        return [self.hit(index, score) for index, score in zip(ids, scores)]
+
+    def search_hybrid(self, text: str, k: int = 5, exact: bool = False, nprobe: int = None, candidates: int = None, rrf_k: int = 60) -> List[MemoryHit]:
+        # reciprocal rank fusion of the vector and BM25 rankings, the hit score is the fused score
+        candidates = candidates or max(4 * k, 20)
+        fused = {}
+        for hits in (self.search(text, candidates, exact, nprobe), self.search_lexical(text, candidates)):
+            for rank, hit in enumerate(hits):
+                fused[hit.index] = fused.get(hit.index, 0.0) + 1.0 / (rrf_k + rank + 1)
+        top = sorted(fused, key=fused.get, reverse=True)[:k]
+        return [self.hit(index, fused[index]) for index in top]
+
+    def __len__(self):
+        return self.count
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+def get_default_store() -> MemoryStore:
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = MemoryStore(path=DEFAULT_MEMORY_PATH)
+    return _default_store
@@ -1,18 +1,34 @@
-from dataclasses import dataclass
-import openai
+from dataclasses import dataclass, replace
+import asyncio
+import atexit
+import concurrent.futures
+import threading
+import weakref
 import os
+from rag.log import log
 
 @dataclass
 class Backends:
     OPENAI = "openai"
     DEEPINFRA = "deepinfra"
     GROQ = "groq"
+    LOCAL = "local"
 
-@dataclass
+def env_limit(name):
+    value = os.getenv(name)
+    return float(value) if value else None
+
+@dataclass(frozen=True)
 class BackendConfig:
     api_key: str
     name: str
     base_url: str = None
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    # client side limits of rag/limits.py, None is unlimited
+    rpm: float = None
+    tpm: float = None
+    max_concurrency: int = 64
 
 @dataclass
 class ModelBackend:
@@ -21,22 +37,38 @@ class ModelBackend:
     supports_tools: bool
     supports_functions: bool
     client_config: BackendConfig
+    # the same weights served by other backends, see rag/router.py
+    family: str = None
     
 BACKENDS = {
     Backends.OPENAI: BackendConfig(
         name=Backends.OPENAI,
         api_key=os.getenv("OPENAI_API_KEY"),
-        base_url=None
+        base_url=None,
+        rpm=env_limit("OPENAI_RPM"),
+        tpm=env_limit("OPENAI_TPM")
     ),
     Backends.DEEPINFRA: BackendConfig(
         name=Backends.DEEPINFRA,
         api_key=os.getenv("DEEPINFRA_API_KEY"),
-        base_url="https://api.deepinfra.com/v1/openai"
+        base_url="https://api.deepinfra.com/v1/openai",
+        rpm=env_limit("DEEPINFRA_RPM"),
+        tpm=env_limit("DEEPINFRA_TPM")
     ),
     Backends.GROQ: BackendConfig(
         name=Backends.GROQ,
         api_key=os.getenv("GROQ_API_KEY"),
-        base_url="https://api.groq.com/openai/v1"
+        base_url="https://api.groq.com/openai/v1",
+        rpm=env_limit("GROQ_RPM"),
+        tpm=env_limit("GROQ_TPM")
+    ),
+    # rag/stub_server.py, or any other openai compatible server
+    Backends.LOCAL: BackendConfig(
+        name=Backends.LOCAL,
+        api_key=os.getenv("LOCAL_API_KEY", "local"),
+        base_url=os.getenv("RAG_LOCAL_BASE_URL", "http://127.0.0.1:8765/v1"),
+        rpm=env_limit("LOCAL_RPM"),
+        tpm=env_limit("LOCAL_TPM")
     )
 }
 
@@ -46,14 +78,16 @@ MODELS = [
         supports_json=False,
         supports_tools=True,
         supports_functions=True,
-        client_config=BACKENDS[Backends.GROQ]
+        client_config=BACKENDS[Backends.GROQ],
+        family="llama3-70b"
     ),
     ModelBackend(
         model="meta-llama/Meta-Llama-3-70B-Instruct",
         supports_json=False,
         supports_tools=False,
         supports_functions=False,
-        client_config=BACKENDS[Backends.DEEPINFRA]
+        client_config=BACKENDS[Backends.DEEPINFRA],
+        family="llama3-70b"
     ),
     ModelBackend(
         model="meta-llama/Meta-Llama-3-8B-Instruct",
@@ -96,40 +130,157 @@ MODELS = [
         supports_tools=True,
         supports_functions=True,
         client_config=BACKENDS[Backends.OPENAI]
+    ),
+    ModelBackend(
+        model="local-stub",
+        supports_json=False,
+        supports_tools=False,
+        supports_functions=False,
+        client_config=BACKENDS[Backends.LOCAL]
     )
 ]
 
+# RAG_BACKEND=local sends every model to one backend, e.g. the stub server for load tests
+BACKEND_OVERRIDE = os.getenv("RAG_BACKEND")
+if BACKEND_OVERRIDE:
+    MODELS = [replace(model, client_config=BACKENDS[BACKEND_OVERRIDE]) for model in MODELS]
+
+MODELS_BY_NAME = {model.model: model for model in MODELS}
+
+def get_family(model: ModelBackend):
+    if model.family is None:
+        return [model]
+    return [member for member in MODELS if member.family == model.family]
+
 def get_client_for_model(
     model: str,
     async_client: bool = False
 ):
-    model = get_model(model)
+    model = require_model(model)
     if async_client:
-        client = create_async_client(model.client_config)
+        client = CLIENTS.get_async_client(model.client_config)
     else:
-        client = create_client(model.client_config)
+        client = CLIENTS.get_client(model.client_config)
     return client
 
+# openai and httpx are imported with the first client, CLI paths that never
+# call a model don't pay for them
+
+def get_limits(backend: BackendConfig):
+    import httpx
+    return httpx.Limits(
+        max_connections=backend.max_connections,
+        max_keepalive_connections=backend.max_keepalive_connections
+    )
+
 def create_async_client(
     backend: BackendConfig
 ):
+    import openai
     client = openai.AsyncOpenAI(
         api_key=backend.api_key,
-        base_url=backend.base_url
+        base_url=backend.base_url,
+        # retries and backoff happen in rag/limits.py
+        max_retries=0,
+        http_client=openai.DefaultAsyncHttpxClient(limits=get_limits(backend))
     )
     return client
 
 def create_client(
     backend: BackendConfig
 ):
+    import openai
     client = openai.OpenAI(
         api_key=backend.api_key,
-        base_url=backend.base_url
+        base_url=backend.base_url,
+        max_retries=0,
+        http_client=openai.DefaultHttpxClient(limits=get_limits(backend))
     )
     return client
 
+class ClientRegistry:
+    # long-lived clients keyed by BackendConfig, every client owns a keep-alive
+    # connection pool that is shared by all nodes using that backend
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = {}
+        # async connection pools are bound to the event loop they were created on
+        self.async_clients = weakref.WeakKeyDictionary()
+
+    def get_client(self, backend: BackendConfig):
+        client = self.clients.get(backend)
+        if client is None:
+            with self.lock:
+                client = self.clients.get(backend)
+                if client is None:
+                    client = create_client(backend)
+                    self.clients[backend] = client
+        return client
+
+    def get_async_client(self, backend: BackendConfig):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # an unpooled client per call would leak its connections
+            raise RuntimeError(f"Async client for {backend.name} requested outside of a running event loop")
+        with self.lock:
+            clients = self.async_clients.setdefault(loop, {})
+            if backend not in clients:
+                clients[backend] = create_async_client(backend)
+            return clients[backend]
+
+    def prewarm(self, backends=None, connections: int = 1):
+        # open connections (TCP + TLS) ahead of the first node call
+        backends = list(BACKENDS.values()) if backends is None else backends
+        
+        def warm(backend):
+            try:
+                self.get_client(backend).models.list()
+            except Exception as e:
+                log(f"*** Prewarming {backend.name} failed:", e)
+
+        jobs = [backend for backend in backends if backend.api_key for _ in range(connections)]
+        if len(jobs) == 0:
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            list(executor.map(warm, jobs))
+
+    async def aprewarm(self, backends=None, connections: int = 1):
+        backends = list(BACKENDS.values()) if backends is None else backends
+
+        async def warm(backend):
+            try:
+                await self.get_async_client(backend).models.list()
+            except Exception as e:
+                log(f"*** Prewarming {backend.name} failed:", e)
+
+        await asyncio.gather(*[
+            warm(backend) for backend in backends if backend.api_key for _ in range(connections)
+        ])
+
+    def close(self):
+        with self.lock:
+            clients = list(self.clients.values())
+            self.clients = {}
+        for client in clients:
+            client.close()
+
+    async def aclose(self):
+        # closes the async clients of the running event loop
+        with self.lock:
+            clients = self.async_clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client.close()
+
+CLIENTS = ClientRegistry()
+atexit.register(CLIENTS.close)
+
 def get_model(model_name):
-    for model in MODELS:
-        if model.model == model_name:
-            return model
-    return None
\ No newline at end of file
+    return MODELS_BY_NAME.get(model_name)
+
+def require_model(model_name) -> ModelBackend:
+    model = get_model(model_name)
+    if model is None:
+        raise ValueError(f"Unknown model '{model_name}', available: {', '.join(MODELS_BY_NAME)}")
+    return model
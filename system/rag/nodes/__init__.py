@@ -1,13 +1,23 @@
-from .extractor import ParamExtractorNode
-from .casual import CasualResponseNode
-from .tools import ToolSelectorNode, ToolCasualEndNode
-from .web import WebSearchLookup, WebSearchResponse
+from rag.registry import NODES, get_node_class
+
+# node classes are imported on first access (rag/registry.py), so importing
+# one node does not pull in the dependencies of all the others
+
+def __getattr__(name):
+    if name in NODES:
+        return get_node_class(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 __all__ = [
     "ParamExtractorNode",
+    "FusedExtractorNode",
+    "ExtractorSpec",
     "CasualResponseNode",
     "ToolSelectorNode",
     "ToolCasualEndNode",
     "WebSearchLookup",
-    "WebSearchResponse"
-]
\ No newline at end of file
+    "WebSearchDistill",
+    "WebSearchResponse",
+    "MemoryRetrievalNode",
+    "MemoryResponse"
+]
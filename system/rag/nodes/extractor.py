@@ -1,9 +1,38 @@
+import copy
 import json
-from rag.abs import RagNode, DEFAULT_MODEL, NodeContext, RagNodeResult
-from jsonschema import validate
-from rag.models import get_model, get_client_for_model
+import threading
+from dataclasses import dataclass
+from typing import List
+from rag.abs import NodeContext, RagNodeResult, VERBOSE
+from rag.jsonstream import IncrementalJSONParser
+from rag.nodes.llm import LLMNode, Completion
+from rag.prompts import PromptTemplate
+from rag.validation import get_validator
+from rag.log import log
 
-class ParamExtractorNode(RagNode):
+class FieldRelease:
+    # stream watcher of ParamExtractorNode: parses the streamed answer as it
+    # arrives and releases the fields parsed so far once all release_fields
+    # are complete and valid, the edges and consumers of the node start while
+    # the model still generates the rest of the answer
+
+    def __init__(self, node):
+        self.node = node
+        self.parser = IncrementalJSONParser()
+
+    def feed(self, token: str) -> Completion:
+        if len(self.parser.feed(token)) == 0:
+            return None
+        fields = self.parser.fields
+        if not all(name in fields for name in self.node.release_fields):
+            return None
+        if not self.node.get_validator().is_valid(fields):
+            # the complete answer is validated (and reported) as usual
+            self.parser.failed = True
+            return None
+        return Completion(content=json.dumps(fields), released=True)
+
+class ParamExtractorNode(LLMNode):
     base_prompt: str = """
 You are a function parameter generating AI.
 The User Intend AI has already identified the user intend as "{tool_name}".
@@ -22,12 +51,19 @@ You should respond with a json object that looks e.g.: like this.
 Based on the field descriptions of the schema analyze the user input and generate the parameters.
 """ 
 
-    system_prompt = None
     schema = None
     schema_example = None
     tool_name = None
     tool_description = None
-    model_name = DEFAULT_MODEL
+    # a SemanticCache (rag/semantic_cache.py), True until the first run creates it
+    semantic_cache = None
+    semantic_threshold: float = 0.95
+    # share of hits still sent to the model, measures the false hit rate
+    semantic_verify_rate: float = 0.02
+    # fields downstream nodes read from the result, once all of them are
+    # complete in the streamed answer the node releases its result early
+    release_fields: List[str] = None
+    validator = None
     
     def create(
             self,
@@ -42,62 +78,72 @@ Based on the field descriptions of the schema analyze the user input and generat
         self.schema_example = schema_example
         self.tool_name = tool_name
         self.tool_description = tool_description
-        self.model_name = kwargs.get("model", self.model_name)
-        self.model = get_model(self.model_name)
+        # semantic_cache=True creates a cache with the default local embedder
+        # on the first run, numpy isn't imported before that
+        self.semantic_cache = kwargs.get("semantic_cache", None) or None
+        self.semantic_threshold = kwargs.get("semantic_threshold", self.semantic_threshold)
+        self.semantic_verify_rate = kwargs.get("semantic_verify_rate", self.semantic_verify_rate)
+        self.semantic_lock = threading.Lock()
+        self.release_fields = kwargs.get("release_fields", self.release_fields)
+        super().create(**kwargs)
 
-        
-    def run(
-            self,
-            context: NodeContext
-        ):
+    def get_validator(self):
+        # compiled once per schema (rag/validation.py)
+        if self.validator is None:
+            self.validator = get_validator(self.schema)
+        return self.validator
+
+    def stream_watcher(self, context: NodeContext):
+        # only the engine can take a released result
+        if not self.release_fields or context.release is None:
+            return None
+        return FieldRelease(self)
+
+    def get_semantic_cache(self):
+        if self.semantic_cache is True:
+            with self.semantic_lock:
+                if self.semantic_cache is True:
+                    from rag.semantic_cache import SemanticCache
+                    self.semantic_cache = SemanticCache(
+                        threshold=self.semantic_threshold,
+                        verify_rate=self.semantic_verify_rate
+                    )
+        return self.semantic_cache
 
-        self.system_prompt = self.base_prompt.format(
-            tool_name=context.prompt,
+        
+    def compile_prompt(self):
+        # nothing request specific in the system prompt, the user prompt follows it
+        return PromptTemplate(self.base_prompt.format(
+            tool_name=self.tool_name,
             schema=self.schema,
             tool_description=self.tool_description,
             schema_example=self.schema_example
-        )
-        
-        messages = [{
-            "role": "system",
-            "content": self.system_prompt
-        }, {
-            "role": "user",
-            "content": context.prompt
-        }]
-        
-        print("Running ParamExtractorNode", messages)
+        ))
         
-        completion_params = {
-            "model": self.model.model,
-            "messages": messages,
-            "max_tokens": 400,
-            "temperature": 0.0,
-        }
-
-        client = get_client_for_model(self.model.model) # TODO effienctly lookup
-        response = client.chat.completions.create(
-            **completion_params
-        )
-
+    def to_result(
+            self,
+            context: NodeContext,
+            completion
+        ):
         parsable = False
         parsed = None
-        res = response.choices[0].message.content
+        res = completion.content
         try:
             parsed = json.loads(res)
             parsable = True
         except Exception as e:
-            print("ERROR:" + str(e), self.model.model)
+            log("ERROR:" + str(e), self.model.model)
             
         valid = False
         if parsable:
             try:
-                validate(parsed, self.schema)
+                self.get_validator().validate(parsed)
                 valid = True
             except Exception as e:
-                print("ERROR:" + str(e), self.model.model)
+                log("ERROR:" + str(e), self.model.model)
 
-        print("RES", res) 
+        if VERBOSE:
+            log("RES", res)
         
         return RagNodeResult(
             node_name=self.name,
@@ -107,5 +153,165 @@ Based on the field descriptions of the schema analyze the user input and generat
                 "valid": valid,
                 "parsable": parsable,
                 "parsed": parsed,
+                "released_early": completion.released
             },
-        )
\ No newline at end of file
+        )
+
+    def semantic_result(self, value, score):
+        return RagNodeResult(
+            node_name=self.name,
+            forward=True,
+            response=copy.deepcopy(value),
+            meta={
+                "valid": True,
+                "parsable": True,
+                "parsed": value,
+                "semantic_cache": {"hit": True, "score": score},
+                "trace": {"cache": "semantic", "semantic_score": score}
+            },
+        )
+
+    def semantic_lookup(self, context: NodeContext):
+        # returns (cached result, slot to verify), both None on a miss
+        semantic_cache = self.get_semantic_cache()
+        if semantic_cache is None:
+            return None, None
+        value, score, slot = semantic_cache.lookup(context.prompt)
+        if value is None:
+            return None, None
+        log(f"*** Semantic cache hit for {self.name}, score: {score:.3f}")
+        if semantic_cache.should_verify():
+            return None, (slot, value)
+        return self.semantic_result(value, score), None
+
+    def semantic_store(self, context: NodeContext, result: RagNodeResult, verify):
+        # only schema-validated results are reused
+        semantic_cache = self.get_semantic_cache()
+        if semantic_cache is None or not result.meta["valid"]:
+            return
+        if verify is not None:
+            slot, value = verify
+            semantic_cache.record_verification(slot, value, result.response)
+        else:
+            semantic_cache.put(context.prompt, copy.deepcopy(result.response))
+
+    def run(self, context: NodeContext):
+        cached, verify = self.semantic_lookup(context)
+        if cached is not None:
+            return cached
+        result = super().run(context)
+        self.semantic_store(context, result, verify)
+        return result
+
+    async def arun(self, context: NodeContext):
+        cached, verify = self.semantic_lookup(context)
+        if cached is not None:
+            return cached
+        result = await super().arun(context)
+        self.semantic_store(context, result, verify)
+        return result
+
+
+@dataclass
+class ExtractorSpec:
+    # one ParamExtractorNode worth of configuration, name is the result name
+    name: str
+    tool_name: str
+    schema: dict
+    schema_example: str
+    tool_description: str
+
+class FusedExtractorNode(LLMNode):
+    # extracts the parameters of several tools with a single completion and
+    # publishes every sub-result under its ExtractorSpec name
+    base_prompt: str = """
+You are a function parameter generating AI.
+Analyze the user input and generate the parameters for each of the following functions.
+{functions}
+You should respond with a single json object that has one key per function name,
+the value of each key is the parameter object of that function, e.g.: like this.
+
+{example}
+
+Based on the field descriptions of the schemas analyze the user input and generate the parameters.
+"""
+
+    function_prompt: str = """
+Function "{tool_name}":
+{tool_description}
+
+The "{tool_name}" function has the following input schema:
+
+{schema}
+
+Its parameters look e.g.: like this.
+
+{schema_example}
+"""
+
+    extractors: List[ExtractorSpec] = None
+
+    def create(self, extractors: List[ExtractorSpec], **kwargs):
+        self.extractors = extractors
+        self.provides = tuple(spec.name for spec in extractors)
+        self.max_tokens = kwargs.get("max_tokens", 400 * len(extractors))
+        super().create(**kwargs)
+
+    def compile_prompt(self):
+        functions = "".join(
+            self.function_prompt.format(
+                tool_name=spec.tool_name,
+                tool_description=spec.tool_description,
+                schema=spec.schema,
+                schema_example=spec.schema_example
+            )
+            for spec in self.extractors
+        )
+        example = "{\n" + ",\n".join(
+            f'"{spec.tool_name}": {spec.schema_example}' for spec in self.extractors
+        ) + "\n}"
+        return PromptTemplate(self.base_prompt.format(functions=functions, example=example))
+
+    def to_result(self, context: NodeContext, completion):
+        parsed = None
+        res = completion.content
+        try:
+            parsed = json.loads(res)
+        except Exception as e:
+            log("ERROR:" + str(e), self.model.model)
+        parsable = isinstance(parsed, dict)
+
+        published = {}
+        for spec in self.extractors:
+            sub = parsed.get(spec.tool_name) if parsable else None
+            valid = False
+            if sub is not None:
+                try:
+                    get_validator(spec.schema).validate(sub)
+                    valid = True
+                except Exception as e:
+                    log("ERROR:" + str(e), self.model.model)
+            published[spec.name] = RagNodeResult(
+                node_name=spec.name,
+                forward=valid,
+                response=sub,
+                meta={
+                    "valid": valid,
+                    "parsable": parsable,
+                    "parsed": sub,
+                    "fused_into": self.name
+                },
+            )
+
+        if VERBOSE:
+            log("RES", res)
+
+        return RagNodeResult(
+            node_name=self.name,
+            forward=parsable,
+            response=parsed,
+            published=published,
+            meta={
+                "parsable": parsable
+            },
+        )
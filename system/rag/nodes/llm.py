@@ -0,0 +1,465 @@
+from dataclasses import dataclass
+from typing import List
+import asyncio
+import concurrent.futures
+import threading
+import time
+from rag.abs import RagNode, RagNodeResult, NodeContext, NodeCancelled, DEFAULT_MODEL, VERBOSE
+from rag.models import ModelBackend, get_model, require_model, get_client_for_model
+from rag.cache import CompletionCache, get_default_cache, make_key
+from rag.prompts import PromptTemplate
+from rag.router import ModelRouter, Hedge, get_default_router
+from rag.limits import get_limiter
+from rag.tokens import estimate_tokens
+from rag.log import log
+
+# streamed answers only carry token usage (traces, the limiters tokens/min
+# bucket) when asked for, it arrives in a last chunk without choices
+STREAM_OPTIONS = {"include_usage": True}
+
+# attempts of hedged calls on the sync engine
+HEDGE_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+
+@dataclass
+class Completion:
+    content: str
+    usage: dict = None
+    cached: bool = False
+    # the model that answered, differs from the nodes model when routed
+    model: str = None
+    hedged: bool = False
+    # the part of a streamed answer a StreamWatcher released before it finished
+    released: bool = False
+    # time.perf_counter() of the first token (of the response if not streamed),
+    # the router measures every backend until then
+    first_token_at: float = None
+
+    def to_cache(self):
+        return {"content": self.content, "usage": self.usage}
+
+class LLMNode(RagNode):
+    # base for nodes that answer with a single chat completion, subclasses
+    # implement compile_prompt() (or get_messages()) and to_result()
+    model_name = DEFAULT_MODEL
+    max_tokens = 400
+    temperature = 0.0
+    cache: CompletionCache = None
+    cache_ttl: float = None
+    prompt: PromptTemplate = None
+    router: ModelRouter = None
+
+    def create(self, **kwargs):
+        self.model_name = kwargs.get("model", self.model_name)
+        self.model = get_model(self.model_name)
+        # cache=True uses the shared default cache, or pass a CompletionCache
+        cache = kwargs.get("cache", None)
+        self.cache = get_default_cache() if cache is True else (cache or None)
+        self.cache_ttl = kwargs.get("cache_ttl", self.cache_ttl)
+        # router=True routes calls across the models family with the shared default router
+        router = kwargs.get("router", None)
+        self.router = get_default_router() if router is True else (router or None)
+        self.prompt = self.compile_prompt()
+
+    def compile_prompt(self) -> PromptTemplate:
+        # called once at create(), after the subclass has set its fields
+        return None
+
+    def prompt_values(self, context: NodeContext) -> dict:
+        # per request values for the suffix of the compiled prompt
+        return {}
+
+    def get_messages(self, context: NodeContext) -> List[dict]:
+        if self.prompt is None:
+            raise NotImplementedError
+        return self.prompt.messages(context.prompt, **self.prompt_values(context))
+
+    def to_result(self, context: NodeContext, completion: Completion) -> RagNodeResult:
+        raise NotImplementedError
+
+    def stream_watcher(self, context: NodeContext):
+        # per request hook: an object whose feed(token) returns a Completion of
+        # the part of the answer that is already usable (or None), the node
+        # then releases its result to the graph while the stream continues
+        return None
+
+    def watch(self, watcher, context: NodeContext, token: str, model: str):
+        # feeds a streamed token to the watcher, returns None once it released
+        released = watcher.feed(token)
+        if released is None:
+            return watcher
+        released.model = model
+        context.release_result(self.to_traced_result(context, released))
+        return None
+
+    def completion_params(self, messages):
+        return {
+            "model": self.model.model,
+            "messages": messages,
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+        }
+
+    def usage_of(self, response):
+        if getattr(response, "usage", None) is None:
+            return None
+        return {
+            "prompt_tokens": response.usage.prompt_tokens,
+            "completion_tokens": response.usage.completion_tokens
+        }
+
+    def to_completion(self, response):
+        return Completion(
+            content=response.choices[0].message.content,
+            usage=self.usage_of(response)
+        )
+
+    def cache_key(self, params):
+        # only deterministic requests are repeatable
+        if self.cache is None or params["temperature"] != 0.0:
+            return None
+        return make_key(params)
+
+    def from_cache(self, key):
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return Completion(cached=True, **cached)
+        return None
+
+    def to_cache(self, key, completion):
+        if key is not None:
+            self.cache.put(key, completion.to_cache(), ttl=self.cache_ttl)
+
+    def complete(self, messages, context: NodeContext = None) -> Completion:
+        params = self.completion_params(messages)
+        key = self.cache_key(params)
+        completion = self.from_cache(key)
+        if completion is None:
+            completion = self.routed_request(params, context) if self.router is not None else self.request(params, context)
+            self.to_cache(key, completion)
+        elif self.stream and context is not None:
+            context.emit_token(completion.content)
+        return completion
+
+    async def acomplete(self, messages, context: NodeContext = None) -> Completion:
+        params = self.completion_params(messages)
+        key = self.cache_key(params)
+        completion = self.from_cache(key)
+        if completion is None:
+            if self.router is not None:
+                completion = await self.arouted_request(params, context)
+            else:
+                completion = await self.arequest(params, context)
+            self.to_cache(key, completion)
+        elif self.stream and context is not None:
+            context.emit_token(completion.content)
+        return completion
+
+    def chunk_content(self, chunk):
+        if len(chunk.choices) > 0 and chunk.choices[0].delta.content:
+            return chunk.choices[0].delta.content
+        return None
+
+    def limiter_for(self, params, context: NodeContext = None):
+        limiter = get_limiter(require_model(params["model"]).client_config)
+        # the estimate only matters for backends with a tokens/min limit
+        tokens = self.request_tokens(params, context) if limiter.tokens is not None else None
+        return limiter, tokens
+
+    def request_tokens(self, params, context: NodeContext = None):
+        # the compiled prompt estimated its static prefix once at create()
+        if self.prompt is not None and context is not None:
+            prompt_tokens = self.prompt.estimate_tokens(context.prompt, **self.prompt_values(context))
+        else:
+            prompt_tokens = sum(estimate_tokens(message["content"] or "") for message in params["messages"])
+        return prompt_tokens + params["max_tokens"]
+
+    def used_tokens(self, completion: Completion):
+        return sum(completion.usage.values()) if completion.usage else None
+
+    def request(self, params, context: NodeContext = None) -> Completion:
+        # the backends limiter queues, throttles and retries the call
+        limiter, tokens = self.limiter_for(params, context)
+        return limiter.call(lambda: self.send(params, context), tokens, self.used_tokens)
+
+    async def arequest(self, params, context: NodeContext = None) -> Completion:
+        limiter, tokens = self.limiter_for(params, context)
+        return await limiter.acall(lambda: self.asend(params, context), tokens, self.used_tokens)
+
+    def send(self, params, context: NodeContext = None) -> Completion:
+        client = get_client_for_model(params["model"])
+        watcher = self.stream_watcher(context) if context is not None else None
+        if not (self.speculative or self.stream or watcher is not None):
+            response = client.chat.completions.create(**params)
+            completion = self.to_completion(response)
+            completion.first_token_at = time.perf_counter()
+            return completion
+
+        # streaming nodes emit their tokens as they arrive, speculative calls are
+        # streamed too, so a cancelled node can abort the request by closing the stream
+        if context is not None and context.is_cancelled():
+            raise NodeCancelled(self.name)
+        stream = client.chat.completions.create(stream=True, stream_options=STREAM_OPTIONS, **params)
+        content = []
+        usage = None
+        first_token_at = None
+        try:
+            for chunk in stream:
+                if context is not None and context.is_cancelled():
+                    raise NodeCancelled(self.name)
+                # requested with STREAM_OPTIONS, sent with the last chunk
+                usage = self.usage_of(chunk) or usage
+                token = self.chunk_content(chunk)
+                if token is not None:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    content.append(token)
+                    if self.stream and context is not None:
+                        context.emit_token(token)
+                    if watcher is not None:
+                        watcher = self.watch(watcher, context, token, params["model"])
+        finally:
+            stream.close()
+        return Completion(content="".join(content), usage=usage, first_token_at=first_token_at)
+
+    async def asend(self, params, context: NodeContext = None) -> Completion:
+        client = get_client_for_model(params["model"], async_client=True)
+        watcher = self.stream_watcher(context) if context is not None else None
+        if not (self.stream or watcher is not None):
+            response = await client.chat.completions.create(**params)
+            completion = self.to_completion(response)
+            completion.first_token_at = time.perf_counter()
+            return completion
+
+        stream = await client.chat.completions.create(stream=True, stream_options=STREAM_OPTIONS, **params)
+        content = []
+        usage = None
+        first_token_at = None
+        try:
+            async for chunk in stream:
+                usage = self.usage_of(chunk) or usage
+                token = self.chunk_content(chunk)
+                if token is not None:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    content.append(token)
+                    if self.stream and context is not None:
+                        context.emit_token(token)
+                    if watcher is not None:
+                        watcher = self.watch(watcher, context, token, params["model"])
+        finally:
+            await stream.close()
+        return Completion(content="".join(content), usage=usage, first_token_at=first_token_at)
+
+    def routed_request(self, params, context: NodeContext = None) -> Completion:
+        candidates = self.router.candidates(self.model)
+        if self.router.hedge and len(candidates) > 1:
+            return self.hedged_request(candidates, params, context)
+        model = candidates[0]
+        started = time.perf_counter()
+        try:
+            completion = self.request({**params, "model": model.model}, context)
+        except NodeCancelled:
+            raise
+        except Exception:
+            self.router.record(model, time.perf_counter() - started, ok=False)
+            raise
+        # until the first token like the hedged attempts, a whole streamed
+        # answer would mix long and short calls in the backends latencies
+        self.router.record(model, (completion.first_token_at or time.perf_counter()) - started)
+        completion.model = model.model
+        return completion
+
+    async def arouted_request(self, params, context: NodeContext = None) -> Completion:
+        candidates = self.router.candidates(self.model)
+        if self.router.hedge and len(candidates) > 1:
+            return await self.ahedged_request(candidates, params, context)
+        model = candidates[0]
+        started = time.perf_counter()
+        try:
+            completion = await self.arequest({**params, "model": model.model}, context)
+        except (NodeCancelled, asyncio.CancelledError):
+            raise
+        except Exception:
+            self.router.record(model, time.perf_counter() - started, ok=False)
+            raise
+        # until the first token like the hedged attempts, a whole streamed
+        # answer would mix long and short calls in the backends latencies
+        self.router.record(model, (completion.first_token_at or time.perf_counter()) - started)
+        completion.model = model.model
+        return completion
+
+    def attempt(self, model: ModelBackend, params, context: NodeContext, hedge: Hedge, index: int) -> Completion:
+        # one streamed request of a hedged call, only the winning attempt emits tokens
+        params = {**params, "model": model.model}
+        limiter, tokens = self.limiter_for(params, context)
+        started = time.perf_counter()
+        try:
+            # a failed attempt hedges instead of retrying
+            return limiter.call(lambda: self.send_attempt(model, params, context, hedge, index, started), tokens, self.used_tokens, retries=0)
+        except NodeCancelled:
+            # a primary that lost was at least this slow, a losing hedge started late and tells nothing
+            if index == 0 and hedge.lost(index):
+                self.router.record(model, time.perf_counter() - started)
+            raise
+        except Exception:
+            self.router.record(model, time.perf_counter() - started, ok=False)
+            raise
+
+    async def aattempt(self, model: ModelBackend, params, context: NodeContext, hedge: Hedge, index: int) -> Completion:
+        params = {**params, "model": model.model}
+        limiter, tokens = self.limiter_for(params, context)
+        started = time.perf_counter()
+        try:
+            return await limiter.acall(lambda: self.asend_attempt(model, params, context, hedge, index, started), tokens, self.used_tokens, retries=0)
+        except (NodeCancelled, asyncio.CancelledError):
+            if index == 0 and hedge.lost(index):
+                self.router.record(model, time.perf_counter() - started)
+            raise
+        except Exception:
+            self.router.record(model, time.perf_counter() - started, ok=False)
+            raise
+
+    def send_attempt(self, model: ModelBackend, params, context: NodeContext, hedge: Hedge, index: int, started: float) -> Completion:
+        client = get_client_for_model(model.model)
+        watcher = self.stream_watcher(context) if context is not None else None
+        stream = client.chat.completions.create(stream=True, stream_options=STREAM_OPTIONS, **params)
+        content = []
+        usage = None
+        won = False
+        try:
+            for chunk in stream:
+                if hedge.lost(index) or (context is not None and context.is_cancelled()):
+                    raise NodeCancelled(self.name)
+                usage = self.usage_of(chunk) or usage
+                token = self.chunk_content(chunk)
+                if token is None:
+                    continue
+                if not won:
+                    won = self.claim(hedge, index, model, started)
+                content.append(token)
+                if self.stream and context is not None:
+                    context.emit_token(token)
+                # only the winning attempt gets here
+                if watcher is not None:
+                    watcher = self.watch(watcher, context, token, model.model)
+        finally:
+            stream.close()
+        if not won:
+            self.claim(hedge, index, model, started)
+        return Completion(content="".join(content), usage=usage, model=model.model, hedged=index > 0)
+
+    async def asend_attempt(self, model: ModelBackend, params, context: NodeContext, hedge: Hedge, index: int, started: float) -> Completion:
+        client = get_client_for_model(model.model, async_client=True)
+        watcher = self.stream_watcher(context) if context is not None else None
+        stream = await client.chat.completions.create(stream=True, stream_options=STREAM_OPTIONS, **params)
+        content = []
+        usage = None
+        won = False
+        try:
+            async for chunk in stream:
+                usage = self.usage_of(chunk) or usage
+                token = self.chunk_content(chunk)
+                if token is None:
+                    continue
+                if not won:
+                    won = self.claim(hedge, index, model, started)
+                content.append(token)
+                if self.stream and context is not None:
+                    context.emit_token(token)
+                # only the winning attempt gets here
+                if watcher is not None:
+                    watcher = self.watch(watcher, context, token, model.model)
+        finally:
+            await stream.close()
+        if not won:
+            self.claim(hedge, index, model, started)
+        return Completion(content="".join(content), usage=usage, model=model.model, hedged=index > 0)
+
+    def claim(self, hedge: Hedge, index: int, model: ModelBackend, started: float) -> bool:
+        if not hedge.claim(index):
+            raise NodeCancelled(self.name)
+        self.router.record(model, time.perf_counter() - started)
+        return True
+
+    def hedged_request(self, candidates, params, context: NodeContext = None) -> Completion:
+        hedge = Hedge(threading.Event())
+        hedge.add(HEDGE_EXECUTOR.submit(self.attempt, candidates[0], params, context, hedge, 0))
+        # the primary has until its latency percentile to produce a token, a failure hedges at once
+        hedge.settled.wait(self.router.hedge_delay(candidates[0]))
+        if hedge.winner is None:
+            log(f"*** Hedging {self.name} on {candidates[1].model}")
+            hedge.add(HEDGE_EXECUTOR.submit(self.attempt, candidates[1], params, context, hedge, 1))
+        errors = []
+        pending = set(hedge.handles)
+        while len(pending) > 0:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.cancelled():
+                    continue
+                if future.exception() is None:
+                    return future.result()
+                if not isinstance(future.exception(), NodeCancelled):
+                    errors.append(future.exception())
+        raise errors[0] if len(errors) > 0 else NodeCancelled(self.name)
+
+    async def ahedged_request(self, candidates, params, context: NodeContext = None) -> Completion:
+        hedge = Hedge(asyncio.Event())
+        hedge.add(asyncio.create_task(self.aattempt(candidates[0], params, context, hedge, 0)))
+        try:
+            try:
+                await asyncio.wait_for(hedge.settled.wait(), self.router.hedge_delay(candidates[0]))
+            except asyncio.TimeoutError:
+                pass
+            if hedge.winner is None:
+                log(f"*** Hedging {self.name} on {candidates[1].model}")
+                hedge.add(asyncio.create_task(self.aattempt(candidates[1], params, context, hedge, 1)))
+            errors = []
+            pending = set(hedge.handles)
+            while len(pending) > 0:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    if task.exception() is None:
+                        return task.result()
+                    if not isinstance(task.exception(), NodeCancelled):
+                        errors.append(task.exception())
+            raise errors[0] if len(errors) > 0 else NodeCancelled(self.name)
+        finally:
+            # the node itself was cancelled, or the loser is still waiting for its first token
+            for task in hedge.handles:
+                task.cancel()
+
+    def trace_attributes(self, completion: Completion) -> dict:
+        # span attributes for rag.tracing, see span_attributes in rag/abs.py
+        model = get_model(completion.model) or self.model
+        return {
+            "model": model.model,
+            "backend": model.client_config.name,
+            "cache": "hit" if completion.cached else ("miss" if self.cache is not None else None),
+            "hedged": completion.hedged,
+            "released": completion.released or None,
+            **(completion.usage or {})
+        }
+
+    def to_traced_result(self, context: NodeContext, completion: Completion) -> RagNodeResult:
+        result = self.to_result(context, completion)
+        result.meta["trace"] = {**self.trace_attributes(completion), **result.meta.get("trace", {})}
+        return result
+
+    def log_messages(self, messages):
+        if VERBOSE:
+            log(f"Running {self.name}", messages)
+        else:
+            log(f"Running {self.name}")
+
+    def run(self, context: NodeContext):
+        messages = self.get_messages(context)
+        self.log_messages(messages)
+        return self.to_traced_result(context, self.complete(messages, context))
+
+    async def arun(self, context: NodeContext):
+        messages = self.get_messages(context)
+        self.log_messages(messages)
+        return self.to_traced_result(context, await self.acomplete(messages, context))
@@ -0,0 +1,88 @@
+from rag.abs import RagNode, NodeContext, RagNodeResult
+from rag.nodes.llm import LLMNode
+from rag.prompts import PromptTemplate
+from rag.log import log
+
+class MemoryRetrievalNode(RagNode):
+    # looks up the description extracted by the 'MemoryLookup' node in the memory store
+    # a rag.memory.MemoryStore, the default store (and numpy) load on the first run
+    store = None
+    source: str = "MemoryLookup"
+    k: int = 5
+    # 'exact' scans every memory, 'ann' searches the stores IVF index once it is trained,
+    # 'lexical' ranks by BM25 keyword match, 'hybrid' fuses vector and BM25 rankings
+    mode: str = "exact"
+    nprobe: int = None
+
+    def create(self, store=None, source: str = None, k: int = None, mode: str = None, nprobe: int = None, **kwargs):
+        self.store = store
+        self.source = source or self.source
+        self.k = k or self.k
+        self.mode = mode or self.mode
+        self.nprobe = nprobe
+        if self.mode not in ("exact", "ann", "lexical", "hybrid"):
+            raise ValueError(f"Unknown memory search mode '{self.mode}'")
+
+    def get_store(self):
+        if self.store is None:
+            from rag.memory import get_default_store
+            self.store = get_default_store()
+        if self.mode == "ann" and self.store.ann_train_size is None:
+            self.store.enable_ann()
+        return self.store
+
+    def run(self, context: NodeContext):
+        description = context.parent_results[self.source].response["description"]
+        log(f"*** Memory lookup: {description}")
+        store = self.get_store()
+        if self.mode == "lexical":
+            hits = store.search_lexical(description, k=self.k)
+        elif self.mode == "hybrid":
+            hits = store.search_hybrid(description, k=self.k, nprobe=self.nprobe)
+        else:
+            hits = store.search(description, k=self.k, exact=self.mode == "exact", nprobe=self.nprobe)
+        return RagNodeResult(
+            node_name=self.name,
+            forward=True,
+            response={
+                "description": description,
+                "hits": [hit.to_dict() for hit in hits]
+            }
+        )
+
+class MemoryResponse(LLMNode):
+    base_prompt = """
+Based on the users query, you used the 'memory_lookup' tool to search your memory.
+Use the memories below to answer the users query, if none of them is relevant say that you don't remember.
+Respond with a consize answer to the users query.
+"""
+
+    context_prompt = """
+You searched your memory for: {description}
+
+Here is what you remember, most relevant first:
+{memories}
+"""
+
+    source: str = "MemoryRetrieval"
+
+    def create(self, source: str = None, **kwargs):
+        self.source = source or self.source
+        super().create(**kwargs)
+
+    def compile_prompt(self):
+        return PromptTemplate(self.base_prompt, self.context_prompt)
+
+    def prompt_values(self, context: NodeContext):
+        retrieval = context.parent_results[self.source].response
+        return {
+            "description": retrieval["description"],
+            "memories": "\n".join(f"- {hit['text']}" for hit in retrieval["hits"]) or "- nothing"
+        }
+
+    def to_result(self, context: NodeContext, completion):
+        return RagNodeResult(
+            node_name=self.name,
+            forward=True,
+            response=completion.content
+        )
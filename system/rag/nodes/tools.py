@@ -1,12 +1,13 @@
 from rag.abs import RagNode, NodeContext, RagNodeResult, YieldMessage
+from rag.log import log
 
 
 class ToolCasualEndNode(RagNode):
     
     def run(self, context: NodeContext):
-        print(f"End node {self.name} reached")
+        log(f"End node {self.name} reached")
         casual_response = context.all_results["CasualResponse"].response
-        print("Casual response:", casual_response)
+        log("Casual response:", casual_response)
         return RagNodeResult(
             node_name=self.name,
             response=casual_response,
@@ -22,30 +23,17 @@ class ToolSelectorNode(RagNode):
         results = context.parent_results
         assert all([results[res].forward for res in results]), "Not all results are valid"
         
-        parsed = {results[res].node_name: results[res].response for res in results}
-        tool_map = {
-            "web_search": "WebExtract",
-            "memory_lookup": "MemoryLookup",
-            "casual": "CasualResponse"
-        }
-        selected_tools = parsed["ToolUsageCategorizer"]["intends"]
-        
-        tool_params = {}
-        for tool in selected_tools:
-            tool_params[tool_map[tool]] = parsed[tool_map[tool]]
+        selected_tools = results["ToolUsageCategorizer"].response["intends"]
         
+        # the tool parameters are extracted in parallel, they are forwarded
+        # directly to the nodes that use them
         return RagNodeResult(
             node_name=self.name,
             forward=True,
             response={
-                "selected_tools": selected_tools,
-                "tool_params": tool_params
+                "selected_tools": selected_tools
             },
             yield_messages=[
-                YieldMessage("info", f"Selected tools: {selected_tools}"),
-                YieldMessage("info", f"Tool parameters: {tool_params}")
-            ],
-            meta={
-                "parsed": parsed
-            }
+                YieldMessage("info", f"Selected tools: {selected_tools}")
+            ]
         )
\ No newline at end of file
@@ -1,22 +1,38 @@
-from rag.abs import RagNode, NodeContext, RagNodeResult, DEFAULT_MODEL
-from rag.models import get_model, get_client_for_model
-from serpapi import GoogleSearch
+from rag.abs import RagNode, NodeContext, RagNodeResult
+from rag.nodes.llm import LLMNode
+from rag.prompts import PromptTemplate
+from rag.search_cache import SearchCache, get_default_search_cache
+from rag.tokens import estimate_tokens
+import asyncio
 import os
+from rag.log import log
+
+class SearchError(Exception):
+    # serpapi reports failures (quota, invalid key) as an {"error": ...} payload,
+    # raised inside the search cache so the payload is never stored
+
+    def __init__(self, results):
+        super().__init__(results["error"])
+        self.results = results
 
 class WebSearchLookup(RagNode):
+    # search_cache=True shares the default SearchCache, identical queries
+    # within its ttl (or in flight at the same time) cost one serpapi call
+    search_cache: SearchCache = None
 
-    def run(self, context: NodeContext):
-        
-        print(f"*** Running {self.name}, context: {context.parent_results}")
-        
+    def create(self, search_cache=None, **kwargs):
+        self.search_cache = get_default_search_cache() if search_cache is True else search_cache
+    
+    def get_query(self, context: NodeContext):
         selected_tools = context.parent_results["ToolSelector"].response["selected_tools"]
         assert "web_search" in selected_tools, "Web search not selected"
-        tool_params = context.parent_results["ToolSelector"].response["tool_params"]
-        search_query = tool_params["WebExtract"]["query"]
-        
-        print(f"*** Web search query: {search_query}")
-        
+        search_query = context.parent_results["WebExtract"].response["query"]
         
+        log(f"*** Web search query: {search_query}")
+        return search_query
+    
+    def search(self, search_query):
+        from serpapi import GoogleSearch
         params = {
           "engine": "google",
           "q": search_query,
@@ -24,75 +40,167 @@ class WebSearchLookup(RagNode):
         }
 
         search = GoogleSearch(params)
-        results = search.get_dict()
-        
+        return search.get_dict()
+    
+    def to_result(self, search_query, results, cache=None):
         return RagNodeResult(
             node_name=self.name,
             forward=True,
             response={
                 "search_query": search_query,
                 "search_results": results
-            }
+            },
+            meta={"trace": {"search_cache": cache}}
         )
+
+    def cached_fetch(self, search_query, fetched):
+        # fetched records whether this run paid for the search or got it from the cache
+        def fetch():
+            fetched.append(True)
+            results = self.search(search_query)
+            if "error" in results:
+                raise SearchError(results)
+            return results
+        return fetch
+
+    def run(self, context: NodeContext):
+        search_query = self.get_query(context)
+        if self.search_cache is None:
+            return self.to_result(search_query, self.search(search_query))
+        fetched = []
+        try:
+            results = self.search_cache.get(search_query, self.cached_fetch(search_query, fetched))
+        except SearchError as e:
+            # WebSearchDistill reports the error payload
+            return self.to_result(search_query, e.results, "error")
+        return self.to_result(search_query, results, "miss" if fetched else "hit")
+
+    async def arun(self, context: NodeContext):
+        # serpapi has no async client, the blocking request runs in a worker thread
+        search_query = self.get_query(context)
+        if self.search_cache is None:
+            return self.to_result(search_query, await asyncio.to_thread(self.search, search_query))
+        fetched = []
+        try:
+            results = await self.search_cache.aget(search_query, self.cached_fetch(search_query, fetched))
+        except SearchError as e:
+            return self.to_result(search_query, e.results, "error")
+        return self.to_result(search_query, results, "miss" if fetched else "hit")
         
 
-class WebSearchResponse(RagNode):
+class WebSearchDistill(RagNode):
+    # Reduces the raw serpapi payload (metadata, pagination, ads, thumbnails, ...)
+    # to answer boxes, knowledge graph and organic snippets, deduplicates them
+    # and packs the best ones, in ranking order, into a token budget.
+    source: str = "WebSearchLookup"
+    token_budget: int = 600
+    max_snippet_chars: int = 400
+
+    def create(self, source: str = None, token_budget: int = None, max_snippet_chars: int = None, **kwargs):
+        self.source = source or self.source
+        self.token_budget = token_budget or self.token_budget
+        self.max_snippet_chars = max_snippet_chars or self.max_snippet_chars
+
+    def clip(self, text):
+        text = " ".join(str(text or "").split())
+        if len(text) > self.max_snippet_chars:
+            text = text[:self.max_snippet_chars].rsplit(" ", 1)[0] + " ..."
+        return text
+
+    def extract(self, results: dict):
+        # candidates best first: direct answers, then organic results by position
+        items = []
+        answer_box = results.get("answer_box") or {}
+        if answer_box:
+            snippet = answer_box.get("answer") or answer_box.get("result") or answer_box.get("snippet")
+            if not snippet and answer_box.get("temperature"):
+                snippet = " ".join(str(answer_box.get(key, "")) for key in ("temperature", "unit", "weather", "location", "date"))
+            items.append(("answer_box", answer_box.get("title"), snippet, answer_box.get("link")))
+        knowledge_graph = results.get("knowledge_graph") or {}
+        if knowledge_graph:
+            items.append(("knowledge_graph", knowledge_graph.get("title"), knowledge_graph.get("description"), knowledge_graph.get("website")))
+        for result in results.get("organic_results") or []:
+            items.append(("organic", result.get("title"), result.get("snippet"), result.get("link")))
+        for story in results.get("top_stories") or []:
+            items.append(("top_story", story.get("title"), story.get("date"), story.get("link")))
+        for question in results.get("related_questions") or []:
+            items.append(("related_question", question.get("question"), question.get("snippet"), question.get("link")))
+        return items
+
+    def distill(self, results: dict):
+        seen = set()
+        packed = []
+        lines = []
+        used = 0
+        for kind, title, snippet, link in self.extract(results):
+            title, snippet = self.clip(title), self.clip(snippet)
+            if not title and not snippet:
+                continue
+            keys = {key for key in (link, snippet.lower()) if key}
+            if keys & seen:
+                continue
+            seen |= keys
+            line = f"- {title}: {snippet}" + (f" ({link})" if link else "")
+            tokens = estimate_tokens(line)
+            # skip items that don't fit, a later shorter one still might
+            if used + tokens > self.token_budget:
+                continue
+            used += tokens
+            lines.append(line)
+            packed.append({"kind": kind, "title": title, "snippet": snippet, "link": link, "tokens": tokens})
+        return packed, "\n".join(lines), used
+
+    def run(self, context: NodeContext):
+        lookup = context.parent_results[self.source].response
+        results = lookup["search_results"]
+        if "error" in results:
+            log(f"*** Web search error: {results['error']}")
+        items, text, tokens = self.distill(results)
+        log(f"*** Distilled {len(items)} search results into ~{tokens} tokens")
+        return RagNodeResult(
+            node_name=self.name,
+            forward=True,
+            response={
+                "search_query": lookup["search_query"],
+                "items": items,
+                "context": text,
+                "tokens": tokens
+            }
+        )
+
+class WebSearchResponse(LLMNode):
     base_prompt = """
-Based on the users query, you used the 'web_search' tool to search the web for the query: {search_query}.
+Based on the users query, you used the 'web_search' tool to search the web.
+Use the search results below to answer the users query.
+Respond with a consize answer to the users query.
+"""
+
+    context_prompt = """
+The search query was: {search_query}
 
 Here are the search results:
 {web_search_results}
-
-Use them to answer the users query.
-Respond with a consize answer to the users query.
 """
 
-    system_prompt = ""
-    
-    model_name = DEFAULT_MODEL
-    
-    def create(self, **kwargs):
-        self.model_name = kwargs.get("model", self.model_name)
-        self.model = get_model(self.model_name)
+    source: str = "WebSearchDistill"
 
+    def create(self, source: str = None, **kwargs):
+        self.source = source or self.source
+        super().create(**kwargs)
 
-    def run(self, context: NodeContext):
-        
-        print(f"*** Running {self.name}, context: {context.parent_results}")
-        
-        search_results = context.parent_results["WebSearchLookup"].response
-        
-        self.system_prompt = self.base_prompt.format(
-            search_query=search_results["search_query"],
-            web_search_results=search_results["search_results"]
-        )
+    def compile_prompt(self):
+        return PromptTemplate(self.base_prompt, self.context_prompt)
 
-        messages = [{
-            "role": "system",
-            "content": self.base_prompt
-        }, {
-            "role": "user",
-            "content": context.prompt
-        }]
-        
-        print("Running ParamExtractorNode", messages)
-        
-        completion_params = {
-            "model": self.model.model,
-            "messages": messages,
-            "max_tokens": 400,
-            "temperature": 0.0,
+    def prompt_values(self, context: NodeContext):
+        search_results = context.parent_results[self.source].response
+        return {
+            "search_query": search_results["search_query"],
+            "web_search_results": search_results["context"] or "- no results"
         }
 
-        client = get_client_for_model(self.model.model)
-        response = client.chat.completions.create(
-            **completion_params
-        )
-
-        res = response.choices[0].message.content
-        
+    def to_result(self, context: NodeContext, completion):
         return RagNodeResult(
             node_name=self.name,
             forward=True,
-            response=res        
-        )
\ No newline at end of file
+            response=completion.content
+        )
@@ -0,0 +1,135 @@
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, Tuple
+from rag.policy import POLICIES
+
+class GraphValidationError(Exception):
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__("Invalid graph: " + "; ".join(problems))
+
+@dataclass(frozen=True)
+class GraphPlan:
+    # immutable topology of a RagGraph, built once by RagGraph.compile()
+    # and shared by every run of the graph
+    nodes: Mapping[str, object]
+    start_node: object
+    end_nodes: Tuple[object, ...]
+    incoming: Mapping[str, Tuple[object, ...]]
+    outgoing: Mapping[str, Tuple[object, ...]]
+    # result names a node publishes besides its own (RagNode.provides)
+    published: Mapping[str, Tuple[str, ...]]
+    levels: Tuple[Tuple[str, ...], ...]
+    warnings: Tuple[str, ...] = ()
+
+    def get_node(self, name):
+        return self.nodes.get(name)
+
+def reachable(start_names, adjacency):
+    seen = set(start_names)
+    stack = list(start_names)
+    while len(stack) > 0:
+        name = stack.pop()
+        for other in adjacency.get(name, ()):
+            if other not in seen:
+                seen.add(other)
+                stack.append(other)
+    return seen
+
+def topological_levels(names, incoming_names, outgoing_names):
+    # Kahn's algorithm, a node's level is its longest distance from a root
+    in_degree = {name: len(incoming_names[name]) for name in names}
+    level = [name for name in names if in_degree[name] == 0]
+    levels = []
+    while len(level) > 0:
+        levels.append(tuple(level))
+        next_level = []
+        for name in level:
+            for other in outgoing_names[name]:
+                in_degree[other] -= 1
+                if in_degree[other] == 0:
+                    next_level.append(other)
+        level = next_level
+    cyclic = [name for name in names if in_degree[name] > 0]
+    return tuple(levels), cyclic
+
+def compile_graph(nodes, edges, strict: bool = False) -> GraphPlan:
+    errors = []
+    warnings = []
+
+    node_by_name = {}
+    for node in nodes:
+        if node.name in node_by_name:
+            errors.append(f"Duplicate node name '{node.name}'")
+        node_by_name[node.name] = node
+
+    start_nodes = [node for node in nodes if node.start_node]
+    if len(start_nodes) != 1:
+        errors.append(f"Expected exactly one start node, found {len(start_nodes)}")
+    end_nodes = tuple(node for node in nodes if node.end_node)
+    if len(end_nodes) == 0:
+        errors.append("No end node found")
+
+    for node in nodes:
+        if node.policy not in POLICIES:
+            errors.append(f"Node '{node.name}' has unknown policy '{node.policy}', expected one of {POLICIES}")
+
+    published = {name: tuple(node.provides) for name, node in node_by_name.items()}
+    result_names = list(node_by_name)
+    for name, provided in published.items():
+        for other in provided:
+            if other in result_names:
+                errors.append(f"Node '{name}' publishes '{other}' which is already a result name")
+            else:
+                result_names.append(other)
+
+    incoming = {name: [] for name in node_by_name}
+    outgoing = {name: [] for name in result_names}
+    incoming_names = {name: [] for name in result_names}
+    outgoing_names = {name: [] for name in result_names}
+    for name, provided in published.items():
+        for other in provided:
+            outgoing_names[name].append(other)
+            incoming_names[other].append(name)
+    for edge in edges:
+        unknown = [name for name in (edge.start, edge.end) if name not in outgoing]
+        if len(unknown) > 0:
+            errors.append(f"{edge} references unknown node(s) {unknown}")
+            continue
+        if edge.end not in node_by_name:
+            errors.append(f"{edge} ends at '{edge.end}' which is published by another node")
+            continue
+        outgoing[edge.start].append(edge)
+        incoming[edge.end].append(edge)
+        outgoing_names[edge.start].append(edge.end)
+        incoming_names[edge.end].append(edge.start)
+
+    levels, cyclic = topological_levels(result_names, incoming_names, outgoing_names)
+    if len(cyclic) > 0:
+        errors.append(f"Cycle in graph, nodes on or behind it: {cyclic}")
+
+    if len(start_nodes) == 1:
+        from_start = reachable([start_nodes[0].name], outgoing_names)
+        for name in result_names:
+            if name not in from_start:
+                warnings.append(f"Node '{name}' is unreachable from the start node")
+    to_end = reachable([node.name for node in end_nodes], incoming_names)
+    for name in result_names:
+        if name not in to_end:
+            warnings.append(f"Node '{name}' is a dead end, no end node is reachable from it")
+
+    if strict:
+        errors.extend(warnings)
+    if len(errors) > 0:
+        raise GraphValidationError(errors)
+
+    return GraphPlan(
+        nodes=MappingProxyType(node_by_name),
+        start_node=start_nodes[0],
+        end_nodes=end_nodes,
+        incoming=MappingProxyType({name: tuple(e) for name, e in incoming.items()}),
+        outgoing=MappingProxyType({name: tuple(e) for name, e in outgoing.items()}),
+        published=MappingProxyType(published),
+        levels=levels,
+        warnings=tuple(warnings)
+    )
@@ -0,0 +1,81 @@
+from collections import deque
+import threading
+
+# When a node runs once its inputs are ready (RagNode.policy):
+#   "eager"     start right away, e.g. speculatively next to the categorizer
+#   "lazy"      wait until a downstream node actually needs the result, i.e.
+#               every other input of a consumer fired and the consumer leads
+#               to an end node
+#   "adaptive"  eager or lazy per run, decided by the measured hit rate of
+#               the nodes result and its latency
+POLICIES = ("eager", "lazy", "adaptive")
+
+class NodeUsage:
+    # rolling record of whether the result of a node was consumed, and its latency
+
+    def __init__(self, window: int):
+        self.hits = deque(maxlen=window)
+        self.latencies = deque(maxlen=window)
+
+    def hit_rate(self):
+        return sum(self.hits) / len(self.hits) if len(self.hits) > 0 else None
+
+    def latency(self):
+        return sum(self.latencies) / len(self.latencies) if len(self.latencies) > 0 else None
+
+class EvaluationPolicy:
+    # Speculating on a node saves its latency on the runs that consume the
+    # result and wastes a backend call on the others. An adaptive node runs
+    # eagerly while hit_rate * latency >= (1 - hit_rate) * waste_cost, where
+    # waste_cost prices a wasted call in seconds of latency. Lazy runs still
+    # measure the hit rate, a node is a hit when a consumer asked for it.
+
+    def __init__(self, waste_cost: float = 0.1, min_samples: int = 20, window: int = 200):
+        self.waste_cost = waste_cost
+        self.min_samples = min_samples
+        self.window = window
+        self.lock = threading.Lock()
+        self.usage = {}
+
+    def get_usage(self, name) -> NodeUsage:
+        usage = self.usage.get(name)
+        if usage is None:
+            usage = self.usage.setdefault(name, NodeUsage(self.window))
+        return usage
+
+    def prefers_lazy(self, usage: NodeUsage) -> bool:
+        hit_rate, latency = usage.hit_rate(), usage.latency()
+        # speculate until there is enough data, like before adaptive nodes existed
+        if len(usage.hits) < self.min_samples or latency is None:
+            return False
+        return hit_rate * latency < (1 - hit_rate) * self.waste_cost
+
+    def is_lazy(self, node) -> bool:
+        if node.policy != "adaptive":
+            return node.policy == "lazy"
+        with self.lock:
+            return self.prefers_lazy(self.get_usage(node.name))
+
+    def lazy_nodes(self, plan) -> frozenset:
+        return frozenset(name for name, node in plan.nodes.items() if self.is_lazy(node))
+
+    def record(self, usage: dict):
+        # {node name: (hit, elapsed or None)} of one run
+        with self.lock:
+            for name, (hit, elapsed) in usage.items():
+                stats = self.get_usage(name)
+                stats.hits.append(hit)
+                if elapsed is not None:
+                    stats.latencies.append(elapsed)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                name: {
+                    "runs": len(usage.hits),
+                    "hit_rate": usage.hit_rate(),
+                    "latency": usage.latency(),
+                    "lazy": self.prefers_lazy(usage)
+                }
+                for name, usage in self.usage.items()
+            }
@@ -0,0 +1,32 @@
+from typing import List
+from rag.tokens import estimate_tokens
+
+class PromptTemplate:
+    # A system prompt split into a static prefix, formatted once when the node
+    # is created, and a per request suffix that is appended after it. Everything
+    # that varies between requests sits behind the prefix, so the prefix is
+    # byte-identical across requests and prefix caching backends can reuse it.
+
+    def __init__(self, static: str, suffix: str = ""):
+        self.static = static
+        self.suffix = suffix
+        self.static_tokens = estimate_tokens(static)
+
+    def system_prompt(self, **values) -> str:
+        if not self.suffix:
+            return self.static
+        return self.static + self.suffix.format(**values)
+
+    def messages(self, prompt: str, **values) -> List[dict]:
+        return [{
+            "role": "system",
+            "content": self.system_prompt(**values)
+        }, {
+            "role": "user",
+            "content": prompt
+        }]
+
+    def estimate_tokens(self, prompt: str, **values) -> int:
+        # the static part is counted once, only the varying text per request
+        dynamic = self.suffix.format(**values) if self.suffix else ""
+        return self.static_tokens + estimate_tokens(dynamic) + estimate_tokens(prompt)
@@ -0,0 +1,51 @@
+import importlib
+
+# Agents and node classes by name, as "module:attribute" specs that are only
+# imported when the name is first resolved. Importing rag.agents or rag.nodes
+# is cheap, third-party dependencies (openai, jsonschema, serpapi, numpy) load
+# when a node that needs them first runs (benchmarks/import_time.py guards this).
+
+AGENTS = {
+    # name -> (graph factory, keyword arguments)
+    "hal9004_rag": ("rag.agents.hal9004_rag:get_graph", {}),
+    "hal9004_rag_fused": ("rag.agents.hal9004_rag:get_graph", {"fused_extraction": True})
+}
+
+NODES = {
+    "ParamExtractorNode": "rag.nodes.extractor:ParamExtractorNode",
+    "FusedExtractorNode": "rag.nodes.extractor:FusedExtractorNode",
+    "ExtractorSpec": "rag.nodes.extractor:ExtractorSpec",
+    "CasualResponseNode": "rag.nodes.casual:CasualResponseNode",
+    "ToolSelectorNode": "rag.nodes.tools:ToolSelectorNode",
+    "ToolCasualEndNode": "rag.nodes.tools:ToolCasualEndNode",
+    "WebSearchLookup": "rag.nodes.web:WebSearchLookup",
+    "WebSearchDistill": "rag.nodes.web:WebSearchDistill",
+    "WebSearchResponse": "rag.nodes.web:WebSearchResponse",
+    "MemoryRetrievalNode": "rag.nodes.memory:MemoryRetrievalNode",
+    "MemoryResponse": "rag.nodes.memory:MemoryResponse"
+}
+
+def resolve(spec: str):
+    # "module:attribute" -> the attribute, the import system caches the module
+    # and serializes concurrent first imports
+    module_name, attribute = spec.split(":", 1)
+    return getattr(importlib.import_module(module_name), attribute)
+
+def agent_names():
+    return list(AGENTS.keys())
+
+def get_agent(name: str):
+    # returns a function that builds a new graph of the agent
+    if name not in AGENTS:
+        raise KeyError(f"Unknown agent '{name}', available: {', '.join(AGENTS)}")
+    spec, kwargs = AGENTS[name]
+    factory = resolve(spec)
+    return lambda: factory(**kwargs)
+
+def build_agent(name: str):
+    return get_agent(name)()
+
+def get_node_class(name: str):
+    if name not in NODES:
+        raise KeyError(f"Unknown node class '{name}', available: {', '.join(NODES)}")
+    return resolve(NODES[name])
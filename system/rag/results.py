@@ -0,0 +1,56 @@
+from collections.abc import Mapping
+import threading
+
+# Per-run store of node results. Every result name is written once, so the
+# store is append-only: a snapshot is the store plus the number of results it
+# had when taken, taking one is O(1) and it never changes afterwards.
+
+class ResultSnapshot(Mapping):
+    __slots__ = ("store", "size")
+
+    def __init__(self, store, size):
+        self.store = store
+        self.size = size
+
+    def __getitem__(self, name):
+        seq, result = self.store.entries[name]
+        if seq >= self.size:
+            raise KeyError(name)
+        return result
+
+    def __iter__(self):
+        return iter(self.store.names[:self.size])
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self) -> str:
+        return f"ResultSnapshot({list(self)})"
+
+class ResultStore:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name -> (sequence number, result), entries are never replaced or removed
+        self.entries = {}
+        self.names = []
+
+    def add(self, name, result):
+        with self.lock:
+            if name in self.entries:
+                raise KeyError(f"Result '{name}' already stored")
+            self.entries[name] = (len(self.names), result)
+            self.names.append(name)
+
+    def get(self, name, default=None):
+        entry = self.entries.get(name)
+        return default if entry is None else entry[1]
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.names)
+
+    def snapshot(self) -> ResultSnapshot:
+        return ResultSnapshot(self, len(self.names))
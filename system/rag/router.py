@@ -0,0 +1,167 @@
+from collections import deque
+from typing import List
+import os
+import random
+import threading
+import time
+from rag.models import ModelBackend, get_family
+
+# Latency-aware routing across the backends that serve the same model family
+# (e.g. Llama 3 70B on Groq and DeepInfra). Every call, hedged or not, is
+# measured from before its limiter wait until its first token (the whole
+# response for non-streamed calls), each call goes to the healthy backend with
+# the lowest recent latency. With hedge=True a second
+# request goes to the next backend when the first produced no token within the
+# hedge_percentile of its recent latencies, the first to answer wins.
+
+class BackendStats:
+    # rolling first-token latencies, error rate and circuit state of one model on one backend
+
+    def __init__(self, window: int = 100):
+        self.latencies = deque(maxlen=window)
+        self.error_rate = 0.0  # exponentially weighted, alpha 0.1
+        self.failures = 0  # consecutive
+        self.down_until = 0.0
+        self.requests = 0
+
+    def record(self, latency: float, ok: bool, failure_threshold: int, cooldown: float):
+        self.requests += 1
+        self.error_rate = 0.9 * self.error_rate + (0.0 if ok else 0.1)
+        if ok:
+            self.latencies.append(latency)
+            self.failures = 0
+        else:
+            self.failures += 1
+            if self.failures >= failure_threshold:
+                self.down_until = time.monotonic() + cooldown
+
+    def healthy(self):
+        return time.monotonic() >= self.down_until
+
+    def percentile(self, p: float):
+        if len(self.latencies) == 0:
+            return None
+        values = sorted(self.latencies)
+        return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+    def score(self):
+        # unmeasured backends score 0 so that every backend gets measured
+        p50 = self.percentile(50)
+        if p50 is None:
+            return 0.0
+        return p50 * (1 + 4 * self.error_rate)
+
+    def to_dict(self):
+        return {
+            "requests": self.requests,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "error_rate": self.error_rate,
+            "healthy": self.healthy()
+        }
+
+class ModelRouter:
+
+    def __init__(
+            self,
+            hedge: bool = False,
+            hedge_percentile: float = 90,
+            min_hedge_delay: float = 0.05,
+            default_hedge_delay: float = 1.0,
+            min_samples: int = 10,
+            explore: float = 0.02,
+            window: int = 100,
+            failure_threshold: int = 3,
+            cooldown: float = 30.0,
+            seed: int = None
+        ):
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        # used until the primary backend has min_samples measurements
+        self.default_hedge_delay = default_hedge_delay
+        self.min_samples = min_samples
+        # share of calls sent to a random healthy alternate, keeps its stats current
+        self.explore = explore
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def get_stats(self, model: ModelBackend) -> BackendStats:
+        stats = self.stats.get(model.model)
+        if stats is None:
+            stats = self.stats.setdefault(model.model, BackendStats(self.window))
+        return stats
+
+    def candidates(self, model: ModelBackend) -> List[ModelBackend]:
+        # the family members with credentials, fastest healthy backend first
+        family = [member for member in get_family(model) if member.client_config.api_key] or [model]
+        with self.lock:
+            ranked = sorted(family, key=lambda member: (not self.get_stats(member).healthy(), self.get_stats(member).score()))
+            healthy = [member for member in ranked if self.get_stats(member).healthy()]
+            if len(healthy) > 1 and self.random.random() < self.explore:
+                pick = self.random.choice(healthy[1:])
+                ranked.remove(pick)
+                ranked.insert(0, pick)
+        return ranked
+
+    def record(self, model: ModelBackend, latency: float, ok: bool = True):
+        with self.lock:
+            self.get_stats(model).record(latency, ok, self.failure_threshold, self.cooldown)
+
+    def hedge_delay(self, model: ModelBackend) -> float:
+        with self.lock:
+            stats = self.get_stats(model)
+            if len(stats.latencies) < self.min_samples:
+                return self.default_hedge_delay
+            return max(stats.percentile(self.hedge_percentile), self.min_hedge_delay)
+
+    def snapshot(self):
+        with self.lock:
+            return {name: stats.to_dict() for name, stats in self.stats.items()}
+
+class Hedge:
+    # shared state of the attempts of one hedged call, the first attempt to
+    # produce a token claims the call and cancels the others
+
+    def __init__(self, settled):
+        self.lock = threading.Lock()
+        self.winner = None
+        # threading.Event or asyncio.Event, set once an attempt claimed the call or finished
+        self.settled = settled
+        self.handles = []
+
+    def add(self, handle):
+        # a concurrent.futures.Future or asyncio.Task, running futures can't be
+        # cancelled, their attempt stops at its next chunk through lost()
+        self.handles.append(handle)
+        handle.add_done_callback(lambda _: self.settled.set())
+        return handle
+
+    def claim(self, index: int) -> bool:
+        with self.lock:
+            if self.winner is None:
+                self.winner = index
+                self.settled.set()
+                for other, handle in enumerate(self.handles):
+                    if other != index:
+                        handle.cancel()
+            return self.winner == index
+
+    def lost(self, index: int) -> bool:
+        return self.winner is not None and self.winner != index
+
+_default_router = None
+_default_router_lock = threading.Lock()
+
+def get_default_router() -> ModelRouter:
+    # RAG_HEDGE=1 enables hedged requests on the shared router
+    global _default_router
+    if _default_router is None:
+        with _default_router_lock:
+            if _default_router is None:
+                _default_router = ModelRouter(hedge=os.getenv("RAG_HEDGE") == "1")
+    return _default_router
@@ -0,0 +1,131 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+import asyncio
+import threading
+import time
+
+def normalize_query(query: str) -> str:
+    # "Weather in  Aachen today?" and "weather in aachen today" share one entry
+    return " ".join(query.lower().split()).strip(" ?!.")
+
+class SearchCache:
+    # Results of a slow, billed upstream search. Fresh entries are served for
+    # ttl seconds, afterwards for another stale_ttl seconds while one background
+    # refresh runs (stale-while-revalidate). Concurrent misses for the same
+    # query share one upstream call (single-flight).
+
+    def __init__(self, ttl: float = 600.0, stale_ttl: float = 3600.0, max_entries: int = 1024):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.upstream_calls = 0
+        self.refresh_errors = 0
+
+    def lookup(self, key, fetch):
+        # returns (value, future, leader), on a miss the leader has to call self.fetch
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, fetched_at = entry
+                age = now - fetched_at
+                if age < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value, None, False
+                if age < self.ttl + self.stale_ttl:
+                    self.entries.move_to_end(key)
+                    self.stale_hits += 1
+                    if key not in self.in_flight:
+                        self.in_flight[key] = future = Future()
+                        threading.Thread(target=self.refresh, args=(key, fetch, future), daemon=True).start()
+                    return value, None, False
+                del self.entries[key]
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return None, future, False
+            self.misses += 1
+            self.in_flight[key] = future = Future()
+            return None, future, True
+
+    def fetch(self, key, fetch, future):
+        try:
+            with self.lock:
+                self.upstream_calls += 1
+            value = fetch()
+        except BaseException as e:
+            with self.lock:
+                self.in_flight.pop(key, None)
+            future.set_exception(e)
+            return
+        self.store(key, value)
+        with self.lock:
+            self.in_flight.pop(key, None)
+        future.set_result(value)
+
+    def refresh(self, key, fetch, future):
+        # errors keep serving the stale entry until it expires
+        self.fetch(key, fetch, future)
+        if future.exception() is not None:
+            with self.lock:
+                self.refresh_errors += 1
+
+    def store(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get(self, query: str, fetch):
+        # fetch() performs the upstream call for this query
+        key = normalize_query(query)
+        value, future, leader = self.lookup(key, fetch)
+        if future is None:
+            return value
+        if leader:
+            self.fetch(key, fetch, future)
+        return future.result()
+
+    async def aget(self, query: str, fetch):
+        # the blocking fetch runs in a worker thread, followers await the leaders future
+        key = normalize_query(query)
+        value, future, leader = self.lookup(key, fetch)
+        if future is None:
+            return value
+        if leader:
+            await asyncio.to_thread(self.fetch, key, fetch, future)
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "upstream_calls": self.upstream_calls,
+                "refresh_errors": self.refresh_errors,
+                "hit_rate": (self.hits + self.stale_hits + self.coalesced) / lookups if lookups else 0.0,
+                "entries": len(self.entries)
+            }
+
+_default_search_cache = None
+_default_search_cache_lock = threading.Lock()
+
+def get_default_search_cache() -> SearchCache:
+    global _default_search_cache
+    if _default_search_cache is None:
+        with _default_search_cache_lock:
+            if _default_search_cache is None:
+                _default_search_cache = SearchCache()
+    return _default_search_cache
@@ -0,0 +1,80 @@
+import random
+import threading
+import numpy as np
+from rag.embeddings import Embedder, HashedNgramEmbedder
+
+class SemanticCache:
+    # reuses results of near-identical prompts, recent prompt embeddings live
+    # in a ring buffer matrix so a lookup is a single matrix-vector product
+
+    def __init__(
+            self,
+            embedder: Embedder = None,
+            threshold: float = 0.95,
+            capacity: int = 4096,
+            verify_rate: float = 0.0
+        ):
+        self.embedder = HashedNgramEmbedder() if embedder is None else embedder
+        self.threshold = threshold
+        self.capacity = capacity
+        # share of hits that are still sent to the model to measure false hits
+        self.verify_rate = verify_rate
+        self.lock = threading.Lock()
+        self.vectors = np.zeros((capacity, self.embedder.dim), dtype=np.float32)
+        self.prompts = [None] * capacity
+        self.values = [None] * capacity
+        self.size = 0
+        self.next = 0
+        self.lookups = 0
+        self.hits = 0
+        self.verified = 0
+        self.false_hits = 0
+
+    def lookup(self, prompt: str):
+        # returns (value, score, slot), value is None on a miss
+        vector = self.embedder.embed_one(prompt)
+        with self.lock:
+            self.lookups += 1
+            if self.size == 0:
+                return None, 0.0, None
+            scores = self.vectors[:self.size] @ vector
+            slot = int(np.argmax(scores))
+            score = float(scores[slot])
+            if score < self.threshold:
+                return None, score, None
+            self.hits += 1
+            return self.values[slot], score, slot
+
+    def put(self, prompt: str, value):
+        vector = self.embedder.embed_one(prompt)
+        with self.lock:
+            slot = self.next
+            self.vectors[slot] = vector
+            self.prompts[slot] = prompt
+            self.values[slot] = value
+            self.next = (slot + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+
+    def should_verify(self):
+        return self.verify_rate > 0 and random.random() < self.verify_rate
+
+    def record_verification(self, slot, cached_value, fresh_value):
+        with self.lock:
+            self.verified += 1
+            if cached_value != fresh_value:
+                self.false_hits += 1
+                if self.values[slot] == cached_value:
+                    self.values[slot] = fresh_value
+
+    def stats(self):
+        with self.lock:
+            return {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "verified": self.verified,
+                "false_hits": self.false_hits,
+                "false_hit_rate": self.false_hits / self.verified if self.verified else 0.0,
+                "entries": self.size,
+                "threshold": self.threshold
+            }
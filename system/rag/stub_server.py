@@ -0,0 +1,359 @@
+from dataclasses import dataclass, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from rag.tokens import estimate_tokens
+
+# OpenAI compatible chat-completions stub for load tests and profiling without
+# network access. Answers are rule based (valid parameter JSON for the
+# extractor nodes, canned text otherwise) or scripted, latency and failures
+# follow a profile. Point the graph at it with RAG_BACKEND=local:
+#   python3 -m rag.stub_server --profile groq --port 8765
+
+@dataclass
+class LatencyProfile:
+    ttft: float = 0.2  # seconds until the first token
+    ttft_jitter: float = 0.05  # +- uniform jitter on ttft
+    tokens_per_second: float = 100.0
+    error_rate: float = 0.0  # share of requests answered with a 500
+    rate_limit_rate: float = 0.0  # share of requests answered with a 429
+    retry_after: float = 1.0  # Retry-After header of injected 429s
+    answer_tokens: int = 60  # length of the canned text answers
+    json_tail_tokens: int = 0  # words of a "reasoning" field after the extracted parameters
+    rpm: float = None  # enforced requests/min, excess requests get a 429
+    max_concurrency: int = None  # enforced concurrent requests, excess requests get a 429
+
+PROFILES = {
+    "instant": LatencyProfile(ttft=0.0, ttft_jitter=0.0, tokens_per_second=1e9),
+    "fast": LatencyProfile(ttft=0.05, ttft_jitter=0.01, tokens_per_second=500.0),
+    "groq": LatencyProfile(ttft=0.2, ttft_jitter=0.05, tokens_per_second=300.0),
+    "openai": LatencyProfile(ttft=0.5, ttft_jitter=0.2, tokens_per_second=80.0),
+    "deepinfra": LatencyProfile(ttft=0.6, ttft_jitter=0.3, tokens_per_second=40.0),
+    "flaky": LatencyProfile(ttft=0.3, ttft_jitter=0.2, tokens_per_second=80.0, error_rate=0.05, rate_limit_rate=0.1)
+}
+
+WEB_SEARCH_WORDS = ("weather", "news", "today", "current", "latest", "search", "price", "who won")
+MEMORY_WORDS = ("remember", "told you", "recall", "memory", "last time")
+
+def classify_intends(prompt: str):
+    prompt = prompt.lower()
+    intends = []
+    if any(word in prompt for word in WEB_SEARCH_WORDS):
+        intends.append("web_search")
+    if any(word in prompt for word in MEMORY_WORDS):
+        intends.append("memory_lookup")
+    return intends or ["casual"]
+
+def tool_parameters(tool_name: str, prompt: str):
+    if tool_name == "intend_categorizer":
+        return {"intends": classify_intends(prompt)}
+    if tool_name == "web_search":
+        return {"query": prompt}
+    if tool_name == "memory_lookup":
+        return {"description": prompt}
+    return {}
+
+class StubResponder:
+    # picks the answer text for a chat request
+
+    def __init__(self, profile: LatencyProfile, script: list = None):
+        self.profile = profile
+        # [{"match": regex, "response": text}], matched against system + user text
+        self.script = [(re.compile(rule["match"], re.S), rule["response"]) for rule in script or []]
+
+    def respond(self, messages):
+        system = "\n".join(m["content"] for m in messages if m["role"] == "system")
+        prompt = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        for pattern, response in self.script:
+            if pattern.search(system + "\n" + prompt):
+                return response
+        if "one key per function name" in system:
+            return json.dumps({
+                tool_name: tool_parameters(tool_name, prompt)
+                for tool_name in re.findall(r'Function "(\w+)"', system)
+            })
+        match = re.search(r'identified the user intend as "(\w+)"', system)
+        if match:
+            parameters = tool_parameters(match.group(1), prompt)
+            if self.profile.json_tail_tokens > 0:
+                # models often explain themselves after the parameters
+                parameters["reasoning"] = " ".join(["because"] * self.profile.json_tail_tokens)
+            return json.dumps(parameters)
+        words = f"This is a stubbed answer to: {prompt}".split()
+        filler = "The local stub backend generates this text to simulate a model answer.".split()
+        while len(words) < self.profile.answer_tokens:
+            words.extend(filler)
+        return " ".join(words[:max(self.profile.answer_tokens, 1)])
+
+def split_tokens(text):
+    # word pieces stand in for model tokens
+    return re.findall(r"\S+\s*|\s+", text) or [""]
+
+class StubHTTPServer(ThreadingHTTPServer):
+    # the socketserver default backlog of 5 drops connects under load
+    request_queue_size = 1024
+    daemon_threads = True
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        # clients close connections early, e.g. cancelled speculative nodes
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": "local-stub", "object": "model", "owned_by": "local"}]})
+        elif self.path.rstrip("/").endswith("/stats"):
+            self.send_json(200, self.server.stub.stats())
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        stub = self.server.stub
+        outcome, retry_after = stub.draw_outcome()
+        if outcome == "rate_limited":
+            self.send_json(429, {"error": {"message": "Rate limit reached (stub)", "type": "rate_limit_exceeded"}},
+                           headers={"Retry-After": f"{retry_after:.3f}"})
+            return
+        if outcome == "error":
+            self.send_json(500, {"error": {"message": "Injected server error (stub)", "type": "server_error"}})
+            return
+        try:
+            self.complete(stub, request)
+        finally:
+            stub.finished()
+
+    def complete(self, stub, request):
+        messages = request.get("messages", [])
+        content = stub.responder.respond(messages)
+        tokens = split_tokens(content)
+        max_tokens = request.get("max_tokens")
+        if max_tokens:
+            tokens = tokens[:max_tokens]
+        usage = {
+            "prompt_tokens": sum(estimate_tokens(m.get("content") or "") for m in messages),
+            "completion_tokens": len(tokens),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = request.get("model", "local-stub")
+        time.sleep(stub.draw_ttft())
+        if request.get("stream"):
+            self.stream(completion_id, model, tokens, usage, request)
+        else:
+            time.sleep(len(tokens) / stub.profile.tokens_per_second)
+            self.send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            })
+        stub.record(usage)
+
+    def stream(self, completion_id, model, tokens, usage, request):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        delay = 1.0 / self.server.stub.profile.tokens_per_second
+
+        def event(delta, finish_reason=None, usage=None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else []
+            }
+            if usage is not None:
+                chunk["usage"] = usage
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        event({"role": "assistant", "content": ""})
+        for index, token in enumerate(tokens):
+            if index > 0:
+                time.sleep(delay)
+            event({"content": token})
+        event({}, finish_reason="stop")
+        if (request.get("stream_options") or {}).get("include_usage"):
+            event(None, usage=usage)
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.write_chunk(b"")
+
+class StubServer:
+    # threaded stub server, start() runs it in a daemon thread for in-process use
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, profile: LatencyProfile = None, script: list = None, seed: int = None):
+        self.profile = PROFILES["groq"] if profile is None else profile
+        self.responder = StubResponder(self.profile, script)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.completion_tokens = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.allowance = self.profile.rpm
+        self.allowance_updated = time.monotonic()
+        self.httpd = StubHTTPServer((host, port), StubHandler)
+        self.httpd.stub = self
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def over_limit(self):
+        # seconds until the request would fit the enforced limits, 0 if it fits now
+        if self.profile.max_concurrency is not None and self.in_flight >= self.profile.max_concurrency:
+            return self.profile.retry_after
+        if self.profile.rpm is not None:
+            now = time.monotonic()
+            rate = self.profile.rpm / 60.0
+            self.allowance = min(self.profile.rpm, self.allowance + (now - self.allowance_updated) * rate)
+            self.allowance_updated = now
+            if self.allowance < 1.0:
+                return (1.0 - self.allowance) / rate
+            self.allowance -= 1.0
+        return 0.0
+
+    def draw_outcome(self):
+        # (outcome, retry after), a request with outcome "ok" has to call finished()
+        with self.lock:
+            self.requests += 1
+            wait = self.over_limit()
+            if wait > 0:
+                self.rate_limited += 1
+                return "rate_limited", wait
+            roll = self.random.random()
+            if roll < self.profile.rate_limit_rate:
+                self.rate_limited += 1
+                return "rate_limited", self.profile.retry_after
+            if roll < self.profile.rate_limit_rate + self.profile.error_rate:
+                self.errors += 1
+                return "error", None
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            return "ok", None
+
+    def finished(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def draw_ttft(self):
+        with self.lock:
+            jitter = self.random.uniform(-self.profile.ttft_jitter, self.profile.ttft_jitter)
+        return max(0.0, self.profile.ttft + jitter)
+
+    def record(self, usage):
+        with self.lock:
+            self.completion_tokens += usage["completion_tokens"]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "rate_limited": self.rate_limited,
+                "completion_tokens": self.completion_tokens,
+                "peak_in_flight": self.peak_in_flight,
+                "profile": asdict(self.profile)
+            }
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='OpenAI compatible stub backend for load tests')
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--profile", type=str, default="groq", choices=list(PROFILES.keys()))
+    parser.add_argument("--ttft", type=float, help='Seconds until the first token')
+    parser.add_argument("--ttft-jitter", type=float)
+    parser.add_argument("--tps", type=float, help='Tokens per second')
+    parser.add_argument("--error-rate", type=float, help='Share of requests failing with a 500')
+    parser.add_argument("--rate-limit-rate", type=float, help='Share of requests failing with a 429')
+    parser.add_argument("--retry-after", type=float)
+    parser.add_argument("--answer-tokens", type=int)
+    parser.add_argument("--json-tail", type=int, help='Words of a trailing "reasoning" field in extractor answers')
+    parser.add_argument("--rpm", type=float, help='Enforced requests per minute')
+    parser.add_argument("--max-concurrency", type=int, help='Enforced concurrent requests')
+    parser.add_argument("--script", type=str, help='JSON file with [{"match": regex, "response": text}] rules')
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    profile = LatencyProfile(**asdict(PROFILES[args.profile]))
+    for field, value in (
+            ("ttft", args.ttft),
+            ("ttft_jitter", args.ttft_jitter),
+            ("tokens_per_second", args.tps),
+            ("error_rate", args.error_rate),
+            ("rate_limit_rate", args.rate_limit_rate),
+            ("retry_after", args.retry_after),
+            ("answer_tokens", args.answer_tokens),
+            ("json_tail_tokens", args.json_tail),
+            ("rpm", args.rpm),
+            ("max_concurrency", args.max_concurrency)
+        ):
+        if value is not None:
+            setattr(profile, field, value)
+    script = None
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+
+    server = StubServer(args.host, args.port, profile, script, args.seed)
+    print(f"*** Stub backend on {server.base_url}, profile: {asdict(profile)}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
@@ -0,0 +1,12 @@
+import math
+import re
+
+WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def estimate_tokens(text: str) -> int:
+    # tokenizer free estimate for budgeting prompts: BPE vocabularies average
+    # ~4 characters per token on english text, but split punctuation, urls and
+    # rare words further, so take the larger of the character and word counts
+    if not text:
+        return 0
+    return max(math.ceil(len(text) / 4), len(WORD_PATTERN.findall(text)))
@@ -0,0 +1,215 @@
+from collections import deque
+from dataclasses import dataclass, field
+from typing import List
+import itertools
+import json
+import os
+import threading
+import time
+
+# One span per node execution of a graph run. Tracing is off unless a Tracer is
+# passed to RagGraph (or RAG_TRACE is set), a disabled run carries trace=None
+# and the engine skips every tracing call behind a single None check.
+
+@dataclass
+class Span:
+    name: str
+    ready: float  # submitted to the executor / event loop
+    start: float = None  # picked up by a worker
+    end: float = None
+    status: str = "running"
+    trigger: str = None  # the node whose completion made this one runnable
+    attributes: dict = field(default_factory=dict)
+
+    @property
+    def queue_wait(self):
+        return (self.start - self.ready) if self.start is not None else 0.0
+
+    @property
+    def wall(self):
+        return (self.end - self.start) if self.end is not None and self.start is not None else 0.0
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "ready": self.ready,
+            "start": self.start,
+            "end": self.end,
+            "queue_wait": self.queue_wait,
+            "wall": self.wall,
+            "status": self.status,
+            "trigger": self.trigger,
+            "attributes": self.attributes
+        }
+
+@dataclass
+class EdgeDecision:
+    start: str
+    end: str
+    fired: bool
+    at: float
+
+class RunTrace:
+    # spans and edge decisions of one graph run, times are time.perf_counter()
+
+    def __init__(self, run_id: int, prompt: str = None):
+        self.run_id = run_id
+        self.prompt = prompt
+        self.started = time.perf_counter()
+        self.ended = None
+        self.spans = {}
+        self.edges: List[EdgeDecision] = []
+        self.pending_triggers = {}
+        self.end_node = None
+
+    def ready(self, names, trigger):
+        for name in names:
+            self.pending_triggers.setdefault(name, trigger)
+
+    def submit(self, name):
+        self.spans[name] = Span(name=name, ready=time.perf_counter(), trigger=self.pending_triggers.pop(name, None))
+
+    def started_at(self, name, start):
+        span = self.spans.get(name)
+        if span is not None:
+            span.start = start
+
+    def finish(self, name, status, end=None, attributes=None):
+        span = self.spans.get(name)
+        if span is None:
+            return
+        span.end = time.perf_counter() if end is None else end
+        span.status = status
+        if attributes:
+            span.attributes.update(attributes)
+
+    def annotate(self, name, attributes):
+        # fills in attributes a finished span is missing, e.g. the token usage
+        # of a node that released its result before its stream ended
+        span = self.spans.get(name)
+        if span is None:
+            return
+        for key, value in attributes.items():
+            if value is not None and span.attributes.get(key) is None:
+                span.attributes[key] = value
+
+    def edge(self, start, end, fired):
+        self.edges.append(EdgeDecision(start, end, fired, time.perf_counter()))
+
+    def close(self, end_node=None):
+        self.ended = time.perf_counter()
+        self.end_node = end_node
+        for span in self.spans.values():
+            if span.end is None:
+                span.end = self.ended
+                span.status = "abandoned"
+
+    def critical_path(self) -> List[Span]:
+        # walks back from the end node along the completions that released each node
+        path = []
+        name = self.end_node
+        while name is not None and name in self.spans:
+            span = self.spans[name]
+            path.append(span)
+            name = span.trigger
+        return list(reversed(path))
+
+    def summary(self):
+        path = self.critical_path()
+        total = (self.ended or time.perf_counter()) - self.started
+        work = sum(span.wall for span in path)
+        wait = sum(span.queue_wait for span in path)
+        return {
+            "run_id": self.run_id,
+            "total": total,
+            "critical_path": [span.name for span in path],
+            "critical_wall": work,
+            "critical_queue_wait": wait,
+            # scheduling, result handling and edge predicates between the spans
+            "engine_overhead": max(total - work - wait, 0.0),
+            "spans": {name: span.to_dict() for name, span in self.spans.items()}
+        }
+
+    def chrome_events(self, pid: int = 1):
+        # trace event format, load the exported file in chrome://tracing or ui.perfetto.dev
+        def us(t):
+            return (t - self.started) * 1e6
+
+        critical = {span.name for span in self.critical_path()}
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": f"run {self.run_id}"}}]
+        events.append({
+            "name": "run", "cat": "run", "ph": "X", "pid": pid, "tid": 0,
+            "ts": 0, "dur": us(self.ended or time.perf_counter()),
+            "args": {"prompt": self.prompt, "end_node": self.end_node}
+        })
+        # one lane per node, spans of concurrent nodes would overlap on a shared lane
+        for tid, span in enumerate(self.spans.values(), start=1):
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": span.name}})
+            args = {"status": span.status, "trigger": span.trigger, "critical": span.name in critical, **span.attributes}
+            if span.start is not None and span.queue_wait > 0:
+                events.append({
+                    "name": f"{span.name} (queued)", "cat": "queue", "ph": "X", "pid": pid, "tid": tid,
+                    "ts": us(span.ready), "dur": span.queue_wait * 1e6
+                })
+            start = span.start if span.start is not None else span.ready
+            events.append({
+                "name": span.name, "cat": "critical" if span.name in critical else "node", "ph": "X",
+                "pid": pid, "tid": tid, "ts": us(start), "dur": (span.end - start) * 1e6, "args": args
+            })
+        for edge in self.edges:
+            events.append({
+                "name": f"{edge.start} -> {edge.end}", "cat": "edge", "ph": "i", "s": "p", "pid": pid, "tid": 0,
+                "ts": us(edge.at), "args": {"fired": edge.fired}
+            })
+        return events
+
+class Tracer:
+    # keeps the traces of the last max_runs runs
+
+    def __init__(self, max_runs: int = 1000):
+        self.lock = threading.Lock()
+        self.runs = deque(maxlen=max_runs)
+        self.ids = itertools.count(1)
+
+    def start_run(self, prompt: str = None) -> RunTrace:
+        return RunTrace(next(self.ids), prompt)
+
+    def finish_run(self, trace: RunTrace, end_node: str = None):
+        trace.close(end_node)
+        with self.lock:
+            self.runs.append(trace)
+
+    def traces(self) -> List[RunTrace]:
+        with self.lock:
+            return list(self.runs)
+
+    def export_chrome(self, path: str, traces: List[RunTrace] = None):
+        traces = self.traces() if traces is None else traces
+        events = []
+        for pid, trace in enumerate(traces, start=1):
+            events.extend(trace.chrome_events(pid))
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def critical_path_report(self, traces: List[RunTrace] = None):
+        # how often each node is on the critical path and its mean share of the run
+        traces = self.traces() if traces is None else traces
+        report = {}
+        for trace in traces:
+            summary = trace.summary()
+            for name in summary["critical_path"]:
+                span = trace.spans[name]
+                entry = report.setdefault(name, {"runs": 0, "wall": 0.0, "queue_wait": 0.0})
+                entry["runs"] += 1
+                entry["wall"] += span.wall
+                entry["queue_wait"] += span.queue_wait
+        for entry in report.values():
+            entry["mean_wall"] = entry.pop("wall") / entry["runs"]
+            entry["mean_queue_wait"] = entry.pop("queue_wait") / entry["runs"]
+        return report
+
+_default_tracer = Tracer() if os.getenv("RAG_TRACE") else None
+
+def get_default_tracer() -> Tracer:
+    # None unless RAG_TRACE is set, graphs then run without tracing
+    return _default_tracer
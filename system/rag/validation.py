@@ -0,0 +1,28 @@
+import json
+import threading
+
+# Compiled JSON schema validators, one per distinct schema. jsonschema.validate()
+# checks the schema and builds a new validator on every call, a cached
+# validator only runs the instance checks. jsonschema is imported with the
+# first validator (see benchmarks/import_time.py).
+
+_validators = {}
+_validators_lock = threading.Lock()
+
+def schema_key(schema: dict) -> str:
+    return json.dumps(schema, sort_keys=True)
+
+def get_validator(schema: dict):
+    key = schema_key(schema)
+    validator = _validators.get(key)
+    if validator is None:
+        from jsonschema.validators import validator_for
+        cls = validator_for(schema)
+        cls.check_schema(schema)
+        with _validators_lock:
+            validator = _validators.setdefault(key, cls(schema))
+    return validator
+
+def validate(instance, schema: dict):
+    # raises jsonschema.ValidationError like jsonschema.validate()
+    get_validator(schema).validate(instance)
@@ -0,0 +1,33 @@
+import argparse
+from rag.memory import get_default_store
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Store memories for the memory lookup of the RAGged system')
+    parser.add_argument("texts", type=str, nargs="*", help='The memories to store')
+    parser.add_argument("-q", type=str, help='Search the memory instead of storing')
+    parser.add_argument("-k", type=int, help='Number of memories to return for -q', default=5)
+    parser.add_argument("--ann", action="store_true", help='Use and update the approximate (IVF) memory index')
+    parser.add_argument("--nprobe", type=int, help='Index lists to scan per query with --ann', default=8)
+    parser.add_argument("--lexical", action="store_true", help='Rank -q results by BM25 keyword match')
+    parser.add_argument("--hybrid", action="store_true", help='Fuse vector and BM25 rankings for -q')
+    args = parser.parse_args()
+
+    store = get_default_store()
+    if args.ann:
+        store.enable_ann(nprobe=args.nprobe)
+    if args.q:
+        if args.lexical:
+            hits = store.search_lexical(args.q, k=args.k)
+        elif args.hybrid:
+            hits = store.search_hybrid(args.q, k=args.k, exact=not args.ann)
+        else:
+            hits = store.search(args.q, k=args.k, exact=not args.ann)
+        for hit in hits:
+            print(f"{hit.score:.3f} {hit.text}")
+        # keeps the BM25 index a lexical search built for the next process
+        store.save_index()
+    else:
+        indexes = store.add(args.texts)
+        print(f"Stored {len(indexes)} memories, {len(store)} in total")
+        store.save_index()
@@ -1,24 +1,62 @@
 import argparse
-from rag.agents.hal9004_rag import get_graph
+import asyncio
 from rag.abs import NodeContext
+from rag.log import log
+from rag.models import CLIENTS
+from rag.registry import agent_names, build_agent
+from rag.tracing import Tracer
 
-graph_by_name = {
-    "hal9004_rag": get_graph
-}
+def print_event(event, streamed):
+    # answer tokens are printed as they arrive, the final result only if nothing was streamed
+    if event.kind == "token":
+        print(event.content, end="", flush=True)
+        streamed.append(event.content)
+    elif event.kind == "result":
+        if len(streamed) == 0:
+            print(event.content, flush=True)
+        else:
+            print(flush=True)
+    else:
+        print(f"[{event.kind}] {event.content}", flush=True)
+
+def stream_graph(graph, context):
+    streamed = []
+    for event in graph.stream(context=context):
+        print_event(event, streamed)
+
+async def astream_graph(graph, context):
+    streamed = []
+    try:
+        async for event in graph.astream(context=context):
+            print_event(event, streamed)
+    finally:
+        await CLIENTS.aclose()
 
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='Run the RAGged system')
     parser.add_argument("-p", type=str, help='The user prompt')
-    parser.add_argument("-a", type=str, help='The agent to use (e.g. hal9004_rag)', default="hal9004_rag")
+    parser.add_argument("-a", type=str, help='The agent to use (e.g. hal9004_rag)', default="hal9004_rag", choices=agent_names())
+    parser.add_argument("--use-async", action="store_true", help='Run the graph on the asyncio engine')
+    parser.add_argument("--trace", type=str, help='Write a Chrome trace of the run to this file')
     args = parser.parse_args()
     
 
-    graph = graph_by_name[args.a]()
+    graph = build_agent(args.a)
+    if args.trace:
+        graph.tracer = Tracer()
+    context = NodeContext(
+        message_history=[],
+        prompt=args.p
+    )
     
-    graph.run(
-        context=NodeContext(
-            message_history=[],
-            prompt=args.p
-        )
-    )
\ No newline at end of file
+    if args.use_async:
+        asyncio.run(astream_graph(graph, context))
+    else:
+        stream_graph(graph, context)
+
+    if args.trace:
+        graph.tracer.export_chrome(args.trace)
+        summary = graph.tracer.traces()[-1].summary()
+        log(f"*** Trace written to {args.trace}, total {summary['total']:.2f}s, "
+              f"critical path: {' -> '.join(summary['critical_path'])}")
\ No newline at end of file
@@ -0,0 +1,307 @@
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import signal
+import time
+from rag.abs import NodeContext
+from rag.limits import LIMITERS
+from rag.models import CLIENTS
+from rag.registry import agent_names, build_agent
+from rag.router import get_default_router
+
+# Resident agent server. The graphs of the agents in rag/registry.py are built
+# once and shared by all requests (runs keep their state in GraphRun), the
+# async client pools stay warm on the servers event loop. Every run streams its YieldMessages and
+# answer tokens as server-sent events, the last event is "result" or "error":
+#   python3 serve_agent.py --port 8080
+#   curl -N localhost:8080/v1/agents/hal9004_rag/runs -d '{"prompt": "How are you?"}'
+# SIGTERM/SIGINT drain the server: it stops accepting connections, answers
+# new runs with a 503 and waits up to --drain-timeout for the running ones.
+
+MAX_BODY = 1024 * 1024
+
+class HTTPError(Exception):
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    503: "Service Unavailable"
+}
+
+def encode_event(kind, content) -> bytes:
+    data = json.dumps(content, default=str)
+    return f"event: {kind}\ndata: {data}\n\n".encode("utf-8")
+
+class AgentServer:
+
+    def __init__(self, graphs: dict, max_runs: int = 64, drain_timeout: float = 30.0):
+        self.graphs = graphs
+        self.max_runs = max_runs
+        self.drain_timeout = drain_timeout
+        self.slots = asyncio.Semaphore(max_runs)
+        self.server = None
+        self.draining = False
+        # tasks of the runs in progress, drained on shutdown
+        self.active = set()
+        self.stats = {
+            "runs": 0,
+            "completed": 0,
+            "errors": 0,
+            "disconnected": 0,
+            "rejected": 0,
+            "queued": 0
+        }
+
+    async def start(self, host: str, port: int, prewarm: bool = True):
+        if prewarm:
+            await CLIENTS.aprewarm()
+        self.server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        return self
+
+    @property
+    def address(self):
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    # HTTP
+
+    async def read_request(self, reader):
+        head = await reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", 0) or 0)
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length > MAX_BODY:
+            raise HTTPError(413, f"Body larger than {MAX_BODY} bytes")
+        body = await reader.readexactly(length) if length > 0 else b""
+        return method, target.split("?", 1)[0], body
+
+    def write_head(self, writer, status, content_type, headers=None):
+        lines = [
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+            f"Content-Type: {content_type}",
+            # one request per connection, streams end when the connection closes
+            "Connection: close"
+        ]
+        for key, value in (headers or {}).items():
+            lines.append(f"{key}: {value}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+    async def send_json(self, writer, status, body, headers=None):
+        data = json.dumps(body, default=str).encode("utf-8")
+        self.write_head(writer, status, "application/json", {"Content-Length": len(data), **(headers or {})})
+        writer.write(data)
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        try:
+            method, path, body = await self.read_request(reader)
+            await self.dispatch(reader, writer, method, path, body)
+        except HTTPError as e:
+            await self.send_json(writer, e.status, {"error": e.message})
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, reader, writer, method, path, body):
+        parts = path.strip("/").split("/")
+        if path.rstrip("/") in ("/health", "/stats"):
+            if method != "GET":
+                raise HTTPError(405, f"{method} not allowed on {path}")
+            if path.rstrip("/") == "/health":
+                status = 503 if self.draining else 200
+                await self.send_json(writer, status, {"status": "draining" if self.draining else "ok"})
+            else:
+                await self.send_json(writer, 200, self.snapshot())
+        elif len(parts) == 4 and parts[:2] == ["v1", "agents"] and parts[3] == "runs":
+            if method != "POST":
+                raise HTTPError(405, f"{method} not allowed on {path}")
+            await self.run(reader, writer, parts[2], body)
+        else:
+            raise HTTPError(404, f"Unknown path {path}")
+
+    # runs
+
+    def parse_run(self, name, body):
+        graph = self.graphs.get(name)
+        if graph is None:
+            raise HTTPError(404, f"Unknown agent {name}, available: {', '.join(self.graphs)}")
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError as e:
+            raise HTTPError(400, f"Invalid JSON: {e}")
+        if not isinstance(request, dict) or not isinstance(request.get("prompt"), str):
+            raise HTTPError(400, 'Expected {"prompt": str, "message_history": [...], "stream": bool}')
+        context = NodeContext(
+            message_history=request.get("message_history") or [],
+            prompt=request["prompt"]
+        )
+        return graph, context, request.get("stream", True)
+
+    async def run(self, reader, writer, name, body):
+        graph, context, stream = self.parse_run(name, body)
+        if self.draining:
+            self.stats["rejected"] += 1
+            raise HTTPError(503, "Server is draining")
+        if self.slots.locked():
+            self.stats["queued"] += 1
+        async with self.slots:
+            # the server may have started draining while the request waited
+            if self.draining:
+                self.stats["rejected"] += 1
+                raise HTTPError(503, "Server is draining")
+            self.stats["runs"] += 1
+            if stream:
+                work = asyncio.create_task(self.stream_run(reader, writer, graph, context))
+            else:
+                work = asyncio.create_task(self.collect_run(writer, graph, context))
+            self.active.add(work)
+            try:
+                await asyncio.gather(work, return_exceptions=True)
+            finally:
+                self.active.discard(work)
+            # cancelled by the drain timeout
+            if work.cancelled():
+                if stream:
+                    writer.write(encode_event("error", "Server shut down"))
+                    await writer.drain()
+                else:
+                    raise HTTPError(503, "Server shut down")
+
+    async def stream_run(self, reader, writer, graph, context):
+        self.write_head(writer, 200, "text/event-stream", {"Cache-Control": "no-cache"})
+        await writer.drain()
+        # the client sends nothing after the request, EOF means it went away
+        disconnected = asyncio.create_task(reader.read(1))
+        streaming = asyncio.create_task(self.send_events(writer, graph, context))
+        try:
+            await asyncio.wait([disconnected, streaming], return_when=asyncio.FIRST_COMPLETED)
+            if not streaming.done():
+                # cancelling the stream cancels the node tasks of the run
+                self.stats["disconnected"] += 1
+                streaming.cancel()
+            await asyncio.gather(streaming, return_exceptions=True)
+        finally:
+            disconnected.cancel()
+            streaming.cancel()
+
+    async def send_events(self, writer, graph, context):
+        events = graph.astream(context)
+        started = time.perf_counter()
+        try:
+            async for event in events:
+                writer.write(encode_event(event.kind, event.content))
+                await writer.drain()
+            self.stats["completed"] += 1
+        except ConnectionError:
+            self.stats["disconnected"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"*** Run failed: {e!r}")
+            writer.write(encode_event("error", repr(e)))
+            await writer.drain()
+        finally:
+            await events.aclose()
+        writer.write(encode_event("done", {"elapsed": time.perf_counter() - started}))
+        await writer.drain()
+
+    async def collect_run(self, writer, graph, context):
+        result = None
+        messages = []
+        try:
+            async for event in graph.astream(context):
+                if event.kind == "result":
+                    result = event.content
+                elif event.kind != "token":
+                    messages.append({"kind": event.kind, "content": event.content})
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"*** Run failed: {e!r}")
+            await self.send_json(writer, 500, {"error": repr(e), "messages": messages})
+            return
+        self.stats["completed"] += 1
+        await self.send_json(writer, 200, {"result": result, "messages": messages})
+
+    def snapshot(self):
+        return {
+            "status": "draining" if self.draining else "ok",
+            "active": len(self.active),
+            "max_runs": self.max_runs,
+            "agents": list(self.graphs),
+            **self.stats,
+            "limiters": LIMITERS.metrics(),
+            "router": get_default_router().snapshot()
+        }
+
+    # shutdown
+
+    async def drain(self):
+        if self.draining:
+            return
+        self.draining = True
+        print(f"*** Draining, waiting for {len(self.active)} runs (up to {self.drain_timeout}s)")
+        self.server.close()
+        if len(self.active) > 0:
+            _, pending = await asyncio.wait(set(self.active), timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            if len(pending) > 0:
+                print(f"*** Cancelled {len(pending)} runs after the drain timeout")
+                await asyncio.wait(pending)
+        await CLIENTS.aclose()
+
+    async def serve(self):
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stopped.set)
+        print(f"*** Serving {', '.join(self.graphs)} on {self.address}")
+        await stopped.wait()
+        await self.drain()
+        print("*** Drained, bye")
+
+async def main(args):
+    # sync nodes run in the default executor, size it for the concurrent runs
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=args.threads))
+    agents = args.agents or agent_names()
+    graphs = {name: build_agent(name) for name in agents}
+    for graph in graphs.values():
+        graph.compile()
+    server = AgentServer(graphs, max_runs=args.max_runs, drain_timeout=args.drain_timeout)
+    await server.start(args.host, args.port, prewarm=not args.no_prewarm)
+    await server.serve()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Serve the RAGged agents over HTTP with server-sent events')
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--agents", type=str, nargs="*", choices=agent_names(), help='Agents to serve, all by default')
+    parser.add_argument("--max-runs", type=int, default=64, help='Concurrent runs, further requests wait')
+    parser.add_argument("--threads", type=int, default=64, help='Worker threads for sync nodes')
+    parser.add_argument("--drain-timeout", type=float, default=30.0, help='Seconds to wait for running runs on shutdown')
+    parser.add_argument("--no-prewarm", action="store_true", help='Skip opening backend connections at startup')
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
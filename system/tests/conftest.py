@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the packages live in system/, the scripts put it on sys.path the same way
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,124 @@
+import threading
+import time
+import pytest
+from rag.cache import CompletionCache, make_key
+from rag.search_cache import SearchCache, normalize_query
+from rag.semantic_cache import SemanticCache
+
+def test_completion_key_ignores_dict_order():
+    assert make_key({"model": "m", "messages": [1, 2]}) == make_key({"messages": [1, 2], "model": "m"})
+    assert make_key({"model": "m", "messages": [1, 2]}) != make_key({"model": "m", "messages": [2, 1]})
+
+def test_completion_cache_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "completions.sqlite3")
+    cache = CompletionCache(path=path)
+    cache.put("key", {"content": "hello"})
+    assert cache.get("key") == {"content": "hello"}
+    cache.close()
+
+    cache = CompletionCache(path=path)
+    assert cache.get("key") == {"content": "hello"}
+    assert cache.get("key") == {"content": "hello"}
+    assert cache.get("other") is None
+    assert cache.stats()["disk_hits"] == 1
+    assert cache.stats()["memory_hits"] == 1
+    assert cache.stats()["misses"] == 1
+    cache.close()
+
+def test_completion_cache_expires_entries(tmp_path):
+    cache = CompletionCache(path=str(tmp_path / "completions.sqlite3"), ttl=-1.0)
+    cache.put("key", {"content": "hello"})
+    assert cache.get("key") is None
+    cache.put("key", {"content": "hello"}, ttl=60.0)
+    assert cache.get("key") == {"content": "hello"}
+    cache.close()
+
+def test_completion_cache_evicts_least_recently_used():
+    cache = CompletionCache(max_bytes=60)
+    cache.put("a", {"content": "a" * 10})
+    cache.put("b", {"content": "b" * 10})
+    cache.get("a")
+    cache.put("c", {"content": "c" * 10})
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+def test_semantic_cache_matches_near_identical_prompts():
+    cache = SemanticCache(threshold=0.9)
+    assert cache.lookup("What is the weather in Aachen today?")[0] is None
+    cache.put("What is the weather in Aachen today?", {"query": "weather Aachen"})
+    value, score, slot = cache.lookup("what is the weather in aachen today")
+    assert value == {"query": "weather Aachen"}
+    assert score >= 0.9
+    assert cache.lookup("Remind me of my dentist appointment")[0] is None
+    assert cache.stats()["hits"] == 1
+
+def test_semantic_cache_verification_replaces_false_hits():
+    cache = SemanticCache(threshold=0.9)
+    cache.put("weather in Aachen", {"query": "Aachen"})
+    value, _, slot = cache.lookup("weather in Aachen")
+    cache.record_verification(slot, value, {"query": "Aachen, Germany"})
+    assert cache.lookup("weather in Aachen")[0] == {"query": "Aachen, Germany"}
+    assert cache.stats()["false_hit_rate"] == 1.0
+
+def test_semantic_cache_overwrites_oldest_entry_when_full():
+    cache = SemanticCache(threshold=0.9, capacity=2)
+    for prompt in ("first prompt about cats", "second prompt about dogs", "third prompt about birds"):
+        cache.put(prompt, prompt)
+    assert cache.lookup("first prompt about cats")[0] is None
+    assert cache.lookup("third prompt about birds")[0] == "third prompt about birds"
+    assert cache.stats()["entries"] == 2
+
+def test_search_cache_normalizes_queries():
+    assert normalize_query("  Weather in  Aachen today? ") == "weather in aachen today"
+    cache = SearchCache()
+    calls = []
+    fetch = lambda: calls.append(1) or {"organic_results": []}
+    cache.get("Weather in Aachen?", fetch)
+    cache.get("weather in aachen", fetch)
+    assert len(calls) == 1
+
+def test_search_cache_coalesces_concurrent_misses():
+    cache = SearchCache()
+    entered = threading.Event()
+    proceed = threading.Event()
+
+    def fetch():
+        entered.set()
+        proceed.wait(5)
+        return {"organic_results": ["result"]}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get("query", fetch)))
+    leader.start()
+    entered.wait(5)
+    follower = threading.Thread(target=lambda: results.append(cache.get("query", fetch)))
+    follower.start()
+    while cache.stats()["coalesced"] == 0:
+        time.sleep(0.01)
+    proceed.set()
+    leader.join(5)
+    follower.join(5)
+    assert results == [{"organic_results": ["result"]}] * 2
+    assert cache.stats()["upstream_calls"] == 1
+
+def test_search_cache_does_not_store_errors():
+    cache = SearchCache()
+
+    def failing():
+        raise RuntimeError("quota exceeded")
+
+    with pytest.raises(RuntimeError):
+        cache.get("query", failing)
+    assert cache.get("query", lambda: {"organic_results": []}) == {"organic_results": []}
+    assert cache.stats()["upstream_calls"] == 2
+
+def test_search_cache_serves_stale_entries_while_refreshing():
+    cache = SearchCache(ttl=0.0, stale_ttl=60.0)
+    assert cache.get("query", lambda: "old") == "old"
+    assert cache.get("query", lambda: "new") == "old"
+    while cache.stats()["upstream_calls"] < 2 or len(cache.in_flight) > 0:
+        time.sleep(0.01)
+    assert cache.entries["query"][0] == "new"
+    assert cache.stats()["stale_hits"] == 1
@@ -0,0 +1,125 @@
+import asyncio
+import time
+import pytest
+from rag.abs import RagGraph, RagNode, RagEdge, RagNodeResult, NodeContext, NodeCancelled, ResultRetracted
+from rag.policy import EvaluationPolicy
+
+class Step(RagNode):
+    # answers after delay seconds unless cancelled, optionally releases a result first
+
+    def create(self, response=None, delay: float = 0.0, release=None, forward: bool = True):
+        self.response = response
+        self.delay = delay
+        self.release = release
+        self.forward = forward
+        self.calls = 0
+        self.started_at = None
+        self.returned_at = None
+        self.context = None
+
+    def answer(self, context):
+        return self.response
+
+    def run(self, context: NodeContext):
+        self.calls += 1
+        self.started_at = time.perf_counter()
+        self.context = context
+        if self.release is not None:
+            context.release_result(RagNodeResult(node_name=self.name, response=self.release))
+        if context.cancel_event.wait(self.delay):
+            raise NodeCancelled(self.name)
+        self.returned_at = time.perf_counter()
+        return RagNodeResult(node_name=self.name, response=self.answer(context), forward=self.forward)
+
+class Join(Step):
+
+    def answer(self, context):
+        return {name: res.response for name, res in context.parent_results.items()}
+
+def route(wanted):
+    def check(edge, context: NodeContext):
+        edge.disabled = context.all_results["Gate"].response != wanted
+    return check
+
+def build(spec: Step, gate: str, gate_delay: float = 0.0):
+    # Start -> Spec ----------> Join (all) -> Answer [end]
+    #       -> Gate -- tool --^
+    #               -- casual -> Casual [end]
+    nodes = {
+        "Start": RagNode("Start", start_node=True),
+        "Spec": spec,
+        "Gate": Step("Gate", response=gate, delay=gate_delay),
+        "Join": Join("Join", join="all"),
+        "Answer": Join("Answer", end_node=True),
+        "Casual": Step("Casual", end_node=True, response="hello")
+    }
+    edges = [
+        RagEdge(start="Start", end="Spec"),
+        RagEdge(start="Start", end="Gate"),
+        RagEdge(start="Spec", end="Join"),
+        RagEdge(start="Gate", end="Join", update_overwrite=route("tool")),
+        RagEdge(start="Gate", end="Casual", update_overwrite=route("casual")),
+        RagEdge(start="Join", end="Answer")
+    ]
+    return RagGraph(list(nodes.values()), edges, policy=EvaluationPolicy()), nodes
+
+def run(graph, engine):
+    context = NodeContext([], "prompt")
+    if engine == "async":
+        return asyncio.run(graph.arun_dataflow(context))
+    return graph.run_dataflow(context)
+
+engines = pytest.mark.parametrize("engine", ["sync", "async"])
+
+@engines
+def test_join_all_waits_for_every_input(engine):
+    graph, nodes = build(Step("Spec", response="query", speculative=True), "tool")
+    context = run(graph, engine)
+    assert graph.get_final_result(context) == {"Join": {"Spec": "query", "Gate": "tool"}}
+    assert nodes["Casual"].calls == 0
+
+@engines
+def test_losing_speculative_branch_is_cancelled(engine):
+    graph, nodes = build(Step("Spec", response="query", delay=5.0, speculative=True), "casual")
+    started = time.perf_counter()
+    context = run(graph, engine)
+    assert time.perf_counter() - started < 2.0
+    assert graph.get_final_result(context) == "hello"
+    assert nodes["Spec"].context.is_cancelled()
+    assert "Spec" not in context.all_results
+
+@engines
+def test_lazy_node_runs_only_when_demanded(engine):
+    graph, nodes = build(Step("Spec", response="query", policy="lazy"), "casual")
+    run(graph, engine)
+    assert nodes["Spec"].calls == 0
+
+    graph, nodes = build(Step("Spec", response="query", policy="lazy"), "tool")
+    context = run(graph, engine)
+    assert nodes["Spec"].calls == 1
+    assert graph.get_final_result(context) == {"Join": {"Spec": "query", "Gate": "tool"}}
+
+@engines
+def test_released_result_starts_consumers_early(engine):
+    spec = Step("Spec", response="full", release="partial", delay=0.3, speculative=True)
+    graph, nodes = build(spec, "tool")
+    context = run(graph, engine)
+    assert graph.get_final_result(context) == {"Join": {"Spec": "partial", "Gate": "tool"}}
+    assert nodes["Join"].started_at < spec.returned_at
+
+@engines
+def test_released_node_of_losing_branch_is_cancelled(engine):
+    spec = Step("Spec", response="full", release="partial", delay=5.0, speculative=True)
+    graph, nodes = build(spec, "casual", gate_delay=0.1)
+    started = time.perf_counter()
+    context = run(graph, engine)
+    assert time.perf_counter() - started < 2.0
+    assert graph.get_final_result(context) == "hello"
+    assert spec.context.is_cancelled()
+
+@engines
+def test_invalid_full_answer_retracts_released_result(engine):
+    spec = Step("Spec", response="full", release="partial", delay=0.2, forward=False, speculative=True)
+    graph, _ = build(spec, "tool")
+    with pytest.raises(ResultRetracted):
+        run(graph, engine)
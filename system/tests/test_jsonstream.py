@@ -0,0 +1,60 @@
+import json
+from types import SimpleNamespace
+from rag.jsonstream import IncrementalJSONParser
+from rag.nodes.extractor import FieldRelease
+from rag.validation import get_validator
+
+def feed_all(parser, chunks):
+    return [parser.feed(chunk) for chunk in chunks]
+
+def test_fields_are_reported_once_their_value_is_complete():
+    parser = IncrementalJSONParser()
+    completed = feed_all(parser, ['```json\n{"query": "weather in Aa', 'chen", "reason', 'ing": "because', '"}'])
+    assert completed == [{}, {"query": "weather in Aachen"}, {}, {"reasoning": "because"}]
+    assert parser.done
+
+def test_nested_values_escapes_and_scalars():
+    parser = IncrementalJSONParser()
+    text = '{"intends": ["web_search", "casual"], "filter": {"a": [1, {"b": "}"}]}, "text": "say \\"hi\\"", "n": 12, "ok": true, "none": null}'
+    completed = {}
+    for char in text:
+        completed.update(parser.feed(char))
+    assert completed == json.loads(text)
+    assert parser.fields == json.loads(text)
+
+def test_numbers_end_at_the_next_separator():
+    parser = IncrementalJSONParser()
+    assert parser.feed('{"n": 12') == {}
+    assert parser.feed('3, ') == {"n": 123}
+
+def test_malformed_value_stops_the_parser():
+    parser = IncrementalJSONParser()
+    parser.feed('{"n": 12x, "query": "weather"}')
+    assert parser.failed
+    assert parser.feed('{"query": "weather"}') == {}
+
+schema = {
+    "type": "object",
+    "properties": {
+        "query": {"type": "string"},
+        "reasoning": {"type": "string"}
+    }
+}
+
+def field_release(release_fields):
+    validator = get_validator(schema)
+    return FieldRelease(SimpleNamespace(release_fields=release_fields, get_validator=lambda: validator))
+
+def test_field_release_waits_for_every_release_field():
+    watcher = field_release(["query"])
+    assert watcher.feed('{"reasoning": "the user asks about the wea') is None
+    assert watcher.feed('ther", "query": "weather') is None
+    completion = watcher.feed(' Aachen", "extra"')
+    assert completion.released
+    assert json.loads(completion.content) == {"reasoning": "the user asks about the weather", "query": "weather Aachen"}
+
+def test_field_release_does_not_release_invalid_fields():
+    watcher = field_release(["query"])
+    assert watcher.feed('{"query": 42, "reasoning": "') is None
+    assert watcher.parser.failed
+    assert watcher.feed('more"}') is None
@@ -0,0 +1,107 @@
+import threading
+import time
+import httpx
+import openai
+import pytest
+from rag.limits import BackendLimiter
+
+def rate_limit_error(retry_after=None):
+    headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "http://backend/v1/chat/completions"))
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+def test_sporadic_overload_keeps_the_limit():
+    limiter = BackendLimiter("test", max_concurrency=16)
+    for _ in range(3):
+        limiter.on_overload(limiter.decreases)
+        for _ in range(20):
+            limiter.on_success()
+    assert limiter.limit == 16.0
+    assert limiter.decreases == 0
+
+def test_sustained_overload_decreases_once_per_window():
+    limiter = BackendLimiter("test", max_concurrency=16)
+    window = limiter.decreases
+    # a burst of calls sent at the same limit
+    for _ in range(20):
+        limiter.on_overload(window)
+    assert limiter.limit == 8.0
+    assert limiter.decreases == 1
+    limiter.on_overload(limiter.decreases)
+    assert limiter.limit == 4.0
+    for _ in range(10):
+        limiter.on_overload(limiter.decreases)
+    assert limiter.limit == 1.0
+
+def test_success_adds_one_slot_per_window():
+    limiter = BackendLimiter("test", max_concurrency=16, initial_concurrency=4)
+    for _ in range(4):
+        limiter.on_success()
+    assert 4.9 < limiter.limit < 5.0
+    for _ in range(1000):
+        limiter.on_success()
+    assert limiter.limit == 16.0
+
+def test_retry_after_only_delays_the_rejected_call():
+    limiter = BackendLimiter("test", max_concurrency=4)
+    attempts = []
+
+    def rejected_once():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise rate_limit_error(retry_after=0.5)
+        return "retried"
+
+    results = {}
+    thread = threading.Thread(target=lambda: results.setdefault("rejected", limiter.call(rejected_once)))
+    thread.start()
+    while len(attempts) == 0:
+        time.sleep(0.01)
+    started = time.monotonic()
+    assert limiter.call(lambda: "other") == "other"
+    assert time.monotonic() - started < 0.2
+    thread.join(5)
+    assert results["rejected"] == "retried"
+    assert attempts[1] - attempts[0] >= 0.5
+    assert limiter.stats["rate_limited"] == 1
+    assert limiter.stats["retries"] == 1
+
+def test_calls_give_up_after_max_retries():
+    limiter = BackendLimiter("test", max_retries=2, base_backoff=0.0)
+    attempts = []
+
+    def always_rejected():
+        attempts.append(1)
+        raise rate_limit_error()
+
+    with pytest.raises(openai.RateLimitError):
+        limiter.call(always_rejected)
+    assert len(attempts) == 3
+    assert limiter.in_flight == 0
+
+def test_calls_beyond_the_limit_wait_in_order():
+    limiter = BackendLimiter("test", max_concurrency=1)
+    limiter.acquire()
+    order = []
+    threads = []
+    for i in range(3):
+        threads.append(threading.Thread(target=lambda i=i: limiter.call(lambda: order.append(i))))
+        threads[-1].start()
+        while len(limiter.waiters) < i + 1:
+            time.sleep(0.01)
+    limiter.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == [0, 1, 2]
+    assert limiter.stats["peak_queue_depth"] == 3
+
+def test_settle_charges_the_reported_usage():
+    limiter = BackendLimiter("test", tpm=6000)
+    assert limiter.throttle(100) == 0.0
+    before = limiter.tokens.tokens
+    limiter.settle(100, 250)
+    assert limiter.tokens.tokens == pytest.approx(before - 150, abs=1.0)
+    limiter.settle(100, None)
+    assert limiter.stats["settled"] == 1
+    assert limiter.stats["unsettled"] == 1
+    assert limiter.stats["settled_tokens"] == 150
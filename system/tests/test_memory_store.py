@@ -0,0 +1,101 @@
+import os
+import numpy as np
+from rag.memory.store import MemoryStore
+
+texts = [
+    "The dentist appointment is on Tuesday at nine",
+    "My sister lives in Aachen near the cathedral",
+    "Buy oat milk and coffee beans on the way home",
+    "The car needs new winter tires before November",
+    "Aachen cathedral tour tickets are in the drawer"
+]
+
+def test_exact_search_finds_the_closest_text():
+    store = MemoryStore()
+    assert store.add(texts) == [0, 1, 2, 3, 4]
+    hits = store.search("when is the dentist appointment", k=2, exact=True)
+    assert hits[0].text == texts[0]
+    assert hits[0].score >= hits[1].score
+
+def test_lexical_index_is_built_on_first_lexical_search():
+    store = MemoryStore()
+    store.add(texts[:3])
+    assert store.lexical is None
+    assert [hit.index for hit in store.search_lexical("oat milk", k=1)] == [2]
+    # rows added after the first lexical search are indexed too
+    store.add(texts[3:])
+    assert [hit.index for hit in store.search_lexical("winter tires", k=1)] == [3]
+
+def test_hybrid_search_fuses_both_rankings():
+    store = MemoryStore()
+    store.add(texts)
+    hits = store.search_hybrid("Aachen cathedral", k=3, rrf_k=60)
+    assert {hits[0].index, hits[1].index} == {1, 4}
+    assert [hit.score for hit in hits] == sorted((hit.score for hit in hits), reverse=True)
+    # ranked in both lists, at best first in both
+    assert hits[0].score <= 2 / 61
+
+def test_ivf_search_matches_exact_search():
+    rng = np.random.default_rng(0)
+    words = ["apple", "river", "engine", "violet", "market", "planet", "castle", "forest", "signal", "garden"]
+    rows = [" ".join(rng.choice(words, 5)) + f" note {i}" for i in range(300)]
+    store = MemoryStore()
+    store.add(rows)
+    store.enable_ann(nlist=8, train_size=100)
+    assert store.index is not None and store.index.count == 300
+    query = rows[42]
+    exact = store.search(query, k=5, exact=True)
+    approximate = store.search(query, k=5, nprobe=8)
+    assert [hit.index for hit in approximate] == [hit.index for hit in exact]
+
+def test_reopened_store_keeps_rows(tmp_path):
+    path = str(tmp_path / "memory")
+    store = MemoryStore(path=path)
+    store.add(texts, timestamps=[1.0, 2.0, 3.0, 4.0, 5.0])
+    store = MemoryStore(path=path)
+    assert len(store) == 5
+    assert store.get_text(4) == texts[4]
+    assert store.search(texts[2], k=1)[0].timestamp == 3.0
+
+def test_uncommitted_bytes_are_truncated_on_open(tmp_path):
+    path = str(tmp_path / "memory")
+    store = MemoryStore(path=path)
+    store.add(texts[:2])
+    # an add() interrupted before the offsets file was written
+    for name in ("vectors.f32", "timestamps.f64", "texts.bin"):
+        with open(os.path.join(path, name), "ab") as f:
+            f.write(b"\x01" * 12)
+    store = MemoryStore(path=path)
+    assert len(store) == 2
+    assert os.path.getsize(os.path.join(path, "texts.bin")) == len((texts[0] + texts[1]).encode("utf-8"))
+    store.add(texts[2:3])
+    assert store.get_text(2) == texts[2]
+    assert store.search(texts[2], k=1)[0].index == 2
+
+def drop_last_row(path):
+    # the index was saved with rows that a later open no longer has
+    offsets = os.path.join(path, "offsets.i64")
+    os.truncate(offsets, os.path.getsize(offsets) - 8)
+
+def test_lexical_index_with_more_rows_than_the_store_is_rebuilt(tmp_path):
+    path = str(tmp_path / "memory")
+    store = MemoryStore(path=path)
+    store.add(texts)
+    store.search_lexical("cathedral")
+    store.save_index()
+    drop_last_row(path)
+    store = MemoryStore(path=path)
+    assert len(store) == 4
+    assert [hit.index for hit in store.search_lexical("cathedral tickets drawer", k=5)] == [1]
+
+def test_ivf_index_with_more_rows_than_the_store_is_retrained(tmp_path):
+    path = str(tmp_path / "memory")
+    store = MemoryStore(path=path)
+    store.add(texts)
+    store.enable_ann(nlist=2, train_size=3)
+    store.save_index()
+    drop_last_row(path)
+    store = MemoryStore(path=path)
+    store.enable_ann(nlist=2, train_size=3)
+    assert store.index.count == 4
+    assert all(hit.index < 4 for hit in store.search("Aachen cathedral", k=5, nprobe=2))